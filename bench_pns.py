@@ -0,0 +1,373 @@
+import glob
+import time
+import tracemalloc
+import numpy as np
+import soundfile as sf
+from pns.noise_estimator import ImcraNoiseEstimator
+from scipy.special import expn
+from pns.suppression_gain import OmlsaGain, Features, ExpintTable, suppression_gains
+from pns.noise_estimator import noise_estimators
+from pns.noise_suppressor import NoiseSuppressor, stft_sizes, latency_presets
+from pns.spectral_processor import SpectralProcessor
+from pns import numba_backend
+from pns_reference import ReferenceImcraNoiseEstimator, ReferenceOmlsaGain, ReferenceSuppressor
+
+NOISY_FILES = sorted(glob.glob("data/*_sn*[0-9].wav"))
+
+
+def power_frames(x, fft_size=512, frame_size=160):
+    win = np.hamming(fft_size)
+    return [np.abs(np.fft.fft(win * x[k : k + fft_size])[:fft_size // 2 + 1])**2
+            for k in range(0, len(x) - fft_size, frame_size)]
+
+
+def corpus_features():
+    '''Signal power, eta_2term and noise power per frame, as seen in the reference pipeline.'''
+    frames = []
+    for input_file in NOISY_FILES:
+        noisy_wav, _ = sf.read(input_file)
+        estimator = ReferenceImcraNoiseEstimator()
+        gain = ReferenceOmlsaGain()
+        for Ya2 in power_frames(noisy_wav):
+            eta_2term = gain.eta_2term
+            noise_power = estimator.update(Ya2.copy(), eta_2term)
+            frames.append((Ya2, eta_2term, noise_power))
+            gain.update(Ya2, noise_power)
+    return frames
+
+
+def frame_loop(noise_suppressor, x):
+    '''Output of process_frame over the whole frames of x.'''
+    frame_size = noise_suppressor.get_frame_size()
+    return np.concatenate([noise_suppressor.process_frame(x[k : k + frame_size])
+                           for k in range(0, len(x) - frame_size + 1, frame_size)])
+
+
+def bench_estimator(frames, repeat=3):
+    results = {}
+    for name, update in [("reference", lambda est, Ya2, eta: est.update(Ya2.copy(), eta)),
+                         ("vectorized", lambda est, Ya2, eta: est.update(Features(signal_power=Ya2.copy(), eta_2term=eta)))]:
+        best = float("inf")
+        for _ in range(repeat):
+            estimator = ReferenceImcraNoiseEstimator() if name == "reference" else ImcraNoiseEstimator()
+            start = time.perf_counter()
+            for Ya2, eta_2term, _ in frames:
+                update(estimator, Ya2, eta_2term)
+            best = min(best, time.perf_counter() - start)
+        results[name] = len(frames) / best
+    return results
+
+
+def bench_gain(frames, repeat=3):
+    results = {}
+    for name, update in [("reference", lambda gain, Ya2, noise: gain.update(Ya2, noise)),
+                         ("vectorized", lambda gain, Ya2, noise: gain.update(Features(signal_power=Ya2, noise_power=noise)))]:
+        best = float("inf")
+        for _ in range(repeat):
+            gain = ReferenceOmlsaGain() if name == "reference" else OmlsaGain(16000, 512)
+            start = time.perf_counter()
+            for Ya2, _, noise_power in frames:
+                update(gain, Ya2, noise_power)
+            best = min(best, time.perf_counter() - start)
+        results[name] = len(frames) / best
+    return results
+
+
+def bench_expint(frames, repeat=3):
+    '''exp(0.5*E1(v)) per frame with expn and with ExpintTable, and OmlsaGain.update frames/s in both modes.'''
+    gain = OmlsaGain(16000, 512)
+    vs = []
+    for Ya2, _, noise_power in frames:
+        gain.update(Features(signal_power=Ya2, noise_power=noise_power))
+        vs.append((gain.v.copy(), (gain.v > 0) & (gain.v <= 5)))
+    out, scratch = np.empty(gain.M21), np.empty(gain.M21)
+    table = ExpintTable()
+
+    def exact(v, idx):
+        expn(1, v, out=out, where=idx)
+        np.multiply(out, 0.5, out=out, where=idx)
+        np.exp(out, out=out, where=idx)
+
+    results = {}
+    for name, evaluate in [("expn", exact), ("table", lambda v, idx: table(v, out, idx, scratch))]:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for v, idx in vs:
+                evaluate(v, idx)
+            best = min(best, time.perf_counter() - start)
+        results[name] = len(vs) / best
+    for name, expint_table in [("gain exact", False), ("gain table", True)]:
+        best = float("inf")
+        for _ in range(repeat):
+            gain = OmlsaGain(16000, 512, expint_table=expint_table)
+            start = time.perf_counter()
+            for Ya2, _, noise_power in frames:
+                gain.update(Features(signal_power=Ya2, noise_power=noise_power))
+            best = min(best, time.perf_counter() - start)
+        results[name] = len(frames) / best
+    return results
+
+
+def bench_offline(repeat=3):
+    '''Corpus throughput of a process_frame loop and of process_signal, in seconds of audio per second.'''
+    signals = [sf.read(input_file) for input_file in NOISY_FILES]
+    duration = sum(len(x) / fs for x, fs in signals)
+
+    results = {}
+    backends = ["numpy", "numba"] if numba_backend.available else ["numpy"]
+    for backend in backends:
+        for name, run in [("process_frame", frame_loop),
+                          ("process_signal", lambda noise_suppressor, x: noise_suppressor.process_signal(x))]:
+            # the first run of the numba backend loads or compiles the kernel
+            NoiseSuppressor(16000, backend=backend).process_signal(signals[0][0][:1600])
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for x, fs in signals:
+                    run(NoiseSuppressor(fs, backend=backend), x)
+                best = min(best, time.perf_counter() - start)
+            results[f"{name} {backend}"] = duration / best
+    return results
+
+
+def bench_fast_path(repeat=10):
+    '''
+    process_frame throughput over the corpus with and without the noise-only
+    fast path, the fraction of frames it took, the largest output difference
+    and the mean wide band PESQ of both.
+    '''
+    from pesq import pesq
+    signals = [sf.read(input_file) for input_file in NOISY_FILES]
+    cleans = [sf.read(input_file.split("_")[0] + ".wav")[0] for input_file in NOISY_FILES]
+    n_frames = sum(len(x) // 160 for x, _ in signals)
+
+    results = {}
+    backends = ["numpy", "numba"] if numba_backend.available else ["numpy"]
+    for backend in backends:
+        NoiseSuppressor(16000, backend=backend).process_signal(signals[0][0][:1600])
+        best = {False: float("inf"), True: float("inf")}
+        outputs = {}
+        # the two modes alternate so that both see the same machine load
+        for _ in range(repeat):
+            for fast_path in best:
+                start = time.perf_counter()
+                suppressors = [NoiseSuppressor(fs, backend=backend, fast_path=fast_path) for _, fs in signals]
+                outputs[fast_path] = [frame_loop(noise_suppressor, x)
+                                      for noise_suppressor, (x, _) in zip(suppressors, signals)]
+                best[fast_path] = min(best[fast_path], time.perf_counter() - start)
+        noise_only = sum(noise_suppressor.suppression_gain.noise_only_frames for noise_suppressor in suppressors)
+        for fast_path, ys in outputs.items():
+            scores = [pesq(fs, clean[:len(y)], y[:len(clean)], "wb")
+                      for clean, y, (_, fs) in zip(cleans, ys, signals)]
+            results[f"{backend} fast_path={fast_path}"] = {"frames/s": n_frames / best[fast_path], "PESQ": np.mean(scores)}
+        results[f"{backend} fast_path=True"]["noise-only %"] = 100 * noise_only / n_frames
+        results[f"{backend} fast_path=True"]["max |dy|"] = max(
+            np.max(np.abs(a - b)) for a, b in zip(outputs[False], outputs[True]))
+    return results
+
+
+def bench_tiers(repeat=5):
+    '''
+    Cost of process_frame in microseconds per frame and mean wide band PESQ
+    over the corpus for every noise estimator and suppression gain.
+    '''
+    from pesq import pesq
+    signals = [sf.read(input_file) for input_file in NOISY_FILES]
+    cleans = [sf.read(input_file.split("_")[0] + ".wav")[0] for input_file in NOISY_FILES]
+    n_frames = sum(len(x) // 160 for x, _ in signals)
+
+    results = {"noisy input": {"us/frame": 0.0, "PESQ": np.mean([
+        pesq(fs, clean[:len(x)], x[:len(clean)], "wb") for clean, (x, fs) in zip(cleans, signals)])}}
+    for estimator in noise_estimators:
+        for gain in suppression_gains:
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                ys = [frame_loop(NoiseSuppressor(fs, noise_estimator=estimator, suppression_gain=gain), x)
+                      for x, fs in signals]
+                best = min(best, time.perf_counter() - start)
+            scores = [pesq(fs, clean[:len(y)], y[:len(clean)], "wb")
+                      for clean, y, (_, fs) in zip(cleans, ys, signals)]
+            results[f"{estimator} + {gain}"] = {"us/frame": 1e6 * best / n_frames, "PESQ": np.mean(scores)}
+    return results
+
+
+def bench_latency_presets(repeat=5):
+    '''
+    Latency, process_frame cost per frame and per second of audio (real time
+    factor), and mean wide band PESQ over the corpus for every latency preset.
+    '''
+    from pesq import pesq
+    signals = [sf.read(input_file) for input_file in NOISY_FILES]
+    cleans = [sf.read(input_file.split("_")[0] + ".wav")[0] for input_file in NOISY_FILES]
+    seconds = sum(len(x) / fs for x, fs in signals)
+    results = {}
+    for name, (window_ms, hop_ms) in latency_presets.items():
+        best = float("inf")
+        for _ in range(repeat):
+            ys = []
+            elapsed = 0.0
+            for x, fs in signals:
+                fft_size, frame_size = stft_sizes(fs, window_ms, hop_ms)
+                noise_suppressor = NoiseSuppressor(fs, fft_size=fft_size, frame_size=frame_size)
+                yout = np.empty(frame_size)
+                frames = [x[k : k + frame_size] for k in range(0, len(x) - frame_size + 1, frame_size)]
+                y = []
+                start = time.perf_counter()
+                for frame in frames:
+                    y.append(noise_suppressor.process_frame(frame, out=yout).copy())
+                elapsed += time.perf_counter() - start
+                # drop the delay, so that PESQ compares aligned signals
+                ys.append(np.concatenate(y)[noise_suppressor.get_delay():])
+            best = min(best, elapsed)
+        n_frames = sum(len(x) // stft_sizes(fs, window_ms, hop_ms)[1] for x, fs in signals)
+        scores = [pesq(fs, clean[:len(y)], y[:len(clean)], "wb")
+                  for clean, y, (_, fs) in zip(cleans, ys, signals)]
+        results[name] = {"latency ms": 1000 * noise_suppressor.get_latency(), "us/frame": 1e6 * best / n_frames,
+                         "RTF": best / seconds, "PESQ": np.mean(scores)}
+    return results
+
+
+def bench_spectral(repeat=10):
+    '''
+    Microseconds per frame of NoiseSuppressor.process_frame and of
+    SpectralProcessor.process on the power spectra of the same frames, which
+    a caller with its own STFT already has: the difference is the analysis
+    FFT and the synthesis inverse FFT and overlap-add.
+    '''
+    noisy_wav, fs = sf.read(NOISY_FILES[0])
+    frames = [noisy_wav[k : k + 160] for k in range(0, len(noisy_wav) - 160, 160)]
+    power = np.array(list(power_frames(noisy_wav)))
+    rows = list(power)
+    yout = np.empty(160)
+    best = {"process_frame": float("inf"), "spectral frame": float("inf"), "spectral block": float("inf")}
+    for _ in range(repeat):
+        noise_suppressor = NoiseSuppressor(fs)
+        start = time.perf_counter()
+        for frame in frames:
+            noise_suppressor.process_frame(frame, out=yout)
+        best["process_frame"] = min(best["process_frame"], (time.perf_counter() - start) / len(frames))
+        processor = SpectralProcessor(fs, 512, 160)
+        start = time.perf_counter()
+        for row in rows:
+            processor.process(row)
+        best["spectral frame"] = min(best["spectral frame"], (time.perf_counter() - start) / len(rows))
+        processor = SpectralProcessor(fs, 512, 160)
+        start = time.perf_counter()
+        processor.process(power)
+        best["spectral block"] = min(best["spectral block"], (time.perf_counter() - start) / len(rows))
+    return {name: 1e6 * seconds for name, seconds in best.items()}
+
+
+def bench_allocations(n_warmup=200, n_frames=1000):
+    '''Bytes and blocks allocated per frame by process_frame in steady state, traced with tracemalloc.'''
+    noisy_wav, fs = sf.read(NOISY_FILES[0])
+    frames = [noisy_wav[k : k + 160] for k in range(0, len(noisy_wav) - 160, 160)]
+    results = {}
+    for name, noise_suppressor in [("reference", ReferenceSuppressor()), ("preallocated", NoiseSuppressor(fs))]:
+        if name == "reference":
+            process = noise_suppressor.process_frame
+        else:
+            yout = np.empty(noise_suppressor.get_frame_size())
+            process = lambda frame: noise_suppressor.process_frame(frame, out=yout)
+        for k in range(n_warmup):
+            process(frames[k % len(frames)])
+        tracemalloc.start()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        for k in range(n_warmup, n_warmup + n_frames):
+            process(frames[k % len(frames)])
+        _, peak = tracemalloc.get_traced_memory()
+        stats = tracemalloc.take_snapshot().compare_to(snapshot, "filename")
+        tracemalloc.stop()
+        # allocations made and freed inside the loop are counted through the peak,
+        # allocations that survive it through the snapshot difference
+        results[name] = {"bytes transient peak": peak - base,
+                         "bytes retained per frame": sum(stat.size_diff for stat in stats) / n_frames}
+    return results
+
+
+def bench_instrumentation(repeat=10):
+    '''process_frame frames/s without stats, after enable_stats and disable_stats, and with stats.'''
+    noisy_wav, fs = sf.read(NOISY_FILES[0])
+    frames = [noisy_wav[k : k + 160] for k in range(0, len(noisy_wav) - 160, 160)]
+
+    def plain(noise_suppressor):
+        return noise_suppressor
+
+    def disabled(noise_suppressor):
+        noise_suppressor.enable_stats()
+        noise_suppressor.disable_stats()
+        return noise_suppressor
+
+    def enabled(noise_suppressor):
+        noise_suppressor.enable_stats()
+        return noise_suppressor
+
+    # interleaved runs, so that drift of the machine affects all variants alike
+    best = {"plain": float("inf"), "disabled": float("inf"), "enabled": float("inf")}
+    yout = np.empty(160)
+    for _ in range(repeat):
+        for name, setup in [("plain", plain), ("disabled", disabled), ("enabled", enabled)]:
+            noise_suppressor = setup(NoiseSuppressor(fs))
+            start = time.perf_counter()
+            for frame in frames:
+                noise_suppressor.process_frame(frame, out=yout)
+            best[name] = min(best[name], time.perf_counter() - start)
+    return {name: len(frames) / seconds for name, seconds in best.items()}
+
+
+def report(title, results):
+    print(title)
+    for name, fps in results.items():
+        print(f"  {name:<12s}{fps:10.0f} frames/s")
+    print(f"  speed-up    {results['vectorized'] / results['reference']:10.1f}x")
+
+
+if __name__ == "__main__":
+    frames = corpus_features()
+    report(f"ImcraNoiseEstimator.update over {len(frames)} frames", bench_estimator(frames))
+    report(f"OmlsaGain.update over {len(frames)} frames", bench_gain(frames))
+
+    results = bench_expint(frames)
+    print(f"exp(0.5*E1(v)) over {len(frames)} frames, table max relative error {ExpintTable().max_error:.1e}")
+    for name, fps in results.items():
+        print(f"  {name:<12s}{fps:10.0f} frames/s")
+
+    results = bench_offline()
+    print("Offline corpus throughput")
+    for name, speed in results.items():
+        print(f"  {name:<22s}{speed:8.1f}x real time")
+
+    results = bench_instrumentation()
+    print("process_frame with instrumentation")
+    for name, fps in results.items():
+        print(f"  {name:<12s}{fps:10.0f} frames/s  overhead {100 * (results['plain'] / fps - 1):5.1f} %")
+
+    results = bench_fast_path()
+    print("process_frame with the noise-only fast path")
+    for name, stats in results.items():
+        print(f"  {name:<24s}" + "  ".join(f"{value:8.3g} {key}" for key, value in stats.items()))
+
+    results = bench_tiers()
+    print("process_frame cost and PESQ by noise estimator and gain")
+    for name, stats in results.items():
+        print(f"  {name:<16s}{stats['us/frame']:8.1f} us/frame  PESQ {stats['PESQ']:.3f}")
+
+    results = bench_latency_presets()
+    print("process_frame cost and PESQ by latency preset")
+    for name, stats in results.items():
+        print(f"  {name:<18s}{stats['latency ms']:5.1f} ms latency{stats['us/frame']:8.1f} us/frame  "
+              f"RTF {stats['RTF']:.4f}  PESQ {stats['PESQ']:.3f}")
+
+    results = bench_spectral()
+    print("Time domain and spectral domain processing")
+    for name, us in results.items():
+        print(f"  {name:<16s}{us:8.1f} us/frame")
+
+    results = bench_allocations()
+    print("process_frame allocations in steady state (tracemalloc)")
+    for name, stats in results.items():
+        print(f"  {name:<14s}" + "  ".join(f"{value:8.0f} {key}" for key, value in stats.items()))
@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import numpy as np
+import soundfile as sf
+from pns.server import send_samples, read_samples
+
+'''
+Load test of the streaming service: runs `python -m pns serve` in a
+subprocess and n clients that send audio in real time, in chunks of
+chunk_ms, for each n of the ramp. A load is sustained when the 99th
+percentile of the client latency, from sending a chunk to receiving its
+last output sample, stays below the chunk length plus latency_budget_ms.
+Sessions per core is n divided by the cores the server used (its CPU time
+over the wall time, read from /proc), at the largest sustained load.
+'''
+NOISY_FILES = sorted(glob.glob("data/*_sn*[0-9].wav"))
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def session(port, x, chunk, fs):
+    '''Stream x at real time speed, return the latency of every chunk in seconds.'''
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    sent = []
+
+    async def produce():
+        start = time.perf_counter()
+        for i, k in enumerate(range(0, len(x), chunk)):
+            await asyncio.sleep(max(start + k / fs - time.perf_counter(), 0))
+            sent.append(time.perf_counter())
+            await send_samples(writer, x[k : k + chunk])
+        await send_samples(writer, None)
+
+    producer = asyncio.create_task(produce())
+    latencies = []
+    received = 0
+    while (y := await read_samples(reader)) is not None:
+        received += len(y)
+        now = time.perf_counter()
+        # chunks whose last sample came back with this message
+        while len(latencies) < min(received // chunk, len(sent)):
+            latencies.append(now - sent[len(latencies)])
+    await producer
+    writer.close()
+    return latencies
+
+
+async def load(port, n, seconds, chunk, fs, signals):
+    rng = np.random.default_rng(n)
+    clients = []
+    for i in range(n):
+        x = np.resize(np.roll(signals[i % len(signals)], rng.integers(1000)), int(seconds * fs))
+        clients.append(session(port, x.astype(np.float32), chunk, fs))
+        # spread the chunk boundaries of the sessions
+        await asyncio.sleep(chunk / fs / n)
+    return np.concatenate(await asyncio.gather(*clients))
+
+
+def run(ramp, seconds, chunk_ms, latency_budget_ms, server_args):
+    signals = [sf.read(input_file)[0] for input_file in NOISY_FILES]
+    fs = 16000
+    chunk = int(chunk_ms * fs / 1000)
+    server = subprocess.Popen([sys.executable, "-m", "pns", "serve", "--port", "0"] + server_args,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        port = int(server.stdout.readline().rsplit(":", 1)[1])
+        results = []
+        for n in ramp:
+            cpu, wall = cpu_seconds(server.pid), time.perf_counter()
+            latencies = asyncio.run(load(port, n, seconds, chunk, fs, signals))
+            cpu, wall = cpu_seconds(server.pid) - cpu, time.perf_counter() - wall
+            p99 = np.percentile(latencies, 99)
+            results.append({
+                "sessions": n,
+                "server_cores": cpu / wall,
+                "latency_p50_ms": 1000 * np.percentile(latencies, 50),
+                "latency_p99_ms": 1000 * p99,
+                "sustained": bool(p99 < (chunk_ms + latency_budget_ms) / 1000),
+            })
+            print(f"{n:5d} sessions  server {100 * cpu / wall:5.1f} % CPU  latency p50 "
+                  f"{results[-1]['latency_p50_ms']:7.1f} ms  p99 {results[-1]['latency_p99_ms']:7.1f} ms  "
+                  f"{'sustained' if results[-1]['sustained'] else 'overloaded'}", flush=True)
+            if not results[-1]["sustained"]:
+                break
+    finally:
+        server.send_signal(signal.SIGINT)
+        metrics = json.loads(server.communicate(timeout=30)[0].strip().splitlines()[-1])
+    sustained = [result for result in results if result["sustained"]]
+    if sustained:
+        best = sustained[-1]
+        print(f"{best['sessions']} sessions sustained at {best['server_cores']:.2f} cores: "
+              f"{best['sessions'] / max(best['server_cores'], 1e-3):.0f} sessions per core")
+    print(f"server: {metrics['batches']} batches, {metrics['frames_per_batch']:.1f} frames per batch")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of python -m pns serve.")
+    parser.add_argument("--ramp", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64, 128],
+                        help="numbers of concurrent sessions to try, in order")
+    parser.add_argument("--seconds", type=float, default=10, help="length of every session (default: 10)")
+    parser.add_argument("--chunk-ms", type=float, default=20, help="audio per client message (default: 20)")
+    parser.add_argument("--latency-budget-ms", type=float, default=50,
+                        help="allowed p99 latency on top of the chunk length (default: 50)")
+    args, server_args = parser.parse_known_args()
+    run(args.ramp, args.seconds, args.chunk_ms, args.latency_budget_ms, server_args)
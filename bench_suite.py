@@ -0,0 +1,193 @@
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+import soundfile as sf
+from pns.noise_suppressor import NoiseSuppressor
+from pns_reference import reference_denoise
+
+NOISY_FILES = sorted(f for f in os.listdir("data") if "_sn" in f and not f.endswith("_processed.wav"))
+BASELINE = "bench_baseline.json"
+STAGES = ["stft_analyze", "imcra_update", "omlsa_update", "stft_synthesize"]
+
+# bundled outputs are PCM_16, the other workloads are compared with pns_reference.
+# libsndfile writes PCM_16 scaled by 32767 and reads it back divided by 32768,
+# so a peak normalized output differs from its file by up to half a step of
+# rounding plus one step of scale at full scale: 1.5 steps, measured 1.0.
+# test_equivalence checks the pipeline against the same bound
+BUNDLED_TOLERANCE = 1.5 / 2**15
+REFERENCE_TOLERANCE = 1e-9
+
+
+def workloads(synthetic_seconds=60):
+    '''(name, signal, sample rate, expected output or None, tolerance) of the bundled files and a synthetic signal.'''
+    corpus = []
+    for name in NOISY_FILES:
+        x, fs = sf.read(os.path.join("data", name))
+        processed, _ = sf.read(os.path.join("data", name.replace(".wav", "_processed.wav")))
+        corpus.append(x)
+        yield name, x, fs, processed, BUNDLED_TOLERANCE
+    # the corpus repeated with random levels and a white noise floor
+    rng = np.random.default_rng(0)
+    n = int(synthetic_seconds * 16000)
+    x = np.concatenate([rng.uniform(0.25, 2) * corpus[i % len(corpus)] for i in range(n // min(map(len, corpus)) + 1)])
+    x = x[:n] + 1e-3 * rng.standard_normal(n)
+    yield f"synthetic_{synthetic_seconds}s", x, 16000, None, REFERENCE_TOLERANCE
+
+
+def bundled_output(x, fs):
+    '''Output as written by the frame loop of test_pns.py: up to the last full frame, peak normalized.'''
+    noise_suppressor = NoiseSuppressor(fs)
+    y = noise_suppressor.process_signal(x)
+    y[(len(x) - 1) // noise_suppressor.get_frame_size() * noise_suppressor.get_frame_size():] = 0
+    return y / (np.max(np.abs(y)) + 1e-10)
+
+
+def frame_loop(x, fs, stages=None):
+    '''Per-frame latencies in seconds of a process_frame loop over x, with per-stage time accumulated in stages.'''
+    noise_suppressor = NoiseSuppressor(fs)
+    frame_size = noise_suppressor.get_frame_size()
+    if stages is not None:
+        # instance attributes shadow the methods, so _process_frame calls the timed versions
+        for name, owner, method in [("stft_analyze", noise_suppressor, "stft_analyze"),
+                                    ("imcra_update", noise_suppressor.noise_estimator, "update"),
+                                    ("omlsa_update", noise_suppressor.suppression_gain, "update"),
+                                    ("stft_synthesize", noise_suppressor, "stft_synthesize")]:
+            setattr(owner, method, timed(getattr(owner, method), stages, name))
+    yout = np.empty(frame_size)
+    latencies = np.empty(len(x) // frame_size)
+    clock = time.perf_counter
+    for i in range(len(latencies)):
+        frame = x[i * frame_size : (i + 1) * frame_size]
+        start = clock()
+        noise_suppressor.process_frame(frame, out=yout)
+        latencies[i] = clock() - start
+    return latencies
+
+
+def timed(function, stages, name):
+    clock = time.perf_counter
+    stages[name] = 0.0
+
+    def wrapper(*args, **kwargs):
+        start = clock()
+        result = function(*args, **kwargs)
+        stages[name] += clock() - start
+        return result
+    return wrapper
+
+
+def best_of(run, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def measure(x, fs, expected, tolerance, repeat=3):
+    duration = len(x) / fs
+    frame_size = NoiseSuppressor(fs).get_frame_size()
+    n_frames = len(x) // frame_size
+
+    latencies = min((frame_loop(x, fs) for _ in range(repeat)), key=np.sum)
+    stages = {}
+    total = np.sum(frame_loop(x, fs, stages))
+    signal_time = best_of(lambda: NoiseSuppressor(fs).process_signal(x), repeat)
+
+    tracemalloc.start()
+    NoiseSuppressor(fs).process_signal(x)
+    _, signal_peak = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    frame_loop(x[:100 * frame_size], fs)
+    _, frame_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    if expected is None:
+        drift = np.max(np.abs(NoiseSuppressor(fs).process_signal(x) - reference_denoise(x)))
+    else:
+        drift = np.max(np.abs(bundled_output(x, fs) - expected))
+
+    return {
+        "duration_s": duration,
+        "frames": n_frames,
+        "process_frame": {
+            "rtf": np.sum(latencies) / duration,
+            "frames_per_s": n_frames / np.sum(latencies),
+            "latency_p50_us": 1e6 * np.percentile(latencies, 50),
+            "latency_p99_us": 1e6 * np.percentile(latencies, 99),
+            "stage_us_per_frame": dict({name: 1e6 * stages[name] / n_frames for name in STAGES},
+                                       other=1e6 * (total - sum(stages.values())) / n_frames),
+            "peak_memory_bytes": frame_peak,
+        },
+        "process_signal": {
+            "rtf": signal_time / duration,
+            "frames_per_s": n_frames / signal_time,
+            "peak_memory_bytes": signal_peak,
+        },
+        "drift": float(drift),
+        "drift_tolerance": tolerance,
+    }
+
+
+def run_suite(synthetic_seconds=60, repeat=3):
+    return {name: measure(x, fs, expected, tolerance, repeat)
+            for name, x, fs, expected, tolerance in workloads(synthetic_seconds)}
+
+
+def check(results, baseline, tolerance):
+    '''Failures: output drift beyond the workload tolerance, throughput below (1 - tolerance) times the baseline.'''
+    failures = []
+    for name, result in results.items():
+        if result["drift"] > result["drift_tolerance"]:
+            failures.append(f"{name}: output drift {result['drift']:.3g} > {result['drift_tolerance']:.3g}")
+        if name not in baseline:
+            continue
+        for path in ["process_frame", "process_signal"]:
+            current = result[path]["frames_per_s"]
+            previous = baseline[name][path]["frames_per_s"]
+            if current < (1 - tolerance) * previous:
+                failures.append(f"{name}: {path} {current:.0f} frames/s, baseline {previous:.0f} frames/s")
+    return failures
+
+
+def report(results):
+    for name, result in results.items():
+        frame, signal = result["process_frame"], result["process_signal"]
+        print(f"{name}  {result['duration_s']:.1f} s, {result['frames']} frames, drift {result['drift']:.2g}")
+        print(f"  process_frame   RTF {frame['rtf']:.4f}  {frame['frames_per_s']:8.0f} frames/s  "
+              f"p50 {frame['latency_p50_us']:6.1f} us  p99 {frame['latency_p99_us']:6.1f} us  "
+              f"peak {frame['peak_memory_bytes'] / 1024:8.1f} KiB")
+        print("                  " + "  ".join(f"{stage} {us:.1f} us" for stage, us in frame["stage_us_per_frame"].items()))
+        print(f"  process_signal  RTF {signal['rtf']:.4f}  {signal['frames_per_s']:8.0f} frames/s  "
+              f"peak {signal['peak_memory_bytes'] / 1024:8.1f} KiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="NoiseSuppressor benchmark suite.")
+    parser.add_argument("--baseline", default=BASELINE, help=f"baseline JSON file (default: {BASELINE})")
+    parser.add_argument("--update", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative throughput loss against the baseline (default: 0.25)")
+    parser.add_argument("--seconds", type=float, default=60, help="length of the synthetic signal (default: 60)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per measurement, the best is kept")
+    args = parser.parse_args()
+
+    results = run_suite(args.seconds, args.repeat)
+    report(results)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    failures = check(results, baseline, args.tolerance)
+    if args.update:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline written to {args.baseline}")
+    for failure in failures:
+        print("FAIL", failure)
+    sys.exit(1 if failures else 0)
@@ -1,4 +1,4 @@
 # __init__.py
-__all__ = ['noise_suppressor', 'noise_estimator', 'suppression_gain']
-
-
+__all__ = ['noise_suppressor', 'spectral_processor', 'noise_estimator', 'suppression_gain']
+# part of the job key of incremental runs (pns.manifest): changing it reprocesses everything
+__version__ = '0.2.0'
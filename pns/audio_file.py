@@ -0,0 +1,103 @@
+#!/usr/bin/python
+
+import os
+import numpy as np
+import soundfile as sf
+from .noise_suppressor import NoiseSuppressor
+from .manifest import replace_atomically
+
+'''
+File to file processing in blocks. Memory use depends on the block size and
+the number of channels only, not on the length of the recording.
+'''
+BLOCK_FRAMES = 100      # frames of frame_size samples per block, 1 s at any rate
+# intermediate files keep the output exactly in the processing dtype, W64 has no 4 GB limit
+PART_SUBTYPES = {np.dtype(np.float64): 'DOUBLE', np.dtype(np.float32): 'FLOAT'}
+PART_FORMAT = 'W64'
+
+
+def denoise_to_file(input_file, output_file, start=0, stop=None, warmup_start=None,
+                    block_frames=BLOCK_FRAMES, subtype=None, format=None, backend='numpy',
+                    noise_estimator='imcra', suppression_gain='omlsa', dtype=np.float64):
+    '''
+    Denoise samples [start, stop) of input_file into output_file, reading and
+    writing blocks of block_frames frames. Processing starts at warmup_start
+    (default start) and the output before start is dropped. The output equals
+    process_signal over the range. subtype and format default to the ones of
+    the input, backend, noise_estimator, suppression_gain and dtype are passed
+    to NoiseSuppressor. The samples are read and written as dtype, soundfile
+    converts them from and to the subtype of the files. Returns the peak
+    absolute output value of every channel.
+    '''
+    info = sf.info(input_file)
+    stop = info.frames if stop is None else stop
+    warmup_start = start if warmup_start is None else warmup_start
+    dtype = np.dtype(dtype)
+    noise_suppressors = [NoiseSuppressor(info.samplerate, backend=backend, noise_estimator=noise_estimator,
+                                         suppression_gain=suppression_gain, dtype=dtype)
+                         for _ in range(info.channels)]
+    blocksize = block_frames * noise_suppressors[0].get_frame_size()
+    peak = np.zeros(info.channels)
+    skip = start - warmup_start
+
+    yout = np.empty((blocksize, info.channels), dtype)
+    with sf.SoundFile(output_file, 'w', info.samplerate, info.channels,
+                      subtype or info.subtype, format=format or info.format) as output:
+        # blocks are whole frames, only the last one is zero padded by process_signal
+        for x in sf.blocks(input_file, blocksize=blocksize, start=warmup_start, stop=stop, dtype=dtype.name,
+                           always_2d=True):
+            y = yout[:len(x)]
+            for channel, noise_suppressor in enumerate(noise_suppressors):
+                y[:, channel] = noise_suppressor.process_signal(x[:, channel])
+            y = y[min(skip, len(y)):]
+            skip = max(skip - len(x), 0)
+            if len(y):
+                np.maximum(peak, np.max(np.abs(y), axis=0), out=peak)
+                output.write(y)
+    return peak
+
+
+def copy_scaled(input_files, output_file, scale=1.0, blocksize=65536, subtype=None, format=None,
+                dtype=np.float64):
+    '''Concatenate input_files into output_file in blocks of dtype, multiplying every channel by scale.'''
+    info = sf.info(input_files[0])
+    dtype = np.dtype(dtype)
+    scale = np.asarray(scale, dtype)
+    with sf.SoundFile(output_file, 'w', info.samplerate, info.channels,
+                      subtype or info.subtype, format=format or info.format) as output:
+        for input_file in input_files:
+            for x in sf.blocks(input_file, blocksize=blocksize, dtype=dtype.name, always_2d=True):
+                output.write(x * scale)
+
+
+def denoise_file(input_file, output_file, normalize=True, block_frames=BLOCK_FRAMES, backend='numpy',
+                 noise_estimator='imcra', suppression_gain='omlsa', dtype=np.float64):
+    '''
+    Denoise input_file into output_file with the subtype and format of the
+    input. With normalize, every channel is peak normalized like in test_pns.py:
+    the first pass writes a W64 temporary file of dtype next to output_file and
+    records the peaks, the second pass scales it into output_file. The
+    output is written to a temporary file renamed to output_file at the end,
+    so output_file is either complete or as it was before.
+    Returns the peak absolute value of every channel before normalization.
+    '''
+    options = dict(backend=backend, noise_estimator=noise_estimator, suppression_gain=suppression_gain,
+                   dtype=dtype)
+    info = sf.info(input_file)
+    peaks = []
+    if not normalize:
+        replace_atomically(output_file, lambda tmp: peaks.append(denoise_to_file(
+            input_file, tmp, block_frames=block_frames, subtype=info.subtype, format=info.format, **options)))
+        return peaks[0]
+
+    part_file = output_file + '.part'
+    try:
+        peak = denoise_to_file(input_file, part_file, block_frames=block_frames,
+                               subtype=PART_SUBTYPES[np.dtype(dtype)], format=PART_FORMAT, **options)
+        replace_atomically(output_file, lambda tmp: copy_scaled([part_file], tmp, 1 / (peak + 1e-10),
+                                                                subtype=info.subtype, format=info.format,
+                                                                dtype=dtype))
+    finally:
+        if os.path.exists(part_file):
+            os.remove(part_file)
+    return peak
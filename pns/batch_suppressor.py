@@ -0,0 +1,349 @@
+import numpy as np
+from .smoothing import Smoother
+from .noise_estimator import w, Nwin, delta_s, Bmin, delta_y, delta_yt, nonstat, b, \
+    ImcraParameters
+from .suppression_gain import eta_min, b_xi_local, P_min, xi_ll_dB, xi_lu_dB, \
+    xi_gl_dB, xi_gu_dB, xi_fl_dB, xi_fu_dB, xi_ml_dB, xi_mu_dB, q_max, broad_flag, G_f, \
+    to_dB, presence_probability, OmlsaParameters
+from .noise_suppressor import zero_thres, stft_sizes
+from scipy.special import expn
+
+
+class BatchState(object):
+    '''
+    Per-stream state stored as rows of arrays. `fields` maps an attribute name
+    to (shape of one row, dtype, initial value).
+    '''
+    fields = {}
+
+    def __init__(self, n_streams):
+        for name, (shape, dtype, init) in self.fields.items():
+            setattr(self, name, np.full((n_streams,) + shape, init, dtype=dtype))
+
+    def reset(self, rows):
+        for name, (shape, dtype, init) in self.fields.items():
+            getattr(self, name)[rows] = init
+
+    def grow(self, n_streams):
+        for name, (shape, dtype, init) in self.fields.items():
+            old = getattr(self, name)
+            new = np.full((n_streams,) + shape, init, dtype=dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+
+class BatchImcraNoiseEstimator(BatchState, ImcraParameters):
+    '''
+    ImcraNoiseEstimator over (N, M21) arrays. Rows follow the per-stream
+    recursion, including the state the single-stream version shares between
+    arrays: SMactt always holds St, and Smint holds St until the first minimum
+    window shift after frame Ninit.
+    '''
+    def __init__(self, n_streams, sample_rate, fft_size, frame_size):
+        ImcraParameters.__init__(self, sample_rate, fft_size, frame_size)
+        M21 = self.M21
+        self.smoothing = Smoother(b)
+        self.fields = {
+            'l': ((), int, 0),
+            'l_mod_lswitch': ((), int, 0),
+            'smint_is_st': ((), bool, False),
+            'sw_pos': ((), int, 0),
+            'S': ((M21,), float, 0),
+            'St': ((M21,), float, 0),
+            'Smin': ((M21,), float, 0),
+            'Smint': ((M21,), float, 0),
+            'SMact': ((M21,), float, 0),
+            'SW': ((Nwin, M21), float, 0),
+            'SWt': ((Nwin, M21), float, 0),
+            'lambda_d': ((M21,), float, 0),
+            'lambda_dav': ((M21,), float, 0),
+            'lambda_dav_long': ((M21,), float, 0),
+        }
+        super().__init__(n_streams)
+
+    def update(self, rows, Ya2, eta_2term):
+        alpha_s, alpha_d, alpha_d_long, alpha_eta = self.alpha_s, self.alpha_d, self.alpha_d_long, self.alpha_eta
+        Vwin = self.Vwin
+        l = self.l[rows] + 1
+        self.l[rows] = l
+        first = (l == 1)[:, None]
+        init = (l < self.Ninit)[:, None]
+
+        gamma = Ya2 / np.maximum(self.lambda_d[rows], 1e-10) #post_snr
+        eta = alpha_eta*eta_2term + (1-alpha_eta)*np.maximum(gamma-1,0)  #prior_snr
+        eta = np.maximum(eta,eta_min)
+        v = gamma*eta/(1+eta)
+
+        # smooth over frequency and time
+        Sf = self.smoothing(Ya2)
+        S = np.where(first, Sf, alpha_s * self.S[rows] + (1-alpha_s) * Sf)
+        St = np.where(first, Sf, self.St[rows])
+        Smin = np.where(init, S, np.minimum(self.Smin[rows], S))
+        SMact = np.where(init, S, np.minimum(self.SMact[rows], S))
+
+        # Local Minima Search
+        I_f = ((Ya2 < delta_y*Bmin*Smin) & (S < delta_s*Bmin*Smin)).astype(float)
+        conv_I = self.smoothing(I_f)
+        idx = conv_I > 0
+        Sft = St.copy()
+        if w :
+            np.divide(self.smoothing(I_f*Ya2), conv_I, out=Sft, where=idx)
+        else :
+            Sft[idx] = Ya2[idx]
+        # on the first frame S, Smin and SMact are the same array as St
+        S = np.where(first, Sft, S)
+        Smin = np.where(first, Sft, Smin)
+        SMact = np.where(first, Sft, SMact)
+
+        St = np.where(init, S, alpha_s * Sft + (1-alpha_s) * Sft)
+        smint_is_st = self.smint_is_st[rows] | (l < self.Ninit)
+        Smint = np.where(smint_is_st[:, None], St, np.minimum(self.Smint[rows], St))
+
+        qhat = np.ones(Ya2.shape)
+        phat = np.zeros(Ya2.shape)
+
+        if nonstat  == 'low' :
+            gamma_mint = Ya2/Bmin/np.maximum(Smin,1e-10)
+            zetat = S/Bmin/np.maximum(Smin,1e-10)
+        else :
+            gamma_mint = Ya2/Bmin/np.maximum(Smint,1e-10)
+            zetat = S/Bmin/np.maximum(Smint,1e-10)
+
+        idx = (gamma_mint > 1) & (gamma_mint < delta_yt) & (zetat < delta_s)
+        qhat[idx] = (delta_yt-gamma_mint[idx])/(delta_yt-1)
+        phat[idx] = 1/(1+qhat[idx]/(1-qhat[idx])*(1+eta[idx])*np.exp(-v[idx]))
+        phat[(gamma_mint > delta_yt) | (zetat >= delta_s)] = 1
+
+        self.S[rows] = S
+        self.St[rows] = St
+        self.Smin[rows] = Smin
+        self.Smint[rows] = Smint
+        self.SMact[rows] = SMact
+        self.smint_is_st[rows] = smint_is_st
+
+        l_mod_lswitch = self.l_mod_lswitch[rows] + 1
+        switch = l_mod_lswitch == Vwin
+        l_mod_lswitch[switch] = 0
+        self.l_mod_lswitch[rows] = l_mod_lswitch
+
+        start = rows[switch & (l == Vwin)]
+        self.SW[start] = self.S[start, None, :]
+        self.SWt[start] = self.St[start, None, :]
+        shift = rows[switch & (l != Vwin)]
+        if len(shift) :
+            # the oldest sub-window minimum of every row is replaced in place
+            pos = self.sw_pos[shift]
+            self.SW[shift, pos] = self.SMact[shift]
+            self.Smin[shift] = self.SW[shift].min(1)
+            self.SMact[shift] = self.S[shift]
+            self.SWt[shift, pos] = self.St[shift]
+            self.Smint[shift] = self.SWt[shift].min(1)
+            self.sw_pos[shift] = (pos + 1) % Nwin
+            self.smint_is_st[shift] = False
+
+        alpha_dt = alpha_d + (1-alpha_d)*phat
+        lambda_dav = np.where(first, Ya2, self.lambda_dav[rows])
+        lambda_dav = alpha_dt * lambda_dav + (1-alpha_dt)*Ya2
+        alpha_dt_long = alpha_d_long + (1-alpha_d_long)*phat
+        self.lambda_dav_long[rows] = np.where(init, lambda_dav,
+            alpha_dt_long * self.lambda_dav_long[rows] + (1-alpha_dt_long)*Ya2)
+        self.lambda_dav[rows] = lambda_dav
+
+        # 2.4. Noise Spectrum Estimate
+        if nonstat == 'high' :
+            lambda_d = 2 * lambda_dav
+        else :
+            lambda_d = 1.4685 * lambda_dav
+        self.lambda_d[rows] = lambda_d
+
+        return lambda_d
+
+
+class BatchOmlsaGain(BatchState, OmlsaParameters):
+    '''OmlsaGain over (N, M21) arrays.'''
+    def __init__(self, n_streams, sample_rate, fft_size, frame_size):
+        OmlsaParameters.__init__(self, sample_rate, fft_size, frame_size)
+        M21 = self.M21
+        self.smooth_local = Smoother(b_xi_local)
+        self.smooth_global = Smoother(self.b_xi_global)
+        self.fields = {
+            'eta_2term': ((M21,), float, 1),
+            'xi': ((M21,), float, 1),
+            'xi_frame': ((), float, 0),
+            'xi_m_dB': ((), float, 0),
+        }
+        super().__init__(n_streams)
+
+    def update(self, rows, Ya2, lambda_d):
+        alpha_eta, alpha_xi = self.alpha_eta, self.alpha_xi
+        k_l, k_u, k2_local, k3_local = self.k_l, self.k_u, self.k2_local, self.k3_local
+        gamma = Ya2 / np.maximum(lambda_d, 1e-10) #post_snr
+        eta = alpha_eta*self.eta_2term[rows] + (1-alpha_eta)*np.maximum(gamma-1,0)  #prior_snr
+        eta = np.maximum(eta,eta_min)
+        v = gamma*eta/(1+eta)
+
+        # A Priori Probability for Signal-Absence Estimate
+        xi = alpha_xi * self.xi[rows] + (1-alpha_xi) * eta
+        self.xi[rows] = xi
+        xi_local = self.smooth_local(xi)
+        xi_global = self.smooth_global(xi)
+        xi_frame = np.mean(xi[:, k_l:k_u], axis=1)
+        dxi_frame = xi_frame - self.xi_frame[rows]
+        self.xi_frame[rows] = xi_frame
+
+        xi_local_dB = to_dB(xi_local)
+        xi_global_dB = to_dB(xi_global)
+        xi_frame_dB = to_dB(xi_frame)
+
+        P_local = presence_probability(xi_local_dB, xi_ll_dB, xi_lu_dB)
+        P_global = presence_probability(xi_global_dB, xi_gl_dB, xi_gu_dB)
+
+        m_P_local = np.mean(P_local[:, 2:(k2_local+k3_local-3)], axis=1)    # average probability of speech presence
+        P_local[m_P_local < 0.25, k2_local:k3_local] = P_min    # reset P_local (frequency>500Hz) for low probability of speech presence
+
+        xi_m_dB = self.xi_m_dB[rows]
+        rising = (xi_frame_dB > xi_fl_dB) & (dxi_frame >= 0)
+        xi_m_dB[rising] = np.minimum(np.maximum(xi_frame_dB[rising], xi_ml_dB), xi_mu_dB)
+        self.xi_m_dB[rows] = xi_m_dB
+        P_frame = np.select(
+            [xi_frame_dB <= xi_fl_dB, dxi_frame >= 0,
+             xi_frame_dB >= xi_m_dB + xi_fu_dB, xi_frame_dB <= xi_m_dB + xi_fl_dB],
+            [P_min, 1, 1, P_min],
+            P_min+(xi_frame_dB-xi_m_dB-xi_fl_dB)/(xi_fu_dB-xi_fl_dB)*(1-P_min))[:, None]
+
+        if broad_flag :
+            q = 1 - P_global * P_local * P_frame
+        else :
+            q = 1 - P_local * P_frame
+
+        q = np.minimum(q, q_max)
+        PH1 = np.zeros(Ya2.shape)
+        idx = q < 0.9
+        PH1[idx] = 1 / ( 1+q[idx] / (1-q[idx]) * (1+eta[idx]) * np.exp(-v[idx]) )
+
+        # Spectral Gain
+        GH1 = np.ones(Ya2.shape)
+        eta_ratio = eta / (1+eta)
+        idx = v > 5
+        GH1[idx] = eta_ratio[idx]
+        idx = (v <= 5) & (v > 0)
+        GH1[idx] = eta_ratio[idx] * np.exp(0.5 * expn(1, v[idx]))
+
+        G = GH1**PH1 * G_f**(1 - PH1)
+        self.eta_2term[rows] = GH1**2 * gamma
+        return G
+
+
+class BatchNoiseSuppressor(object):
+    '''
+    Runs the NoiseSuppressor pipeline for many independent streams at once.
+
+    Every stream owns one row of the STFT buffers and of the IMCRA/OMLSA state,
+    so a single process_frame call handles a (n, frame_size) block of frames.
+    Streams join with add_stream and leave with remove_stream without touching
+    the state of the others. Each row reproduces the output of a separate
+    NoiseSuppressor fed with the same frames.
+    '''
+    def __init__(self, sample_rate, n_streams):
+        self.sample_rate = sample_rate
+        self.fft_size, self.frame_size = stft_sizes(sample_rate)
+        self.overlap_size = self.fft_size - self.frame_size
+        self.M21 = int(self.fft_size/2+1)
+        self.win = np.hamming(self.fft_size)
+        self.noise_estimator = BatchImcraNoiseEstimator(n_streams, sample_rate, self.fft_size, self.frame_size)
+        self.suppression_gain = BatchOmlsaGain(n_streams, sample_rate, self.fft_size, self.frame_size)
+        self.in_buffer = np.zeros((n_streams, self.fft_size))
+        self.out_buffer = np.zeros((n_streams, self.fft_size))
+        self.fnz_flag = np.zeros(n_streams, dtype=bool)
+        self.active = np.ones(n_streams, dtype=bool)
+
+    def get_frame_size(self):
+        return self.frame_size
+
+    def get_fft_size(self):
+        return self.fft_size
+
+    def get_streams(self):
+        '''Ids of the streams currently joined, in increasing order.'''
+        return np.flatnonzero(self.active)
+
+    def add_stream(self):
+        '''Join a new stream with fresh state and return its id.'''
+        free = np.flatnonzero(~self.active)
+        if len(free) == 0 :
+            self._grow(max(2*len(self.active), 1))
+            free = np.flatnonzero(~self.active)
+        stream = free[0]
+        self.reset_stream(stream)
+        self.active[stream] = True
+        return stream
+
+    def remove_stream(self, stream):
+        '''Leave a stream. Its row is reused by a later add_stream.'''
+        if not self.active[stream] :
+            raise ValueError(f"Stream {stream} is not active")
+        self.active[stream] = False
+
+    def reset_stream(self, stream):
+        self.noise_estimator.reset(stream)
+        self.suppression_gain.reset(stream)
+        self.in_buffer[stream] = 0
+        self.out_buffer[stream] = 0
+        self.fnz_flag[stream] = False
+
+    def _grow(self, n_streams):
+        n = len(self.active)
+        self.noise_estimator.grow(n_streams)
+        self.suppression_gain.grow(n_streams)
+        for name in ('in_buffer', 'out_buffer', 'fnz_flag', 'active'):
+            old = getattr(self, name)
+            new = np.zeros((n_streams,) + old.shape[1:], dtype=old.dtype)
+            new[:n] = old
+            setattr(self, name, new)
+
+    def process_frame(self, frames, streams=None):
+        '''
+        frames: (n, frame_size) block, row i belongs to streams[i]
+        streams: stream ids, all joined streams by default
+        Returns the (n, frame_size) block of output frames.
+        '''
+        M = self.fft_size
+        M21 = self.M21
+        Mno = self.frame_size
+        streams = self.get_streams() if streams is None else np.asarray(streams)
+        if not np.all(self.active[streams]) :
+            raise ValueError("Frames given for a stream that is not active")
+        frames = np.asarray(frames)
+        yout = np.zeros((len(streams), Mno))
+
+        #0 STFT Analysis
+        in_buffer = self.in_buffer[streams]
+        in_buffer[:, :M-Mno] = in_buffer[:, Mno:M]    # update the frame of data
+        in_buffer[:, M-Mno:M] = frames
+        self.in_buffer[streams] = in_buffer
+        self.fnz_flag[streams] |= np.abs(in_buffer[:, 1]) > zero_thres
+        nz = self.fnz_flag[streams]
+        if not np.any(nz) :
+            return yout
+
+        rows = streams[nz]
+        in_buffer = in_buffer[nz]
+        signal_spec = np.fft.rfft(self.win * in_buffer)
+        signal_spec[~np.any(np.abs(in_buffer) > zero_thres, axis=1)] = 0
+        signal_power = abs(signal_spec)**2
+
+        #1-5 noise estimation, a priori and posteriori snr estimation
+        noise_power = self.noise_estimator.update(rows, signal_power, self.suppression_gain.eta_2term[rows])
+
+        #6 Update suppression gain
+        gain = self.suppression_gain.update(rows, signal_power, noise_power)
+
+        #7 STFT Synthesis
+        x = self.win * np.fft.irfft(gain * signal_spec)
+        out_buffer = self.out_buffer[rows] + x
+        yout[nz] = out_buffer[:, :Mno]
+        out_buffer[:, :M-Mno] = out_buffer[:, Mno:M]   # update output frame
+        out_buffer[:, M-Mno:M] = 0   # update output frame
+        self.out_buffer[rows] = out_buffer
+
+        return yout
@@ -0,0 +1,319 @@
+#!/usr/bin/python
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import soundfile as sf
+from .noise_suppressor import stft_sizes
+from .spectral_processor import resolve_backend
+from .noise_estimator import noise_estimators, ImcraParameters, McraParameters
+from .suppression_gain import suppression_gains
+from .audio_file import denoise_to_file, copy_scaled, PART_SUBTYPES, PART_FORMAT
+from .manifest import Manifest, replace_atomically
+from . import server
+from . import evaluation
+
+'''
+Command line interface
+
+    python -m pns denoise <inputs...> -o <dir> [-j workers] [--manifest manifest.json]
+    python -m pns serve [--port 8765]
+    python -m pns evaluate <noisy inputs...> [--configs sweep.json] [--report report.json]
+
+Every input is cut into work units of about unit_seconds. A unit is
+processed from warmup_seconds before its start so that the noise estimate
+has settled when its own samples come in, and the warm-up output is dropped.
+Unit boundaries are multiples of the IMCRA minimum search window, so the
+estimator runs in the same phase as it does over the whole file. The
+recursions have long memory in bins where speech is always present, so the
+samples after a boundary are close to, not identical to, the output of one
+process_signal call; unit_seconds=0 processes whole files.
+
+Workers read and write their unit in blocks into a temporary file and the
+parent joins the units into the output, peak normalized with the peaks the
+workers report, so memory does not grow with the length of the files.
+Outputs are written to a temporary name and renamed once complete.
+
+With --manifest, a pns.manifest.Manifest records every finished output
+under a key of the input's content, the processing options and the library
+version. Outputs that match their entry are skipped, so a repeated or
+interrupted run only processes new, changed or missing files.
+
+serve runs the streaming service of pns.server until interrupted, then
+prints its metrics as JSON.
+
+evaluate scores NoiseSuppressor configurations with PESQ through
+pns.evaluation. Each input's clean reference is named like the bundled files
+(data/sp02_train_sn5.wav -> data/sp02.wav) unless --clean lists them.
+--configs is a JSON object that maps names to NoiseSuppressor keyword
+arguments, for example {"mcra": {"noise_estimator": "mcra"}}.
+'''
+UNIT_SECONDS = 60
+WARMUP_SECONDS = 10
+
+
+def search_window(sample_rate, noise_estimator='imcra'):
+    '''Samples of one minimum search window of noise_estimator in the default STFT configuration.'''
+    fft_size, frame_size = stft_sizes(sample_rate)
+    if noise_estimator == 'mcra':
+        return McraParameters(sample_rate, fft_size, frame_size).L * frame_size
+    return ImcraParameters(sample_rate, fft_size, frame_size).Vwin * frame_size
+
+
+def plan_units(n_samples, sample_rate, unit_seconds=UNIT_SECONDS, warmup_seconds=WARMUP_SECONDS,
+               noise_estimator='imcra'):
+    '''(warmup_start, start, stop) sample ranges covering n_samples.'''
+    step = search_window(sample_rate, noise_estimator)
+    if unit_seconds <= 0:
+        return [(0, 0, n_samples)]
+    unit = max(round(unit_seconds * sample_rate / step), 1) * step
+    warmup = round(warmup_seconds * sample_rate / step) * step
+    return [(max(start - warmup, 0), start, min(start + unit, n_samples))
+            for start in range(0, max(n_samples, 1), unit)]
+
+
+def denoise_unit(input_file, part_file, warmup_start, start, stop, backend='numpy',
+                 noise_estimator='imcra', suppression_gain='omlsa', dtype='float64'):
+    '''
+    Denoise samples [start, stop) of every channel into part_file.
+    Returns (peak of every channel, seconds spent processing).
+    '''
+    begin = time.perf_counter()
+    peak = denoise_to_file(input_file, part_file, start, stop, warmup_start,
+                           subtype=PART_SUBTYPES[np.dtype(dtype)], format=PART_FORMAT, backend=backend,
+                           noise_estimator=noise_estimator, suppression_gain=suppression_gain, dtype=dtype)
+    return peak, time.perf_counter() - begin
+
+
+def check_outputs(results):
+    '''
+    Set the error of the results whose output is also the output of another
+    input, or is one of the inputs, which it would overwrite.
+    '''
+    inputs = {os.path.realpath(result['input']) for result in results}
+    outputs = {}
+    for result in results:
+        outputs.setdefault(os.path.realpath(result['output']), []).append(result)
+    for output, same_output in outputs.items():
+        if output in inputs:
+            error = f"output {same_output[0]['output']} would overwrite an input"
+        elif len(same_output) > 1:
+            error = f"output {same_output[0]['output']} is shared by {len(same_output)} inputs"
+        else:
+            continue
+        for result in same_output:
+            result['error'] = error
+
+
+def denoise_files(input_files, output_dir, workers=None, unit_seconds=UNIT_SECONDS,
+                  warmup_seconds=WARMUP_SECONDS, normalize=True, backend='numpy',
+                  noise_estimator='imcra', suppression_gain='omlsa', dtype='float64', manifest=None):
+    '''
+    Denoise input_files into output_dir with a pool of workers processes.
+    Returns one dict per input with 'input', 'output', 'duration' (s),
+    'cpu' (s spent in the workers), 'rtf' (cpu/duration), 'skipped' (True
+    when the manifest, a pns.manifest.Manifest, has the output as current)
+    and 'error' (None, or the message of the failure that stopped this file).
+    Every output finished is recorded in the manifest at once. Outputs are
+    named as their input: inputs with the same name, or an output that
+    would replace an input, are failed without processing.
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    # keyed on the backend that runs, so that installing numba reprocesses 'auto' outputs
+    backend = resolve_backend(backend, noise_estimator, suppression_gain, dtype)
+    options = dict(unit_seconds=unit_seconds, warmup_seconds=warmup_seconds, normalize=normalize, backend=backend,
+                   noise_estimator=noise_estimator, suppression_gain=suppression_gain, dtype=str(np.dtype(dtype)))
+    results = [{'input': input_file, 'output': os.path.join(output_dir, os.path.basename(input_file)),
+                'duration': 0.0, 'cpu': 0.0, 'rtf': None, 'skipped': False, 'error': None}
+               for input_file in input_files]
+    check_outputs(results)
+    jobs = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in results:
+            if result['error'] is not None:
+                logging.error(f"{result['input']}: {result['error']}")
+                continue
+            try:
+                info = sf.info(result['input'])
+                if manifest is not None:
+                    if manifest.is_current(result['input'], result['output'], options):
+                        result['skipped'] = True
+                        logging.info(f"{result['input']} -> {result['output']}: up to date")
+                        continue
+                    # keyed on the input as planned, should it change while it is processed
+                    result['key'] = manifest.job_key(result['input'], options)
+            except Exception as e:
+                result['error'] = f"{type(e).__name__}: {e}"
+                logging.error(f"{result['input']}: {result['error']}")
+                continue
+            units = plan_units(info.frames, info.samplerate, unit_seconds, warmup_seconds, noise_estimator)
+            result.update(info=info, duration=info.frames / info.samplerate, peak=np.zeros(info.channels),
+                          parts=[f"{result['output']}.{i}.part" for i in range(len(units))], pending=len(units))
+            for part_file, (warmup_start, start, stop) in zip(result['parts'], units):
+                future = executor.submit(denoise_unit, result['input'], part_file, warmup_start, start, stop,
+                                         backend, noise_estimator, suppression_gain, dtype)
+                jobs[future] = result
+
+        for future in as_completed(jobs):
+            result = jobs.pop(future)
+            try:
+                peak, cpu = future.result()
+                np.maximum(result['peak'], peak, out=result['peak'])
+                result['cpu'] += cpu
+            except Exception as e:
+                if result['error'] is None:
+                    result['error'] = f"{type(e).__name__}: {e}"
+            result['pending'] -= 1
+            if result['pending'] == 0:
+                finish_file(result, normalize, dtype)
+                key = result.pop('key', None)
+                if manifest is not None and result['error'] is None:
+                    manifest.record(result['input'], result['output'], options, key)
+    return results
+
+
+def finish_file(result, normalize, dtype='float64'):
+    '''Join the work units of a file into its output, atomically, and log its real-time factor.'''
+    info = result.pop('info')
+    peak = result.pop('peak')
+    parts = result.pop('parts')
+    del result['pending']
+    try:
+        if result['error'] is None:
+            replace_atomically(result['output'], lambda tmp: copy_scaled(
+                parts, tmp, 1 / (peak + 1e-10) if normalize else 1.0, subtype=info.subtype, format=info.format,
+                dtype=dtype))
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        for part_file in parts:
+            if os.path.exists(part_file):
+                os.remove(part_file)
+    if result['error'] is not None:
+        logging.error(f"{result['input']}: {result['error']}")
+        return
+    result['rtf'] = result['cpu'] / max(result['duration'], 1e-10)
+    logging.info(f"{result['input']} -> {result['output']}: {result['duration']:.1f} s, "
+                 f"{info.channels} ch, {info.samplerate} Hz, RTF {result['rtf']:.4f}")
+
+
+def run_server(args):
+    def on_start(port):
+        # the port goes to stdout for scripts that start the server with --port 0
+        print(f"listening on {args.host}:{port}", flush=True)
+
+    async def run():
+        return await server.serve(args.host, args.port, args.sample_rate, args.batch_window_ms / 1000,
+                                  args.max_rounds, args.max_pending_frames, on_start)
+
+    try:
+        metrics = asyncio.run(run())
+    except KeyboardInterrupt:
+        return 0
+    print(json.dumps(metrics), flush=True)
+    return 0
+
+
+def run_evaluation(args):
+    clean_files = args.clean or [evaluation.clean_file_of(noisy_file) for noisy_file in args.inputs]
+    if len(clean_files) != len(args.inputs):
+        logging.error(f"{len(clean_files)} clean files for {len(args.inputs)} inputs")
+        return 2
+    configurations = {'default': {}}
+    if args.configs:
+        with open(args.configs) as f:
+            configurations = json.load(f)
+    report = evaluation.evaluate(configurations, list(zip(clean_files, args.inputs)), args.cache_dir,
+                                 args.workers, args.output_dir)
+    for name, summary in report['configurations'].items():
+        scores = '  '.join(f"{key} {summary[key]:.3f}" for key in ['pesq_nb', 'pesq_wb', 'delta_nb', 'delta_wb']
+                           if summary[key] is not None)
+        logging.info(f"{name}: {summary['files']} files, {summary['errors']} failed, {scores}")
+    logging.info(f"PESQ cache: {report['cache']['hits']} hits, {report['cache']['misses']} misses")
+    if args.report:
+        evaluation.write_report(report, args.report)
+    else:
+        print(json.dumps(report, default=str))
+    return 1 if any(summary['errors'] for summary in report['configurations'].values()) else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pns', description='Speech enhancement.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    denoise = commands.add_parser('denoise', help='denoise audio files with IMCRA/OMLSA')
+    denoise.add_argument('inputs', nargs='+', help='input audio files')
+    denoise.add_argument('-o', '--output-dir', required=True, help='directory for the outputs, named as the inputs')
+    denoise.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: number of CPUs)')
+    denoise.add_argument('--unit-seconds', type=float, default=UNIT_SECONDS,
+                         help='split inputs into work units of this length, 0 to process them whole '
+                              f'(default: {UNIT_SECONDS})')
+    denoise.add_argument('--warmup-seconds', type=float, default=WARMUP_SECONDS,
+                         help=f'audio processed and dropped before each work unit (default: {WARMUP_SECONDS})')
+    denoise.add_argument('--no-normalize', dest='normalize', action='store_false',
+                         help='write the output as is instead of peak normalizing each channel')
+    denoise.add_argument('--backend', choices=['auto', 'numpy', 'numba'], default='auto',
+                         help='IMCRA/OMLSA backend, auto uses numba when installed (default: auto)')
+    denoise.add_argument('--noise-estimator', choices=sorted(noise_estimators), default='imcra',
+                         help='noise estimator (default: imcra)')
+    denoise.add_argument('--gain', choices=sorted(suppression_gains), default='omlsa',
+                         help='suppression gain (default: omlsa)')
+    denoise.add_argument('--dtype', choices=['float64', 'float32'], default='float64',
+                         help='processing precision, float32 halves the memory traffic (default: float64)')
+    denoise.add_argument('--manifest', help='JSON manifest of finished outputs: skip the ones up to date and '
+                         'resume interrupted runs')
+    serve = commands.add_parser('serve', help='run the streaming denoising service')
+    serve.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    serve.add_argument('--port', type=int, default=8765, help='TCP port, 0 for any free port (default: 8765)')
+    serve.add_argument('--sample-rate', type=int, default=16000, help='sample rate of all sessions (default: 16000)')
+    serve.add_argument('--batch-window-ms', type=float, default=1000 * server.BATCH_WINDOW,
+                       help=f'time to wait for frames of other sessions (default: {1000 * server.BATCH_WINDOW:g})')
+    serve.add_argument('--max-rounds', type=int, default=server.MAX_ROUNDS,
+                       help=f'frames per session in one batch (default: {server.MAX_ROUNDS})')
+    serve.add_argument('--max-pending-frames', type=int, default=server.MAX_PENDING_FRAMES,
+                       help=f'backlog per session before reading pauses (default: {server.MAX_PENDING_FRAMES})')
+    evaluate = commands.add_parser('evaluate', help='score configurations with PESQ, with a disk cache')
+    evaluate.add_argument('inputs', nargs='+', help='noisy audio files')
+    evaluate.add_argument('--clean', nargs='+', help='clean references in the order of the inputs '
+                          '(default: the input name up to its first underscore)')
+    evaluate.add_argument('--configs', help='JSON object of configuration names to NoiseSuppressor arguments '
+                          '(default: one "default" configuration)')
+    evaluate.add_argument('--report', help='write the JSON report to this file instead of stdout')
+    evaluate.add_argument('--cache-dir', default=evaluation.CACHE_DIR,
+                          help=f'PESQ score cache (default: {evaluation.CACHE_DIR})')
+    evaluate.add_argument('-o', '--output-dir', help='also write the denoised files to <dir>/<configuration>/')
+    evaluate.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: number of CPUs)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == 'serve':
+        return run_server(args)
+    if args.command == 'evaluate':
+        return run_evaluation(args)
+    begin = time.perf_counter()
+    manifest = Manifest(args.manifest) if args.manifest else None
+    results = denoise_files(args.inputs, args.output_dir, args.workers, args.unit_seconds,
+                            args.warmup_seconds, args.normalize, args.backend, args.noise_estimator, args.gain,
+                            args.dtype, manifest)
+    wall = time.perf_counter() - begin
+
+    failed = [result for result in results if result['error'] is not None]
+    skipped = sum(result['skipped'] for result in results)
+    denoised = [result for result in results if result['error'] is None and not result['skipped']]
+    duration = sum(result['duration'] for result in denoised)
+    cpu = sum(result['cpu'] for result in denoised)
+    logging.info(f"{len(denoised)} files denoised, {skipped} up to date, {len(failed)} failed, "
+                 f"{duration:.1f} s of audio in {wall:.1f} s: RTF {wall / max(duration, 1e-10):.4f} wall, "
+                 f"{cpu / max(duration, 1e-10):.4f} per worker")
+    for result in failed:
+        logging.error(f"failed: {result['input']}: {result['error']}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
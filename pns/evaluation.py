@@ -0,0 +1,219 @@
+#!/usr/bin/python
+
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from importlib import metadata
+import numpy as np
+import soundfile as sf
+from .noise_suppressor import NoiseSuppressor
+from .manifest import replace_atomically
+
+'''
+PESQ evaluation of NoiseSuppressor configurations over a corpus
+
+    evaluate(configurations, pairs, cache_dir) -> report
+
+configurations maps a name to NoiseSuppressor keyword arguments and pairs
+lists (clean_file, noisy_file). Every configuration denoises every noisy
+file in a pool of worker processes, which also score the peak normalized
+output and, once per file, the noisy input against the clean reference, in
+narrow band and, above 8 kHz, wide band mode. Scores are cached on disk
+under a hash of the reference and degraded samples, the sample rate, the
+mode and the pesq version, so unchanged inputs and outputs are never scored
+twice, across configurations and across runs. The report is a plain dict,
+written as JSON by write_report.
+'''
+CACHE_DIR = os.path.join('export', 'pesq_cache')
+
+
+def clean_file_of(noisy_file):
+    '''Reference of a noisy file named like the bundled ones: data/sp02_train_sn5.wav -> data/sp02.wav.'''
+    directory, name = os.path.split(noisy_file)
+    return os.path.join(directory, name.split('_')[0] + os.path.splitext(name)[1])
+
+
+def pesq_modes(sample_rate):
+    return ['nb', 'wb'] if sample_rate > 8000 else ['nb']
+
+
+def pesq_version():
+    try:
+        return metadata.version('pesq')
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def score_key(ref, deg, sample_rate, mode):
+    '''Content hash of a PESQ call: the float64 samples of ref and deg, the rate, the mode and the pesq version.'''
+    h = hashlib.sha256(f'pesq {pesq_version()} {mode} {sample_rate:g} {len(ref)} {len(deg)}'.encode())
+    h.update(np.ascontiguousarray(ref, dtype=np.float64).tobytes())
+    h.update(np.ascontiguousarray(deg, dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+class ScoreCache(object):
+    '''
+    PESQ scores in directory, one small JSON file per key in a subdirectory
+    named by its first two characters. Files are written to a temporary name
+    and renamed, so concurrent workers and interrupted runs never leave a
+    partial entry.
+    '''
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, key):
+        try:
+            with open(self.path(key)) as f:
+                score = json.load(f)['score']
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return score
+
+    def put(self, key, score):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        def write(tmp):
+            with open(tmp, 'w') as f:
+                json.dump({'score': score}, f)
+        replace_atomically(path, write)
+
+    def score(self, ref, deg, sample_rate, mode):
+        '''PESQ of deg against ref, from the cache or computed and stored.'''
+        key = score_key(ref, deg, sample_rate, mode)
+        score = self.get(key)
+        if score is None:
+            from pesq import pesq
+            score = float(pesq(sample_rate, ref, deg, mode))
+            self.put(key, score)
+        return score
+
+
+def score_signals(cache, ref, deg, sample_rate, prefix=''):
+    '''{prefix + 'pesq_' + mode: score} over the common length of ref and deg, and the error, if any.'''
+    n = min(len(ref), len(deg))
+    scores = {}
+    try:
+        for mode in pesq_modes(sample_rate):
+            scores[f'{prefix}pesq_{mode}'] = cache.score(ref[:n], deg[:n], sample_rate, mode)
+    except Exception as e:
+        return scores, f'{type(e).__name__}: {e}'
+    return scores, None
+
+
+def score_input(clean_file, noisy_file, cache_dir):
+    '''Worker: PESQ of the noisy file. Returns (scores, error, cache hits, cache misses).'''
+    cache = ScoreCache(cache_dir)
+    try:
+        clean, fs = sf.read(clean_file)
+        noisy, _ = sf.read(noisy_file)
+    except Exception as e:
+        return {}, f'{type(e).__name__}: {e}', 0, 0
+    scores, error = score_signals(cache, clean, noisy, fs, 'input_')
+    return scores, error, cache.hits, cache.misses
+
+
+def score_configuration(clean_file, noisy_file, options, cache_dir, output_file=None):
+    '''
+    Worker: denoise the noisy file with NoiseSuppressor(fs, **options), peak
+    normalize it like test_pns.py, write it to output_file if given and score
+    it. Returns (scores, error, cache hits, cache misses).
+    '''
+    cache = ScoreCache(cache_dir)
+    try:
+        clean, fs = sf.read(clean_file)
+        noisy, _ = sf.read(noisy_file)
+        y = NoiseSuppressor(fs, **options).process_signal(noisy).astype(np.float64)
+    except Exception as e:
+        return {}, f'{type(e).__name__}: {e}', 0, 0
+    y = y / (np.max(np.abs(y)) + 1e-10)
+    if output_file is not None:
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        sf.write(output_file, y, fs)
+    scores, error = score_signals(cache, clean, y, fs)
+    return scores, error, cache.hits, cache.misses
+
+
+def summarize(rows, keys):
+    '''Mean of every key over the rows that have it.'''
+    summary = {}
+    for key in keys:
+        values = [row[key] for row in rows if row.get(key) is not None]
+        summary[key] = float(np.mean(values)) if values else None
+    return summary
+
+
+def evaluate(configurations, pairs, cache_dir=CACHE_DIR, workers=None, output_dir=None):
+    '''
+    Score every configuration on every (clean_file, noisy_file) pair with
+    workers processes. With output_dir, the denoised files are written to
+    output_dir/<configuration>/<noisy file name>. Returns the report:
+
+    'files': one dict per configuration and file with 'configuration',
+        'clean', 'input', 'input_pesq_nb', 'input_pesq_wb', 'pesq_nb',
+        'pesq_wb', 'delta_nb', 'delta_wb' (output minus input) and 'error'
+        (None, or the message of the failure; the scores obtained before it
+        are kept)
+    'configurations': per configuration, its 'options', the number of
+        'files' and 'errors', and the means of the scores and deltas
+    'cache': 'hits' and 'misses' of the score cache over the run
+    '''
+    rows = [{'configuration': name, 'clean': clean_file, 'input': noisy_file, 'error': None}
+            for name in configurations for clean_file, noisy_file in pairs]
+    inputs = {noisy_file: {} for _, noisy_file in pairs}
+    cache = {'hits': 0, 'misses': 0}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        jobs = {}
+        for clean_file, noisy_file in pairs:
+            jobs[executor.submit(score_input, clean_file, noisy_file, cache_dir)] = inputs[noisy_file]
+        for row in rows:
+            output_file = None if output_dir is None else \
+                os.path.join(output_dir, row['configuration'], os.path.basename(row['input']))
+            jobs[executor.submit(score_configuration, row['clean'], row['input'],
+                                 configurations[row['configuration']], cache_dir, output_file)] = row
+        for future in as_completed(jobs):
+            result = jobs.pop(future)
+            scores, error, hits, misses = future.result()
+            result.update(scores)
+            result['error'] = result.get('error') or error
+            cache['hits'] += hits
+            cache['misses'] += misses
+
+    for row in rows:
+        scores = dict(inputs[row['input']])
+        input_error = scores.pop('error')
+        row.update(scores)
+        row['error'] = row['error'] or input_error
+        for mode in ['nb', 'wb']:
+            if row.get(f'pesq_{mode}') is not None and row.get(f'input_pesq_{mode}') is not None:
+                row[f'delta_{mode}'] = row[f'pesq_{mode}'] - row[f'input_pesq_{mode}']
+        if row['error'] is not None:
+            logging.error(f"{row['configuration']}: {row['input']}: {row['error']}")
+
+    keys = ['input_pesq_nb', 'input_pesq_wb', 'pesq_nb', 'pesq_wb', 'delta_nb', 'delta_wb']
+    summary = {}
+    for name, options in configurations.items():
+        selected = [row for row in rows if row['configuration'] == name]
+        summary[name] = {'options': options, 'files': len(selected),
+                         'errors': sum(row['error'] is not None for row in selected), **summarize(selected, keys)}
+    return {'pesq_version': pesq_version(), 'files': rows, 'configurations': summary, 'cache': cache}
+
+
+def write_report(report, path):
+    '''Write the report as JSON, atomically.'''
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def write(tmp):
+        with open(tmp, 'w') as f:
+            json.dump(report, f, indent=1, default=str)
+    replace_atomically(path, write)
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+
+from bisect import bisect_right
+
+'''
+Opt-in statistics of a NoiseSuppressor, see NoiseSuppressor.enable_stats.
+'''
+STAGES = ('stft_analyze', 'noise_estimation', 'gain', 'synthesis')
+# upper edges of the timing histogram buckets in seconds, the last bucket is open
+BUCKET_EDGES = (1e-6, 2e-6, 5e-6, 1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4, 1e-3, 2e-3, 5e-3, 1e-2)
+
+
+class Stats(object):
+    '''
+    Counters of one stream. time[stage] is the cumulative time of a stage in
+    seconds and histogram[stage][i] the number of frames whose stage time
+    fell in bucket i of BUCKET_EDGES (for the batched stages of process_signal,
+    the time per frame of the batch). frames counts all processed frames,
+    skipped_frames the ones output as zeros by the first non-zero frame gate.
+    Gain and speech presence probability are averaged over the bins of every
+    frame that was not skipped; speech_frames counts those whose mean speech
+    presence probability is above 0.5. The speech presence counters stay 0
+    when the noise estimator and gain give no speech presence probability.
+
+    callback, if given, is called with the Stats every interval frames.
+    '''
+    def __init__(self, callback=None, interval=100):
+        self.callback = callback
+        self.interval = interval
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self.skipped_frames = 0
+        self.speech_frames = 0
+        self.gain_sum = 0.0
+        self.speech_presence_sum = 0.0
+        self.time = dict.fromkeys(STAGES, 0.0)
+        self.histogram = {stage: [0] * (len(BUCKET_EDGES) + 1) for stage in STAGES}
+
+    def add_time(self, stage, seconds, frames=1):
+        '''Add the time of a stage over frames frames, histogrammed at the time per frame.'''
+        self.time[stage] += seconds
+        self.histogram[stage][bisect_right(BUCKET_EDGES, seconds / frames)] += frames
+
+    def add_frame(self, gain=None, speech_presence=None):
+        '''
+        Count a frame, skipped if gain is None, else with its gain and speech
+        presence arrays. speech_presence is None for stages that give none.
+        '''
+        self.frames += 1
+        if gain is None:
+            self.skipped_frames += 1
+        else:
+            self.gain_sum += gain.mean()
+            if speech_presence is None:
+                return self._callback()
+            presence = speech_presence.mean()
+            self.speech_presence_sum += presence
+            self.speech_frames += presence > 0.5
+        self._callback()
+
+    def _callback(self):
+        if self.callback is not None and self.frames % self.interval == 0:
+            self.callback(self)
+
+    def mean_gain(self):
+        return self.gain_sum / max(self.frames - self.skipped_frames, 1)
+
+    def mean_speech_presence(self):
+        return self.speech_presence_sum / max(self.frames - self.skipped_frames, 1)
+
+    def speech_presence_ratio(self):
+        return self.speech_frames / max(self.frames - self.skipped_frames, 1)
+
+    def snapshot(self):
+        '''Plain dict of the counters, for logging or export.'''
+        return {
+            'frames': self.frames,
+            'skipped_frames': self.skipped_frames,
+            'mean_gain': self.mean_gain(),
+            'mean_speech_presence': self.mean_speech_presence(),
+            'speech_presence_ratio': self.speech_presence_ratio(),
+            'time': dict(self.time),
+            'histogram': {stage: list(counts) for stage, counts in self.histogram.items()},
+            'bucket_edges': list(BUCKET_EDGES),
+        }
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+
+import hashlib
+import json
+import logging
+import os
+from . import __version__
+
+'''
+Manifest of an incremental batch run. Every output is recorded with a job
+key, the SHA-256 of the input file, the processing options and the library
+version, and with the SHA-256 of the output file. An output is current, and
+its processing can be skipped, when its entry has the key of the planned
+job and the file on disk still has the recorded digest. The manifest is
+rewritten atomically after every finished file, so an interrupted run
+resumes after the last one, and the input digests are reused while the
+size and modification time of an input are unchanged.
+'''
+MANIFEST_VERSION = 1
+
+
+def file_digest(path, blocksize=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while block := f.read(blocksize):
+            h.update(block)
+    return h.hexdigest()
+
+
+def create_temporary(path, suffix='.tmp'):
+    '''
+    Create an empty file next to path and return its name. It is opened with
+    mode 0o666 like open() does, so the kernel applies the umask.
+    '''
+    directory, name = os.path.split(os.path.abspath(path))
+    for _ in range(100):
+        tmp = os.path.join(directory, f'{name}.{os.urandom(4).hex()}{suffix}')
+        try:
+            os.close(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+            return tmp
+        except FileExistsError:
+            continue
+    raise FileExistsError(f"no free temporary name next to {path}")
+
+
+def replace_atomically(path, write, suffix='.tmp'):
+    '''
+    Call write(temporary path) next to path, then rename it to path; the
+    temporary file is removed on failure. path keeps its permissions if it
+    exists, else gets the ones open() gives a new file.
+    '''
+    tmp = create_temporary(path, suffix)
+    try:
+        write(tmp)
+        try:
+            os.chmod(tmp, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class Manifest(object):
+    '''
+    The entries of the manifest file at path by output file, loaded if it
+    exists. A manifest that cannot be read is logged and started afresh:
+    everything is processed again.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.digests = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                if data.get('version') == MANIFEST_VERSION:
+                    self.entries = data['files']
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning(f"ignoring unreadable manifest {path}: {e}")
+
+    def input_digest(self, input_file):
+        '''SHA-256 of input_file, from the manifest while its size and modification time are unchanged.'''
+        stat = os.stat(input_file)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        if input_file not in self.digests:
+            for entry in self.entries.values():
+                if entry['input'] == input_file and entry['input_stat'] == signature:
+                    self.digests[input_file] = (signature, entry['input_digest'])
+                    break
+        cached = self.digests.get(input_file)
+        if cached is None or cached[0] != signature:
+            self.digests[input_file] = (signature, file_digest(input_file))
+        return self.digests[input_file][1]
+
+    def job_key(self, input_file, options):
+        '''Key of processing input_file with options (a dict of JSON values) with this library version.'''
+        config = json.dumps(options, sort_keys=True)
+        return hashlib.sha256(f'{self.input_digest(input_file)} {config} pns {__version__}'.encode()).hexdigest()
+
+    def is_current(self, input_file, output_file, options):
+        '''True when output_file holds the output of the job, unchanged since it was recorded.'''
+        entry = self.entries.get(output_file)
+        if entry is None or entry['key'] != self.job_key(input_file, options):
+            return False
+        try:
+            return file_digest(output_file) == entry['output_digest']
+        except OSError:
+            return False
+
+    def record(self, input_file, output_file, options, key):
+        '''
+        Record output_file as the output of the job of key, from job_key
+        when the job was planned, and save the manifest.
+        '''
+        signature, input_digest = self.digests[input_file]
+        self.entries[output_file] = {'input': input_file, 'input_stat': signature, 'input_digest': input_digest,
+                                     'options': options, 'version': __version__, 'key': key,
+                                     'output_digest': file_digest(output_file)}
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        def write(tmp):
+            with open(tmp, 'w') as f:
+                json.dump({'version': MANIFEST_VERSION, 'files': self.entries}, f, indent=1, sort_keys=True)
+        replace_atomically(self.path, write)
@@ -1,4 +1,5 @@
 import numpy as np
+from .smoothing import Smoother
 
 
 '''
@@ -14,7 +15,7 @@ Mo_ref = 352
 w = 1			# 2.1)  Size of frequency smoothing window function = 2*w+1
 alpha_s_ref = 0.9	# 2.2)  Recursive averaging parameter for the smoothing operation
 Nwin = 8 	# 2.3)  Resolution of local minima search
-Vwin = 15
+Vwin_ref = 15
 delta_s = 1.67		# 2.4)  Local minimum factor
 Bmin = 1.66
 delta_y = 4.6		# 2.4)  Local minimum factor
@@ -31,147 +32,354 @@ eta_min_dB = -18	# 4.2) Lower limit constraint
 # 5) Flags
 nonstat = 'medium'                #Non stationarity  # new version
 
-Fs = Fs_ref
-M = int(M_ref)
-Mo = int(Mo_ref)
-Mno = int(M-Mo)
-alpha_s = alpha_s_ref
-alpha_d = alpha_d_ref
-alpha_eta = alpha_eta_ref
-alpha_xi = alpha_xi_ref
-
-alpha_d_long = 0.99
+Mno_ref = M_ref - Mo_ref
+alpha_d_long_ref = 0.99
+Ninit_ref = 15   # frames before the minimum tracking starts
 eta_min = 10**(eta_min_dB/10)
 
 #b = hanning(2*w+1)
 #b = b/sum(b)     # normalize the window function
 b = np.array([0, 1, 0])
 
-M21 = int(M/2+1)
+# 6) Parameters of MCRA (Cohen and Berdugo, 2002)
+alpha_s_mcra_ref = 0.8	# 6.1) Recursive averaging parameter for the smoothing operation
+alpha_p_mcra_ref = 0.2	# 6.2) Recursive averaging parameter for the speech presence probability
+alpha_d_mcra_ref = 0.95	# 6.3) Recursive averaging parameter for the noise
+delta_mcra = 5		# 6.4) Threshold on the ratio of the smoothed power to its minimum
+L_mcra_ref = 100	# 6.5) Frames of the minimum search window
+
+class ImcraParameters(object):
+    '''
+    IMCRA constants for one sample rate and STFT configuration. The recursive
+    averaging parameters and the frame counts are given for the reference hop
+    of Mno_ref/Fs_ref = 10 ms and are rescaled to the actual hop duration.
+    '''
+    def __init__(self, sample_rate=Fs_ref, fft_size=M_ref, frame_size=Mno_ref):
+        self.fs = sample_rate
+        self.fft_size = fft_size
+        self.frame_size = frame_size
+        self.M21 = int(fft_size/2+1)
+
+        hop_scale = (frame_size/sample_rate) / (Mno_ref/Fs_ref)
+        self.alpha_s = alpha_s_ref**hop_scale
+        self.alpha_d = alpha_d_ref**hop_scale
+        self.alpha_d_long = alpha_d_long_ref**hop_scale
+        self.alpha_eta = alpha_eta_ref**hop_scale
+        self.Vwin = max(round(Vwin_ref/hop_scale), 1)
+        self.Ninit = max(round(Ninit_ref/hop_scale), 1)
 
 class NoiseEstimator(object):
     def update(self, features):
         pass
 
-class ImcraNoiseEstimator(NoiseEstimator):
-    def __init__(self):    
+class ImcraNoiseEstimator(NoiseEstimator, ImcraParameters):
+    '''
+    IMCRA noise estimator. All state and scratch arrays are allocated here and
+    updated in place, update returns the lambda_d array of the estimator.
+
+    The original implementation shared arrays between state variables; the
+    same values are kept here with separate arrays: SMactt always equals St,
+    and Smint follows St (smint_is_st) until the first minimum window shift
+    after frame Ninit. The Nwin sub-window minima SW and SWt are rings of rows
+    with the next row to replace at sw_pos.
+
+    All arrays are of dtype, float64 or float32 (see NoiseSuppressor).
+
+    state_names lists the attributes that carry over between frames, see
+    pns.state.
+    '''
+    state_names = ('l', 'l_mod_lswitch', 'smint_is_st', 'sw_pos', 'S', 'St', 'Smin', 'Smint', 'SMact',
+                   'SW', 'SWt', 'lambda_d', 'lambda_dav', 'lambda_dav_long')
+
+    def __init__(self, sample_rate=Fs_ref, fft_size=M_ref, frame_size=Mno_ref, dtype=np.float64):
+        ImcraParameters.__init__(self, sample_rate, fft_size, frame_size)
+        M21 = self.M21
+        self.dtype = dtype = np.dtype(dtype)
         self.l = 0   #count of frame
         self.l_mod_lswitch = 0
-        self.S = np.zeros(M21)              
-        self.St = np.zeros(M21)                
-        self.Sy = np.zeros(M21)       
-        self.Smin = np.zeros(M21)        
-        self.Smint = np.zeros(M21)      
-        self.SMact = np.zeros(M21)    
-        self.SMactt = np.zeros(M21)    
-        self.SW = np.zeros((M21,Nwin))
-        self.SWt = np.zeros((M21,Nwin))
-        self.lambda_d = np.zeros(M21)   
-        self.lambda_dav = np.zeros(M21)   
+        self.smint_is_st = False
+        self.sw_pos = 0
+        self.smoothing = Smoother(b, dtype)
+        self.S = np.zeros(M21, dtype)              
+        self.St = np.zeros(M21, dtype)                
+        self.Smin = np.zeros(M21, dtype)        
+        self.Smint = np.zeros(M21, dtype)      
+        self.SMact = np.zeros(M21, dtype)    
+        self.SW = np.zeros((Nwin,M21), dtype)
+        self.SWt = np.zeros((Nwin,M21), dtype)
+        self.lambda_d = np.zeros(M21, dtype)   
+        self.lambda_dav = np.zeros(M21, dtype)   
+        self.lambda_dav_long = np.zeros(M21, dtype)
+
+        # scratch
+        self.gamma = np.zeros(M21, dtype)
+        self.eta = np.zeros(M21, dtype)
+        self.v = np.zeros(M21, dtype)
+        self.I_f = np.zeros(M21, dtype)
+        self.qhat = np.zeros(M21, dtype)
+        self.phat = np.zeros(M21, dtype)
+        self.tmp = np.zeros(M21, dtype)
+        self.tmp2 = np.zeros(M21, dtype)
+        self.mask = np.zeros(M21, dtype=bool)
+        self.mask2 = np.zeros(M21, dtype=bool)
 
     def update(self, features):
-        Ya2 = features['signal_power']
-        self.eta_2term = features['eta_2term']
+        Ya2 = features.signal_power
+        M21 = self.M21
+        alpha_s, alpha_d, alpha_d_long, alpha_eta = self.alpha_s, self.alpha_d, self.alpha_d_long, self.alpha_eta
+        S, St, Smin, Smint, SMact = self.S, self.St, self.Smin, self.Smint, self.SMact
+        gamma, eta, v, tmp, tmp2 = self.gamma, self.eta, self.v, self.tmp, self.tmp2
+        mask, mask2 = self.mask, self.mask2
         
         self.l = self.l + 1
-        gamma = Ya2 / np.maximum(self.lambda_d, 1e-10) #post_snr
-        eta = alpha_eta*self.eta_2term + (1-alpha_eta)*np.maximum(gamma-1,0)  #prior_snr
-        eta = np.maximum(eta,eta_min)  
-        v = gamma*eta/(1+eta)
+        # gamma = Ya2 / max(lambda_d, 1e-10), post_snr
+        np.maximum(self.lambda_d, 1e-10, out=tmp)
+        np.divide(Ya2, tmp, out=gamma)
+        # eta = alpha_eta*eta_2term + (1-alpha_eta)*max(gamma-1,0), prior_snr
+        np.subtract(gamma, 1, out=tmp)
+        np.maximum(tmp, 0, out=tmp)
+        np.multiply(tmp, 1-alpha_eta, out=tmp)
+        np.multiply(features.eta_2term, alpha_eta, out=eta)
+        np.add(eta, tmp, out=eta)
+        np.maximum(eta, eta_min, out=eta)
+        # v = gamma*eta/(1+eta)
+        np.multiply(gamma, eta, out=v)
+        np.add(eta, 1, out=tmp)
+        np.divide(v, tmp, out=v)
 
         # 2.1. smooth over frequency
-        Sf = np.convolve(b, Ya2)  # smooth over frequency
-        Sf = Sf[w:M21+w]
+        Sf = self.smoothing(Ya2)  # smooth over frequency
         #         if l==1   
         if self.l == 1 :    
-            self.Sy = Ya2
-            self.S = Sf
-            self.St = Sf
-            self.lambda_dav = Ya2
+            S[:] = Sf
+            St[:] = Sf
+            self.lambda_dav[:] = Ya2
         else :
-            self.S = alpha_s * self.S + (1-alpha_s) * Sf     # smooth over time
+            # smooth over time
+            np.multiply(S, alpha_s, out=S)
+            np.multiply(Sf, 1-alpha_s, out=tmp)
+            np.add(S, tmp, out=S)
 
-        if self.l < 15 :    
-            self.Smin = self.S
-            self.SMact = self.S
+        if self.l < self.Ninit :    
+            Smin[:] = S
+            SMact[:] = S
         else :
-            self.Smin = np.minimum(self.Smin, self.S)
-            self.SMact = np.minimum(self.SMact, self.S)
+            np.minimum(Smin, S, out=Smin)
+            np.minimum(SMact, S, out=SMact)
 
         # Local Minima Search
-        I_f = np.zeros(M21)
-        for i in range(M21) :
-            I_f[i] = Ya2[i]<delta_y*Bmin*self.Smin[i] and self.S[i]<delta_s*Bmin*self.Smin[i] and 1
-        conv_I = np.convolve(b, I_f)
-        conv_I = conv_I[w:M21+w]
-        Sft = self.St
-        idx = [i for i, v in enumerate(conv_I) if v>0] 
-        if len(idx)!=0 :
-            if w :
-                conv_Y = np.convolve(b, I_f*Ya2)
-                conv_Y = conv_Y[w:M21+w]
-                Sft[idx] = conv_Y[idx]/conv_I[idx]
+        np.multiply(Smin, delta_y*Bmin, out=tmp)
+        np.less(Ya2, tmp, out=mask)
+        np.multiply(Smin, delta_s*Bmin, out=tmp)
+        np.less(S, tmp, out=mask2)
+        np.logical_and(mask, mask2, out=mask)
+        I_f = self.I_f
+        I_f[:] = mask
+        conv_I = self.smoothing(I_f)
+        np.greater(conv_I, 0, out=mask)
+        if mask.any() :
+            if not self.smoothing.identity :
+                np.multiply(I_f, Ya2, out=tmp)
+                conv_Y = self.smoothing(tmp)
+                np.divide(conv_Y, conv_I, out=St, where=mask)
             else :
-                Sft[idx] = Ya2[idx]
+                # conv_Y/conv_I is Ya2*1/1 where I_f is set
+                np.copyto(St, Ya2, where=mask)
+        if self.l == 1 :
+            # S, Smin and SMact are the same array as St on the first frame
+            S[:] = St
+            Smin[:] = St
+            SMact[:] = St
 
-        if self.l < 15 :
-            self.St = self.S
-            self.Smint = self.St
-            self.SMactt = self.St
+        if self.l < self.Ninit :
+            St[:] = S
+            Smint[:] = St
+            self.smint_is_st = True
         else : 
-            self.St[:] = alpha_s * self.St + (1-alpha_s) * Sft
-            self.Smint[:] = np.minimum(self.Smint, self.St)
-            self.SMactt[:] = np.minimum(self.SMactt, self.St)
+            # St = alpha_s * St + (1-alpha_s) * Sft, where Sft is St
+            np.multiply(St, 1-alpha_s, out=tmp)
+            np.multiply(St, alpha_s, out=St)
+            np.add(St, tmp, out=St)
+            if self.smint_is_st :
+                Smint[:] = St
+            else :
+                np.minimum(Smint, St, out=Smint)
 
-        qhat = np.ones(M21)
-        phat = np.zeros(M21)
+        qhat = self.qhat
+        phat = self.phat
+        qhat.fill(1)
+        phat.fill(0)
 
         if nonstat  == 'low' : 
-            gamma_mint = Ya2/Bmin/np.maximum(self.Smin,1e-10) 
-            zetat = self.S/Bmin/np.maximum(self.Smin,1e-10)     
+            Smin_ref = Smin
         else : 
-            gamma_mint = Ya2/Bmin/np.maximum(self.Smint,1e-10)   
-            zetat = self.S/Bmin/np.maximum(self.Smint,1e-10)    
-
-        for idx in range(M21) :
-            if gamma_mint[idx]>1 and gamma_mint[idx]<delta_yt and zetat[idx]<delta_s :
-                qhat[idx] = (delta_yt-gamma_mint[idx])/(delta_yt-1)
-                phat[idx] = 1/(1+qhat[idx]/(1-qhat[idx])*(1+eta[idx])*np.exp(-v[idx]))
-            if gamma_mint[idx]>delta_yt  or  zetat[idx]>=delta_s :
-                phat[idx] = 1
+            Smin_ref = Smint
+        np.maximum(Smin_ref, 1e-10, out=tmp2)
+        gamma_mint = np.divide(Ya2, Bmin, out=gamma)    # gamma is not used below
+        np.divide(gamma_mint, tmp2, out=gamma_mint)
+        zetat = np.divide(S, Bmin, out=tmp)
+        np.divide(zetat, tmp2, out=zetat)
+
+        # speech presence probability: qhat/phat stay 1/0 outside the two regions
+        # idx = (gamma_mint > 1) & (gamma_mint < delta_yt) & (zetat < delta_s)
+        idx = mask
+        np.greater(gamma_mint, 1, out=idx)
+        np.less(gamma_mint, delta_yt, out=mask2)
+        np.logical_and(idx, mask2, out=idx)
+        np.less(zetat, delta_s, out=mask2)
+        np.logical_and(idx, mask2, out=idx)
+        # phat = 1/(1+qhat/(1-qhat)*(1+eta)*exp(-v))
+        np.subtract(delta_yt, gamma_mint, out=qhat, where=idx)
+        np.divide(qhat, delta_yt-1, out=qhat, where=idx)
+        np.subtract(1, qhat, out=tmp2, where=idx)
+        np.divide(qhat, tmp2, out=tmp2, where=idx)
+        np.add(eta, 1, out=phat, where=idx)
+        np.multiply(tmp2, phat, out=tmp2, where=idx)
+        np.negative(v, out=phat, where=idx)
+        np.exp(phat, out=phat, where=idx)
+        np.multiply(tmp2, phat, out=tmp2, where=idx)
+        np.add(tmp2, 1, out=tmp2, where=idx)
+        np.divide(1, tmp2, out=phat, where=idx)
+        # phat = 1 where (gamma_mint > delta_yt) | (zetat >= delta_s)
+        np.greater(gamma_mint, delta_yt, out=mask)
+        np.greater_equal(zetat, delta_s, out=mask2)
+        np.logical_or(mask, mask2, out=mask)
+        np.copyto(phat, 1, where=mask)
         
         self.l_mod_lswitch = self.l_mod_lswitch + 1
-        if self.l_mod_lswitch == Vwin :
+        if self.l_mod_lswitch == self.Vwin :
             self.l_mod_lswitch = 0
 
-            if self.l == Vwin : 
-                for i in range(Nwin):
-                    self.SW[:,i] = self.S
-                    self.SWt[:, i] = self.St
+            if self.l == self.Vwin : 
+                self.SW[:] = S
+                self.SWt[:] = St
             else :
-                self.SW[:,:Nwin-1] = self.SW[:,1:Nwin]
-                self.SW[:,Nwin-1] = self.SMact
-                self.Smin = self.SW.min(1)
-                self.SMact = self.S
-                self.SWt[:,:Nwin-1] = self.SWt[:,1:Nwin]
-                self.SWt[:,Nwin-1] = self.SMactt
-                self.Smint = self.SWt.min(1)
-                self.SMactt = self.St
-
-        alpha_dt = alpha_d + (1-alpha_d)*phat
-        self.lambda_dav = alpha_dt * self.lambda_dav + (1-alpha_dt)*Ya2
-        if self.l < 15 :
-            self.lambda_dav_long = self.lambda_dav
+                # the oldest sub-window minimum is replaced in place
+                self.SW[self.sw_pos] = SMact
+                np.minimum.reduce(self.SW, axis=0, out=Smin)
+                SMact[:] = S
+                self.SWt[self.sw_pos] = St
+                np.minimum.reduce(self.SWt, axis=0, out=Smint)
+                self.sw_pos = (self.sw_pos + 1) % Nwin
+                self.smint_is_st = False
+
+        # alpha_dt = alpha_d + (1-alpha_d)*phat
+        # lambda_dav = alpha_dt * lambda_dav + (1-alpha_dt)*Ya2
+        alpha_dt = np.multiply(phat, 1-alpha_d, out=tmp)
+        np.add(alpha_dt, alpha_d, out=alpha_dt)
+        np.subtract(1, alpha_dt, out=tmp2)
+        np.multiply(tmp2, Ya2, out=tmp2)
+        np.multiply(alpha_dt, self.lambda_dav, out=self.lambda_dav)
+        np.add(self.lambda_dav, tmp2, out=self.lambda_dav)
+        if self.l < self.Ninit :
+            self.lambda_dav_long[:] = self.lambda_dav
         else :
-            alpha_dt_long = alpha_d_long + (1-alpha_d_long)*phat
-            self.lambda_dav_long = alpha_dt_long * self.lambda_dav_long + (1-alpha_dt_long)*Ya2
+            alpha_dt_long = np.multiply(phat, 1-alpha_d_long, out=tmp)
+            np.add(alpha_dt_long, alpha_d_long, out=alpha_dt_long)
+            np.subtract(1, alpha_dt_long, out=tmp2)
+            np.multiply(tmp2, Ya2, out=tmp2)
+            np.multiply(alpha_dt_long, self.lambda_dav_long, out=self.lambda_dav_long)
+            np.add(self.lambda_dav_long, tmp2, out=self.lambda_dav_long)
 
         # 2.4. Noise Spectrum Estimate
         if nonstat == 'high' :
-            self.lambda_d = 2 * self.lambda_dav  
+            np.multiply(self.lambda_dav, 2, out=self.lambda_d)
         else :
-            self.lambda_d = 1.4685 * self.lambda_dav  
+            np.multiply(self.lambda_dav, 1.4685, out=self.lambda_d)
 
         return self.lambda_d
 
+class McraParameters(object):
+    '''
+    MCRA constants for one sample rate and STFT configuration, rescaled from
+    the 10 ms reference hop like ImcraParameters.
+    '''
+    def __init__(self, sample_rate=Fs_ref, fft_size=M_ref, frame_size=Mno_ref):
+        self.fs = sample_rate
+        self.fft_size = fft_size
+        self.frame_size = frame_size
+        self.M21 = int(fft_size/2+1)
+
+        hop_scale = (frame_size/sample_rate) / (Mno_ref/Fs_ref)
+        self.alpha_s = alpha_s_mcra_ref**hop_scale
+        self.alpha_p = alpha_p_mcra_ref**hop_scale
+        self.alpha_d = alpha_d_mcra_ref**hop_scale
+        self.L = max(round(L_mcra_ref/hop_scale), 1)
+
+class McraNoiseEstimator(NoiseEstimator, McraParameters):
+    '''
+    MCRA noise estimator: the noise power is a recursive average of the
+    signal power whose speed is set by a speech presence probability phat,
+    itself a smoothed indicator of the smoothed power S exceeding delta_mcra
+    times its minimum over the last L to 2L frames. One minimum search and
+    no bias compensation make it about half the work of IMCRA, with a
+    slower reaction to rising noise. All arrays are of dtype.
+    '''
+    state_names = ('l', 'S', 'Smin', 'Stmp', 'phat', 'lambda_d')
+
+    def __init__(self, sample_rate=Fs_ref, fft_size=M_ref, frame_size=Mno_ref, dtype=np.float64):
+        McraParameters.__init__(self, sample_rate, fft_size, frame_size)
+        M21 = self.M21
+        self.dtype = dtype = np.dtype(dtype)
+        self.l = 0   #count of frame
+        self.smoothing = Smoother(b, dtype)
+        self.S = np.zeros(M21, dtype)
+        self.Smin = np.zeros(M21, dtype)
+        self.Stmp = np.zeros(M21, dtype)
+        self.phat = np.zeros(M21, dtype)
+        self.lambda_d = np.zeros(M21, dtype)
+
+        # scratch
+        self.tmp = np.zeros(M21, dtype)
+        self.mask = np.zeros(M21, dtype=bool)
+
+    def update(self, features):
+        Ya2 = features.signal_power
+        M21 = self.M21
+        alpha_s, alpha_p, alpha_d = self.alpha_s, self.alpha_p, self.alpha_d
+        S, Smin, Stmp, phat, tmp = self.S, self.Smin, self.Stmp, self.phat, self.tmp
+
+        self.l = self.l + 1
+        Sf = self.smoothing(Ya2)  # smooth over frequency
+        if self.l == 1 :
+            S[:] = Sf
+            Smin[:] = Sf
+            Stmp[:] = Sf
+            self.lambda_d[:] = Ya2
+            return self.lambda_d
+
+        # smooth over time
+        np.multiply(S, alpha_s, out=S)
+        np.multiply(Sf, 1-alpha_s, out=tmp)
+        np.add(S, tmp, out=S)
+
+        # minimum search, restarted from Stmp every L frames
+        if self.l % self.L == 0 :
+            np.minimum(Stmp, S, out=Smin)
+            Stmp[:] = S
+        else :
+            np.minimum(Smin, S, out=Smin)
+            np.minimum(Stmp, S, out=Stmp)
+
+        # phat = alpha_p*phat + (1-alpha_p)*(S > delta*Smin)
+        np.multiply(Smin, delta_mcra, out=tmp)
+        np.greater(S, tmp, out=self.mask)
+        np.multiply(phat, alpha_p, out=phat)
+        np.add(phat, 1-alpha_p, out=phat, where=self.mask)
+
+        # alpha_dt = alpha_d + (1-alpha_d)*phat
+        # lambda_d = alpha_dt*lambda_d + (1-alpha_dt)*Ya2
+        alpha_dt = np.multiply(phat, 1-alpha_d, out=tmp)
+        np.add(alpha_dt, alpha_d, out=alpha_dt)
+        np.multiply(alpha_dt, self.lambda_d, out=self.lambda_d)
+        np.subtract(1, alpha_dt, out=alpha_dt)
+        np.multiply(alpha_dt, Ya2, out=alpha_dt)
+        np.add(self.lambda_d, alpha_dt, out=self.lambda_d)
+
+        return self.lambda_d
 
+# noise estimators by name, for NoiseSuppressor(noise_estimator=...)
+noise_estimators = {
+    'imcra': ImcraNoiseEstimator,
+    'mcra': McraNoiseEstimator,
+}
@@ -1,38 +1,167 @@
 #!/usr/bin/python
 
+import time
+import zlib
 import numpy as np
-from .noise_estimator import ImcraNoiseEstimator
-from .suppression_gain import OmlsaGain
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.fft import next_fast_len
+from scipy.signal import get_window
+from .noise_estimator import Fs_ref, M_ref, Mo_ref, Mno_ref
+from .spectral_processor import SpectralProcessor
+from .instrumentation import Stats
+from .state import STATE_VERSION, state_size, pack_state, unpack_state
 
 '''
 Constants
 '''
-# 1) Parameters of Short Time Fourier Analysis:
-Fs_ref = 16e3		# 1.1) Reference Sampling frequency
-M_ref = 512		# 1.2) Size of analysis window
-#Mo_ref = 0.75*M_ref	# 1.3) Number of overlapping samples in consecutive frames
-Mo_ref = 352
-Mno_ref = 160
+# 1) Parameters of Short Time Fourier Analysis: Fs_ref, M_ref, Mo_ref and Mno_ref of noise_estimator
+# (window_ms, hop_ms) of the latency presets, the hop keeps the 10/32 ratio of the reference
+latency_presets = {
+    'default': (32, 10),
+    'low_latency': (16, 5),
+    'ultra_low_latency': (8, 2.5),
+}
 
 # zero_thres is a threshold for discriminating between zero and nonzero sample.
 zero_thres = 1e-10    
+# in float32, half the rounding step of a full scale sample: smaller values are
+# rounding residue rather than signal, and 16-bit PCM steps are 2**-15
+zero_thres_float32 = 2.0**-24
+
+# np.fft takes out= from NumPy 2.0 on; before, the result is copied into the buffer
+fft_out = np.lib.NumpyVersion(np.__version__) >= '2.0.0'
+
+
+def stft_sizes(sample_rate, window_ms=None, hop_ms=None):
+    '''
+    (fft_size, frame_size) at sample_rate: the 32 ms window of the reference
+    rounded up to a fast FFT length, and the 10 ms hop. 512 and 160 at 16 kHz.
+    window_ms and hop_ms replace the reference durations, for example with
+    latency_presets['low_latency'].
+    '''
+    if window_ms is None :
+        fft_size = next_fast_len(round(sample_rate*M_ref/Fs_ref), real=True)
+    else :
+        fft_size = next_fast_len(round(sample_rate*window_ms/1000), real=True)
+    if hop_ms is None :
+        frame_size = round(sample_rate*Mno_ref/Fs_ref)
+    else :
+        frame_size = round(sample_rate*hop_ms/1000)
+    return fft_size, frame_size
+
+def analysis_window(window, fft_size):
+    '''
+    np.hamming for 'hamming', else scipy's symmetric window of that name or
+    (name, parameters) tuple, or the given array.
+    '''
+    if isinstance(window, str) and window == 'hamming' :
+        return np.hamming(fft_size)
+    if isinstance(window, (str, tuple)) :
+        return get_window(window, fft_size, fftbins=False)
+    window = np.asarray(window, dtype=float)
+    if window.shape != (fft_size,) :
+        raise ValueError(f"window of {len(window)} samples for an fft_size of {fft_size}")
+    return window
 
 
 '''
 Class
 '''
 class NoiseSuppressor(object):
-    def __init__(self, sample_rate):
+    '''
+    Time-domain wrapper of a SpectralProcessor (processor): the STFT
+    analysis, the first non-zero frame gate and the overlap-add synthesis
+    around its noise estimate and gain. noise_estimator and suppression_gain
+    are the stages of the processor.
+
+    backend selects how the IMCRA and OMLSA updates run: 'numpy', 'numba' for
+    the fused compiled kernel of numba_backend (ImportError without numba),
+    or 'auto' for numba when it is installed and numpy otherwise.
+
+    noise_estimator and suppression_gain name an entry of the noise_estimators
+    and suppression_gains registries ('imcra' or 'mcra', 'omlsa' or 'wiener')
+    or give a class taking (sample_rate, fft_size, frame_size). The numba
+    backend covers IMCRA with OMLSA only; 'auto' uses numpy for the others.
+
+    fft_size, frame_size and window set the STFT: window length, hop and
+    analysis/synthesis window, by default the ones of stft_sizes and a
+    Hamming window. The IMCRA/OMLSA time constants follow the hop and the
+    frequency smoothing the bin width, and the synthesis window is scaled so
+    that the overlap-add gain matches the default configuration at the same
+    sample rate (a factor of exactly 1 there). get_latency() is the
+    resulting input-to-output delay.
+
+    expint_table and fast_path are passed to OmlsaGain: frames that are confidently noise-only
+    skip the speech presence computation and get the floor gain G_f, which
+    leaves the output unchanged.
+
+    dtype=np.float32 runs the analysis, the estimator and gain state and the
+    synthesis in single precision, which halves the state and the memory
+    traffic per stream; input of any dtype is converted on the way in and
+    the output is float32. The noise power floor of 1e-10 of the SNR ratios
+    stays far above the float32 range limit and keeps gamma*eta finite for
+    inputs scaled to [-1, 1]; the zero sample threshold becomes
+    zero_thres_float32. The numba backend is float64 only.
+
+    get_state and set_state export and restore the complete stream state.
+    '''
+    state_names = ('in_pos', 'out_pos', 'n_pending', 'samples_in', 'samples_out', 'fnz_flag', 'zero_age',
+                   'in_buffer', 'out_buffer', 'pending')
+
+    def __init__(self, sample_rate, expint_table=False, backend='numpy', fast_path=False,
+                 noise_estimator='imcra', suppression_gain='omlsa', fft_size=None, frame_size=None,
+                 window='hamming', dtype=np.float64):
         self.sample_rate = sample_rate
-        self.frame_size = Mno_ref
-        self.overlap_size = Mo_ref
-        self.fft_size = M_ref
-        self.win =np.hamming(self.fft_size)
-        self.in_buffer = np.zeros(self.fft_size)
-        self.out_buffer = np.zeros(self.fft_size)
-        self.noise_estimator = ImcraNoiseEstimator()
-        self.suppression_gain = OmlsaGain(sample_rate, self.fft_size)
+        default_sizes = stft_sizes(sample_rate)
+        self.fft_size = default_sizes[0] if fft_size is None else int(fft_size)
+        self.frame_size = default_sizes[1] if frame_size is None else int(frame_size)
+        if not 0 < self.frame_size <= self.fft_size // 2 :
+            raise ValueError(f"frame_size {self.frame_size} must be at most half of fft_size {self.fft_size}")
+        self.processor = SpectralProcessor(sample_rate, self.fft_size, self.frame_size, expint_table, backend,
+                                           fast_path, noise_estimator, suppression_gain, dtype)
+        self.noise_estimator = self.processor.noise_estimator
+        self.suppression_gain = self.processor.suppression_gain
+        self.speech_presence = self.processor.speech_presence
+        self.kernel = self.processor.kernel
+        self.backend = self.processor.backend
+        self.dtype = dtype = self.processor.dtype
+        self.zero_thres = zero_thres if dtype == np.float64 else zero_thres_float32
+        self.overlap_size = self.fft_size - self.frame_size
+        self.win =analysis_window(window, self.fft_size).astype(dtype, copy=False)
+        if (self.fft_size, self.frame_size) == default_sizes and isinstance(window, str) and window == 'hamming' :
+            self.synthesis_win = self.win
+        else :
+            # overlap-add gain sum(win**2)/hop of the default configuration over the one of this one
+            default_win = np.hamming(default_sizes[0])
+            scale = (np.sum(default_win**2) / default_sizes[1]) / (np.sum(self.win**2) / self.frame_size)
+            self.synthesis_win = (self.win * scale).astype(dtype)
+        # mirrored input ring: the analysis frame is in_buffer[in_pos:in_pos+fft_size]
+        self.in_buffer = np.zeros(2*self.fft_size, dtype)
+        self.in_pos = 0
+        # output ring: the overlap-add sum starts at out_buffer[out_pos]
+        self.out_buffer = np.zeros(self.fft_size, dtype)
+        self.out_pos = 0
+        # samples pushed but not yet forming a full frame
+        self.pending = np.zeros(self.frame_size, dtype)
+        self.n_pending = 0
+        self.samples_in = 0
+        self.samples_out = 0
         self.fnz_flag = 0     # flag for the first frame which is non-zero  
+        # samples since the last non-zero sample of the input, capped at fft_size:
+        # the analysis frame is all zeros when it reaches fft_size
+        self.zero_age = self.fft_size
+
+        # work buffers of the per-frame path
+        M21 = int(self.fft_size/2+1)
+        complex_dtype = np.result_type(dtype, np.complex64)
+        self.frame_buffer = np.zeros(self.fft_size, dtype)
+        self.frame_mask = np.zeros(self.fft_size, dtype=bool)
+        self.signal_spec = np.zeros(M21, dtype=complex_dtype)
+        self.signal_power = np.zeros(M21, dtype)
+        self.X = np.zeros(M21, dtype=complex_dtype)
+        self.x = np.zeros(self.fft_size, dtype)
+        self.features = self.processor.features
+        self.stats = None
     
     def get_frame_size(self):
         return self.frame_size
@@ -40,36 +169,187 @@ class NoiseSuppressor(object):
     def get_fft_size(self):
         return self.fft_size
 
+    def get_latency(self):
+        '''
+        Input-to-output delay in seconds: get_delay() samples of overlap plus
+        the hop a sample may wait for its frame to complete, which is the
+        window length. 32 ms by default, at any sample rate.
+        '''
+        return (self.get_delay() + self.frame_size) / self.sample_rate
+
+    def get_delay(self):
+        '''Algorithmic delay in samples: output sample n belongs to input sample n - delay.'''
+        return self.overlap_size
+
+    def get_pending(self):
+        '''Number of pushed samples waiting for a full frame.'''
+        return self.n_pending
+
+    def state_header(self):
+        '''
+        The header of get_state: STATE_VERSION, the sample rate, fft_size,
+        frame_size, the size in bytes of the dtype and a CRC-32 of the noise
+        estimator and gain classes and of the window, as float64 values.
+        '''
+        stages = f"{type(self.noise_estimator).__qualname__}/{type(self.suppression_gain).__qualname__}"
+        identity = zlib.crc32(self.win.astype(float).tobytes(), zlib.crc32(stages.encode()))
+        return [STATE_VERSION, self.sample_rate, self.fft_size, self.frame_size, self.dtype.itemsize, identity]
+
+    def get_state(self):
+        '''
+        The state of the noise estimator, the gain and the STFT buffers as one
+        flat float64 array, led by state_header(). state.tobytes() gives a
+        blob for storage or another process, which set_state accepts as well.
+        '''
+        header = self.state_header()
+        parts = [self.noise_estimator, self.suppression_gain, self]
+        state = np.empty(len(header) + sum(state_size(part) for part in parts))
+        state[:len(header)] = header
+        k = len(header)
+        for part in parts :
+            k += pack_state(part, state[k:])
+        return state
+
+    def set_state(self, state, buffers=True):
+        '''
+        Restore a state from get_state, as an array or as bytes. Processing
+        then continues exactly as in the suppressor it was taken from. With
+        buffers=False only the noise estimator and gain state are loaded and
+        the input and output buffers stay as they are: this warm starts a new
+        stream from a stored noise profile without the convergence period.
+        The state must come from a suppressor of the same sample rate, STFT,
+        dtype, noise estimator, gain and window, else ValueError is raised.
+        '''
+        if isinstance(state, (bytes, bytearray, memoryview)) :
+            state = np.frombuffer(state)
+        state = np.asarray(state, dtype=float)
+        header = self.state_header()
+        parts = [self.noise_estimator, self.suppression_gain] + ([self] if buffers else [])
+        if len(state) < len(header) or state[0] != STATE_VERSION :
+            raise ValueError(f"not a NoiseSuppressor state of version {STATE_VERSION}")
+        if list(state[1:4]) != header[1:4] :
+            raise ValueError(f"state of a {state[1]:g} Hz suppressor ({int(state[2])}/{int(state[3])}), "
+                             f"this one runs at {self.sample_rate:g} Hz ({self.fft_size}/{self.frame_size})")
+        if state[4] != header[4] :
+            raise ValueError(f"state of a {8*int(state[4])} bit suppressor, this one runs in {self.dtype}")
+        if state[5] != header[5] :
+            raise ValueError("state of a suppressor with another noise estimator, gain or window")
+        size = len(header) + sum(state_size(part) for part in [self.noise_estimator, self.suppression_gain, self])
+        if len(state) != size :
+            raise ValueError(f"state has {len(state)} elements, expected {size}")
+        k = len(header)
+        for part in parts :
+            k += unpack_state(part, state[k:])
+
+    def enable_stats(self, stats=None):
+        '''
+        Record per-stage timing and per-stream counters into stats (a new Stats
+        if None) and return it. The timed frame path replaces _process_frame
+        on this instance only, so a NoiseSuppressor without stats runs the
+        plain path.
+        '''
+        self.stats = Stats() if stats is None else stats
+        self._process_frame = self._process_frame_timed
+        return self.stats
+
+    def disable_stats(self):
+        self.stats = None
+        self.__dict__.pop('_process_frame', None)
+
+    def get_frame(self):
+        '''Current analysis frame, a view into the input ring.'''
+        return self.in_buffer[self.in_pos:self.in_pos+self.fft_size]
+
     def stft_analyze(self, audio):
         M = self.fft_size
         M21 = int(M/2+1)
         Mno = int(M - self.overlap_size)
 
-        self.in_buffer[:M-Mno] = self.in_buffer[Mno:M]    # update the frame of data
-        self.in_buffer[M-Mno:M] = audio 
-        signal_spec = np.zeros(M)
-        signal_power = np.zeros(M21)
+        # update the frame of data: the Mno oldest samples are replaced in both halves of the ring
+        p = self.in_pos
+        q = p + Mno
+        self.in_buffer[p:q] = audio
+        if q <= M :
+            self.in_buffer[p+M:q+M] = audio
+        else :
+            self.in_buffer[p+M:2*M] = audio[:M-p]
+            self.in_buffer[:q-M] = audio[M-p:]
+        self.in_pos = q % M
+        frame = self.get_frame()
+        signal_spec = self.signal_spec
+        signal_power = self.signal_power
+
+        # only the Mno new samples are scanned for the zero frame test
+        nonzero = np.greater(np.abs(audio, out=self.frame_buffer[:Mno]), self.zero_thres, out=self.frame_mask[:Mno])
+        last = Mno - 1 - np.argmax(nonzero[::-1])
+        if nonzero[last] :
+            self.zero_age = Mno - 1 - last
+        else :
+            self.zero_age = min(self.zero_age + Mno, M)
 
-        if ((self.fnz_flag==0 and abs(self.in_buffer[1])>zero_thres)) or \
-             (self.fnz_flag==1 and any(abs(self.in_buffer)>zero_thres)) :     
+        if ((self.fnz_flag==0 and abs(frame[1])>self.zero_thres)) or \
+             (self.fnz_flag==1 and self.zero_age < M) :
             self.fnz_flag = 1   
             # 1. Short Time Fourier Analysis
-            signal_spec = np.fft.fft(self.win * self.in_buffer)
-            signal_power = abs(signal_spec[:M21])**2
+            np.multiply(self.win, frame, out=self.frame_buffer)
+            if fft_out :
+                np.fft.rfft(self.frame_buffer, out=signal_spec)
+            else :
+                signal_spec[:] = np.fft.rfft(self.frame_buffer)
+            np.abs(signal_spec, out=signal_power)
+            np.square(signal_power, out=signal_power)
+        else :
+            signal_spec.fill(0)
+            signal_power.fill(0)
 
         return signal_spec, signal_power
 
-    #def stft_synthesize(self, audio): 
-
-    def process_frame(self, frame_data):
-
+    def stft_synthesize(self, X, out=None):
+        '''Overlap-add the frame of spectrum X and return the Mno samples that are complete.'''
         M = self.fft_size
-        M21 = int(M/2+1)
         Mno = int(M - self.overlap_size)
+        yout = np.empty(Mno, self.dtype) if out is None else out
+
+        if fft_out :
+            x = np.fft.irfft(X, M, out=self.x)
+        else :
+            x = self.x
+            x[:] = np.fft.irfft(X, M)
+        np.multiply(x, self.synthesis_win, out=x)
+        p = self.out_pos
+        q = p + Mno
+        self.out_buffer[p:M] += x[:M-p]
+        self.out_buffer[:p] += x[M-p:]
+        if q <= M :
+            yout[:] = self.out_buffer[p:q]
+            self.out_buffer[p:q] = 0   # update output frame
+        else :
+            yout[:M-p] = self.out_buffer[p:M]
+            yout[M-p:] = self.out_buffer[:q-M]
+            self.out_buffer[p:M] = 0   # update output frame
+            self.out_buffer[:q-M] = 0
+        self.out_pos = q % M
+        return yout
+
+    def process_frame(self, frame_data, out=None):
+        '''
+        Process one frame of frame_size samples. The output is written to out
+        if given, which makes the call free of allocations, else to a new array.
+        '''
+        self._check_not_drained()
+        self.samples_in += self.frame_size
+        self.samples_out += self.frame_size
+        return self._process_frame(frame_data, np.empty(self.frame_size, self.dtype) if out is None else out)
+
+    def _check_not_drained(self):
+        # only a drain produces more output than input
+        if self.samples_out > self.samples_in :
+            raise ValueError("the stream was drained by flush(drain=True), start a new NoiseSuppressor")
+
+    def _process_frame(self, frame_data, yout):
 
         #0 STFT Analysis
         signal_spec, signal_power = self.stft_analyze(frame_data)
-        yout = np.zeros(Mno)
 
         if self.fnz_flag == 1 :  
             #1 rough noise estimation
@@ -77,22 +357,189 @@ class NoiseSuppressor(object):
             #3 speech presence prabability estimation
             #4 precise noise estimation
             #5 a priori and posteri snr estimation
-            features= {'signal_power': signal_power, 
-                        'eta_2term': self.suppression_gain.get_eta()}
-            noise_power = self.noise_estimator.update(features)
-            
             #6 Update suppression gain
-            features= {'signal_power': signal_power, 
-                        'noise_power': noise_power}
-            gain = self.suppression_gain.update(features)
+            gain = self.processor.update(signal_power)
 
             #7 STFT Synthesis
-            X = gain * signal_spec[:M21]
-            x = self.win *np.fft.irfft(X)
-            self.out_buffer = self.out_buffer + x
-
-            yout = self.out_buffer[:Mno] * 1.0
-            self.out_buffer[:M-Mno] = self.out_buffer[Mno:M]   # update output frame
-            self.out_buffer[M-Mno:M] = np.zeros(Mno)   # update output frame
+            self.stft_synthesize(np.multiply(signal_spec, gain, out=self.X), yout)
+        else :
+            yout.fill(0)
         
-        return yout
\ No newline at end of file
+        return yout
+
+    def _process_frame_timed(self, frame_data, yout):
+        '''_process_frame with the stages timed into self.stats.'''
+        stats = self.stats
+        clock = time.perf_counter
+        t0 = clock()
+        signal_spec, signal_power = self.stft_analyze(frame_data)
+        stats.add_time('stft_analyze', clock() - t0)
+
+        if self.fnz_flag == 1 :
+            gain = self.processor.update_timed(signal_power, stats)
+            t1 = clock()
+            self.stft_synthesize(np.multiply(signal_spec, gain, out=self.X), yout)
+            stats.add_time('synthesis', clock() - t1)
+        else :
+            yout.fill(0)
+            stats.add_frame()
+
+        return yout
+
+    def push(self, chunk):
+        '''
+        Feed a chunk of any length. Returns the output samples that are ready,
+        a whole number of frames that may be empty. Samples that do not fill a
+        frame wait in the pending buffer for the next push or flush.
+        '''
+        self._check_not_drained()
+        chunk = np.asarray(chunk)
+        Mno = self.frame_size
+        n = self.n_pending
+        n_frames = (n + len(chunk)) // Mno
+        yout = np.empty(n_frames * Mno, self.dtype)
+        self.samples_in += len(chunk)
+        self.samples_out += len(yout)
+
+        k = 0
+        i = 0
+        if n and n_frames :
+            k = Mno - n
+            self.pending[n:] = chunk[:k]
+            self._process_frame(self.pending, yout[:Mno])
+            n = 0
+            i = 1
+        for i in range(i, n_frames) :
+            self._process_frame(chunk[k:k+Mno], yout[i*Mno:(i+1)*Mno])
+            k += Mno
+        self.pending[n:n+len(chunk)-k] = chunk[k:]
+        self.n_pending = n + len(chunk) - k
+        return yout
+
+    def flush(self, drain=False):
+        '''
+        End the stream: zero pad and process the pending samples and return the
+        rest of the output, so that samples_out equals samples_in. With drain,
+        also process the zeros needed to push the last get_delay() samples out.
+        Pushing after a flush continues the stream after the padding. A drain
+        finishes the stream: samples_out then exceeds samples_in, push,
+        process_frame and process_signal raise ValueError and another flush
+        returns nothing.
+        '''
+        Mno = self.frame_size
+        if self.samples_out > self.samples_in :
+            return np.zeros(0, self.dtype)
+        target = self.samples_in + (self.get_delay() if drain else 0)
+        outputs = []
+        generated = self.samples_out
+        while generated < target :
+            self.pending[self.n_pending:] = 0
+            self.n_pending = 0
+            outputs.append(self._process_frame(self.pending, np.empty(Mno, self.dtype)))
+            generated += Mno
+        yout = np.concatenate(outputs)[:target - self.samples_out] if outputs else np.zeros(0, self.dtype)
+        self.samples_out = target
+        return yout
+
+    def process_stream(self, chunks, drain=False):
+        '''Generator yielding the output of push for every chunk, then the output of flush.'''
+        for chunk in chunks :
+            yield self.push(chunk)
+        yield self.flush(drain)
+
+    def process_signal(self, x):
+        '''
+        Process a whole signal at once. The output matches process_frame called
+        on consecutive frames of x, except that the last partial frame is zero
+        padded and processed too, so len(x) samples are returned. State carries
+        over like for process_frame, so calls on consecutive parts of a signal
+        give the output of one call on all of it, as long as every part but
+        the last is a whole number of frames: after a padded frame, from this
+        or from flush, the stream is no longer aligned with its input and
+        process_signal raises ValueError, as it does while pushed samples are
+        pending, which would come out after x.
+        '''
+        M = self.fft_size
+        M21 = int(M/2+1)
+        Mno = int(M - self.overlap_size)
+        n_frames = -(-len(x) // Mno)
+        dtype = self.dtype
+        self._check_not_drained()
+        if self.n_pending :
+            raise ValueError(f"{self.n_pending} pushed samples are pending, push the rest of their frame "
+                             "or flush() before process_signal")
+        if self.samples_in % Mno :
+            raise ValueError(f"the stream ended on a zero padded frame after {self.samples_in} samples, "
+                             f"not a multiple of the frame size {Mno}")
+        yout = np.zeros(n_frames * Mno, dtype)
+        if n_frames == 0 :
+            return yout
+
+        self.samples_in += len(x)
+        self.samples_out += len(x)
+
+        # analysis frames as a strided view over the buffered and new samples
+        signal = np.zeros(M - Mno + n_frames * Mno, dtype)
+        signal[:M-Mno] = self.get_frame()[Mno:M]
+        signal[M-Mno:M-Mno+len(x)] = x
+        frames = sliding_window_view(signal, M)[::Mno]
+        self.in_buffer[:M] = frames[-1]
+        self.in_buffer[M:] = frames[-1]
+        self.in_pos = 0
+
+        # index of the last non-zero sample up to each sample of signal, -1 before the first
+        last_nonzero = np.where(np.abs(signal) > self.zero_thres, np.arange(len(signal)), -1)
+        np.maximum.accumulate(last_nonzero, out=last_nonzero)
+        self.zero_age = min(len(signal) - 1 - int(last_nonzero[-1]), M)
+
+        stats = self.stats
+        if stats is not None :
+            clock = time.perf_counter
+            t0 = clock()
+
+        start = 0
+        if self.fnz_flag == 0 :
+            nz = np.flatnonzero(np.abs(frames[:, 1]) > self.zero_thres)
+            start = nz[0] if len(nz) else len(frames)
+            if stats is not None :
+                for i in range(start) :
+                    stats.add_frame()
+            if len(nz) == 0 :
+                return yout[:len(x)]
+            self.fnz_flag = 1
+        frames = frames[start:]
+
+        #0 STFT Analysis
+        signal_spec = np.fft.rfft(self.win * frames)
+        # frame i covers signal[i*Mno:i*Mno+M]
+        frame_ends = np.arange(start, start + len(frames)) * Mno + M - 1
+        signal_spec[last_nonzero[frame_ends] < frame_ends - (M - 1)] = 0
+        signal_power = abs(signal_spec)**2
+
+        #1-6 noise estimation and suppression gain, recursive over frames
+        gain = np.empty(signal_power.shape, dtype)
+        if stats is not None :
+            stats.add_time('stft_analyze', clock() - t0, len(frames))
+        self.processor.process(signal_power, gain, stats=stats)
+        if stats is not None :
+            t1 = clock()
+
+        #7 STFT Synthesis, overlap-add of Mno sample blocks, oldest frame first
+        K = -(-M // Mno)
+        blocks = np.zeros((len(frames), K * Mno), dtype)
+        blocks[:, :M] = self.synthesis_win * np.fft.irfft(gain * signal_spec, M)
+        blocks = blocks.reshape(len(frames), K, Mno)
+        out = np.zeros(((len(frames) + K) * Mno), dtype)
+        out[:M-Mno] = np.roll(self.out_buffer, -self.out_pos)[:M-Mno]
+        out = out.reshape(len(frames) + K, Mno)
+        for i in range(K - 1, -1, -1) :
+            out[i:i+len(frames)] += blocks[:, i]
+        out = out.reshape(-1)
+
+        yout[start*Mno:] = out[:len(frames)*Mno]
+        self.out_buffer[:] = 0
+        self.out_buffer[:M-Mno] = out[len(frames)*Mno:len(frames)*Mno+M-Mno]
+        self.out_pos = 0
+        if stats is not None :
+            stats.add_time('synthesis', clock() - t1, len(frames))
+        return yout[:len(x)]
@@ -0,0 +1,508 @@
+#!/usr/bin/python
+
+import math
+import numpy as np
+from .noise_estimator import w, Nwin, delta_s, Bmin, delta_y, delta_yt, nonstat, b, eta_min
+from .suppression_gain import b_xi_local, P_min, xi_ll_dB, xi_lu_dB, xi_gl_dB, \
+    xi_gu_dB, xi_fl_dB, xi_fu_dB, xi_ml_dB, xi_mu_dB, q_max, broad_flag, G_f
+
+'''
+Fused IMCRA + OMLSA kernel compiled with Numba. ImcraNoiseEstimator.update
+followed by OmlsaGain.update becomes one compiled loop per frame, or per block
+of frames for process_signal. The kernel works on the state arrays of the
+estimator and gain objects, so both backends share one state. Compiled code
+is cached on disk (cache=True) next to this module.
+
+The kernel follows the NumPy code operation by operation. It is not bit
+identical: exp/log may come from a different libm, and np.convolve with the
+31 tap b_xi_global sums in a different order. The test suite bounds the
+difference.
+'''
+try:
+    import numba
+except ImportError:
+    numba = None
+
+available = numba is not None
+
+
+def _njit(function):
+    if numba is None:
+        return function
+    return numba.njit(cache=True)(function)
+
+
+# cephes expn constants, as used by scipy.special.expn
+MACHEP = 1.11022302462515654042e-16
+BIG = 4.503599627370496e15
+BIGINV = 2.22044604925031308085e-16
+EULER = 0.57721566490153286061
+
+
+@_njit
+def expn1(x):
+    '''E1(x) for x > 0, the cephes expn algorithm of scipy.special.expn for n = 1.'''
+    if x > 1.0:
+        # continued fraction
+        k = 1
+        pkm2 = 1.0
+        qkm2 = x
+        pkm1 = 1.0
+        qkm1 = x + 1.0
+        ans = pkm1 / qkm1
+        t = 1.0
+        while t > MACHEP:
+            k += 1
+            if k & 1:
+                yk = 1.0
+                xk = 1.0 + (k - 1) // 2
+            else:
+                yk = x
+                xk = float(k // 2)
+            pk = pkm1 * yk + pkm2 * xk
+            qk = qkm1 * yk + qkm2 * xk
+            if qk != 0:
+                r = pk / qk
+                t = abs((ans - r) / r)
+                ans = r
+            else:
+                t = 1.0
+            pkm2 = pkm1
+            pkm1 = pk
+            qkm2 = qkm1
+            qkm1 = qk
+            if abs(pk) > BIG:
+                pkm2 *= BIGINV
+                pkm1 *= BIGINV
+                qkm2 *= BIGINV
+                qkm1 *= BIGINV
+        return ans * math.exp(-x)
+
+    # power series
+    psi = -EULER - math.log(x)
+    z = -x
+    xk = 0.0
+    yk = 1.0
+    pk = 0.0
+    ans = 0.0
+    t = 1.0
+    while t > MACHEP:
+        xk += 1.0
+        yk *= z / xk
+        pk += 1.0
+        if pk != 0.0:
+            ans += yk / pk
+        if ans != 0.0:
+            t = abs(yk / ans)
+        else:
+            t = 1.0
+    return psi - ans
+
+
+@_njit
+def pairwise_block(a, lo, n):
+    '''Sum of a[lo:lo+n], n <= 128, with the 8 accumulators of NumPy's pairwise summation.'''
+    if n < 8:
+        res = 0.0
+        for i in range(lo, lo + n):
+            res += a[i]
+        return res
+    r0 = a[lo]
+    r1 = a[lo + 1]
+    r2 = a[lo + 2]
+    r3 = a[lo + 3]
+    r4 = a[lo + 4]
+    r5 = a[lo + 5]
+    r6 = a[lo + 6]
+    r7 = a[lo + 7]
+    m = n - n % 8
+    for i in range(lo + 8, lo + m, 8):
+        r0 += a[i]
+        r1 += a[i + 1]
+        r2 += a[i + 2]
+        r3 += a[i + 3]
+        r4 += a[i + 4]
+        r5 += a[i + 5]
+        r6 += a[i + 6]
+        r7 += a[i + 7]
+    res = ((r0 + r1) + (r2 + r3)) + ((r4 + r5) + (r6 + r7))
+    for i in range(lo + m, lo + n):
+        res += a[i]
+    return res
+
+
+@_njit
+def pairwise_sum(a, lo, n):
+    '''
+    Sum of a[lo:lo+n] in the order of NumPy's pairwise summation: halves
+    (rounded down to a multiple of 8) until at most 128 elements remain. The
+    recursion is unrolled into a stack of partial sums, as recursive
+    functions do not load reliably from the Numba cache.
+    '''
+    # (lo, n, state) with state 0: not started, 1: first half summed
+    los = np.empty(64, dtype=np.int64)
+    ns = np.empty(64, dtype=np.int64)
+    states = np.zeros(64, dtype=np.int64)
+    partial = np.empty(64)
+    result = 0.0
+    top = 0
+    los[0] = lo
+    ns[0] = n
+    states[0] = 0
+    while top >= 0:
+        n_top = ns[top]
+        if n_top <= 128:
+            result = pairwise_block(a, los[top], n_top)
+            top -= 1
+        elif states[top] == 0:
+            half = n_top // 2
+            half -= half % 8
+            states[top] = 1
+            los[top + 1] = los[top]
+            ns[top + 1] = half
+            states[top + 1] = 0
+            top += 1
+            continue
+        elif states[top] == 1:
+            half = n_top // 2
+            half -= half % 8
+            states[top] = 2
+            partial[top] = result
+            los[top + 1] = los[top] + half
+            ns[top + 1] = n_top - half
+            states[top + 1] = 0
+            top += 1
+            continue
+        else:
+            result = partial[top] + result
+            top -= 1
+        # a finished sum returns to its parent
+        while top >= 0 and states[top] == 2:
+            result = partial[top] + result
+            top -= 1
+    return result
+
+
+@_njit
+def smooth(x, kernel, out):
+    '''out = np.convolve(x, kernel)[w:len(x)+w] with w = len(kernel)//2.'''
+    M21 = len(x)
+    hw = len(kernel) // 2
+    for k in range(M21):
+        acc = 0.0
+        for j in range(len(kernel)):
+            i = k + hw - j
+            if 0 <= i < M21:
+                acc += kernel[j] * x[i]
+        out[k] = acc
+
+
+@_njit
+def interp(v, grid, h):
+    '''np.interp(v, grid, h) for grid[0] <= v <= grid[-1].'''
+    lo = 0
+    hi = len(grid) - 1
+    if v >= grid[hi]:
+        return h[hi]
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if grid[mid] <= v:
+            lo = mid
+        else:
+            hi = mid
+    slope = (h[lo + 1] - h[lo]) / (grid[lo + 1] - grid[lo])
+    return slope * (v - grid[lo]) + h[lo]
+
+
+@_njit
+def presence_probability(xi, xi_l_dB, xi_u_dB, P):
+    '''presence_probability(to_dB(xi), xi_l_dB, xi_u_dB) into P.'''
+    for k in range(len(xi)):
+        xi_dB = 10 * math.log10(xi[k]) if xi[k] > 0 else -100.0
+        if xi_dB <= xi_l_dB:
+            P[k] = P_min
+        elif xi_dB >= xi_u_dB:
+            P[k] = 1.0
+        else:
+            P[k] = (xi_dB - xi_l_dB) / (xi_u_dB - xi_l_dB) * (1 - P_min) + P_min
+
+
+@_njit
+def imcra_update(Ya2, eta_2term, counters, fparams, iparams, b,
+                 S, St, Smin, Smint, SMact, SW, SWt, lambda_d, lambda_dav, lambda_dav_long,
+                 eta, v, I_f, Sf, conv_I, conv_Y, phat):
+    '''One frame of ImcraNoiseEstimator.update. counters holds l, l_mod_lswitch, smint_is_st, sw_pos.'''
+    alpha_s, alpha_d, alpha_d_long, alpha_eta = fparams[0], fparams[1], fparams[2], fparams[3]
+    Vwin, Ninit = iparams[0], iparams[1]
+    M21 = len(Ya2)
+    l = counters[0] + 1
+    counters[0] = l
+
+    for k in range(M21):
+        gamma = Ya2[k] / max(lambda_d[k], 1e-10)
+        e = eta_2term[k] * alpha_eta + max(gamma - 1, 0.0) * (1 - alpha_eta)
+        e = max(e, eta_min)
+        eta[k] = e
+        v[k] = gamma * e / (e + 1)
+
+    smooth(Ya2, b, Sf)
+    if l == 1:
+        for k in range(M21):
+            S[k] = Sf[k]
+            St[k] = Sf[k]
+            lambda_dav[k] = Ya2[k]
+    else:
+        for k in range(M21):
+            S[k] = S[k] * alpha_s + Sf[k] * (1 - alpha_s)
+
+    for k in range(M21):
+        if l < Ninit:
+            Smin[k] = S[k]
+            SMact[k] = S[k]
+        else:
+            Smin[k] = min(Smin[k], S[k])
+            SMact[k] = min(SMact[k], S[k])
+        I_f[k] = 1.0 if (Ya2[k] < Smin[k] * (delta_y * Bmin)) and (S[k] < Smin[k] * (delta_s * Bmin)) else 0.0
+
+    # Local Minima Search
+    smooth(I_f, b, conv_I)
+    for k in range(M21):
+        Sf[k] = I_f[k] * Ya2[k]
+    smooth(Sf, b, conv_Y)
+    for k in range(M21):
+        if conv_I[k] > 0:
+            St[k] = conv_Y[k] / conv_I[k]
+        if l == 1:
+            # S, Smin and SMact are the same array as St on the first frame
+            S[k] = St[k]
+            Smin[k] = St[k]
+            SMact[k] = St[k]
+
+    if l < Ninit:
+        counters[2] = 1
+    smint_is_st = counters[2]
+    for k in range(M21):
+        if l < Ninit:
+            St[k] = S[k]
+            Smint[k] = St[k]
+        else:
+            # St = alpha_s * St + (1-alpha_s) * Sft, where Sft is St
+            St[k] = St[k] * alpha_s + St[k] * (1 - alpha_s)
+            if smint_is_st:
+                Smint[k] = St[k]
+            else:
+                Smint[k] = min(Smint[k], St[k])
+
+        Smin_ref = max(Smin[k] if nonstat == 'low' else Smint[k], 1e-10)
+        gamma_mint = Ya2[k] / Bmin / Smin_ref
+        zetat = S[k] / Bmin / Smin_ref
+        p = 0.0
+        if gamma_mint > 1 and gamma_mint < delta_yt and zetat < delta_s:
+            qhat = (delta_yt - gamma_mint) / (delta_yt - 1)
+            p = 1 / (qhat / (1 - qhat) * (eta[k] + 1) * math.exp(-v[k]) + 1)
+        if gamma_mint > delta_yt or zetat >= delta_s:
+            p = 1.0
+        phat[k] = p
+
+    counters[1] += 1
+    if counters[1] == Vwin:
+        counters[1] = 0
+        if l == Vwin:
+            for j in range(Nwin):
+                for k in range(M21):
+                    SW[j, k] = S[k]
+                    SWt[j, k] = St[k]
+        else:
+            pos = counters[3]
+            for k in range(M21):
+                SW[pos, k] = SMact[k]
+                SWt[pos, k] = St[k]
+                m = SW[0, k]
+                mt = SWt[0, k]
+                for j in range(1, Nwin):
+                    m = min(m, SW[j, k])
+                    mt = min(mt, SWt[j, k])
+                Smin[k] = m
+                Smint[k] = mt
+                SMact[k] = S[k]
+            counters[3] = (pos + 1) % Nwin
+            counters[2] = 0
+
+    for k in range(M21):
+        alpha_dt = phat[k] * (1 - alpha_d) + alpha_d
+        lambda_dav[k] = alpha_dt * lambda_dav[k] + (1 - alpha_dt) * Ya2[k]
+        if l < Ninit:
+            lambda_dav_long[k] = lambda_dav[k]
+        else:
+            alpha_dt_long = phat[k] * (1 - alpha_d_long) + alpha_d_long
+            lambda_dav_long[k] = alpha_dt_long * lambda_dav_long[k] + (1 - alpha_dt_long) * Ya2[k]
+        # 2.4. Noise Spectrum Estimate
+        if nonstat == 'high':
+            lambda_d[k] = lambda_dav[k] * 2
+        else:
+            lambda_d[k] = lambda_dav[k] * 1.4685
+
+
+@_njit
+def omlsa_update(Ya2, lambda_d, state, fparams, iparams, b_xi_global, table_grid, table_h,
+                 eta_2term, xi, gamma, eta, v, xi_local, xi_global, P_local, P_global, PH1, G):
+    '''One frame of OmlsaGain.update. state holds xi_frame, xi_m_dB and noise_only_frames.'''
+    alpha_eta, alpha_xi = fparams[4], fparams[5]
+    k_l, k_u, k2_local, k3_local = iparams[2], iparams[3], iparams[4], iparams[5]
+    M21 = len(Ya2)
+
+    for k in range(M21):
+        g = Ya2[k] / max(lambda_d[k], 1e-10)
+        e = eta_2term[k] * alpha_eta + max(g - 1, 0.0) * (1 - alpha_eta)
+        e = max(e, eta_min)
+        gamma[k] = g
+        eta[k] = e
+        v[k] = g * e / (e + 1)
+        # A Priori Probability for Signal-Absence Estimate
+        xi[k] = xi[k] * alpha_xi + e * (1 - alpha_xi)
+
+    dxi_frame = state[0]
+    state[0] = pairwise_sum(xi, k_l, k_u - k_l) / (k_u - k_l)
+    dxi_frame = state[0] - dxi_frame
+    xi_frame_dB = 10 * math.log10(state[0]) if state[0] > 0 else -100.0
+
+    if xi_frame_dB <= xi_fl_dB:
+        P_frame = P_min
+    elif dxi_frame >= 0:
+        state[1] = min(max(xi_frame_dB, xi_ml_dB), xi_mu_dB)
+        P_frame = 1.0
+    elif xi_frame_dB >= state[1] + xi_fu_dB:
+        P_frame = 1.0
+    elif xi_frame_dB <= state[1] + xi_fl_dB:
+        P_frame = P_min
+    else:
+        P_frame = P_min + (xi_frame_dB - state[1] - xi_fl_dB) / (xi_fu_dB - xi_fl_dB) * (1 - P_min)
+
+    noise_only = iparams[6] != 0 and P_frame == P_min
+    if noise_only:
+        state[2] += 1
+    else:
+        smooth(xi, b_xi_local, xi_local)
+        smooth(xi, b_xi_global, xi_global)
+        presence_probability(xi_local, xi_ll_dB, xi_lu_dB, P_local)
+        presence_probability(xi_global, xi_gl_dB, xi_gu_dB, P_global)
+
+        m_P_local = pairwise_sum(P_local, 2, k2_local + k3_local - 5) / (k2_local + k3_local - 5)
+        if m_P_local < 0.25:
+            for k in range(k2_local, k3_local):
+                P_local[k] = P_min
+
+    for k in range(M21):
+        p = 0.0
+        if not noise_only:
+            if broad_flag:
+                q = 1 - P_global[k] * P_local[k] * P_frame
+            else:
+                q = 1 - P_local[k] * P_frame
+            q = min(q, q_max)
+            if q < 0.9:
+                p = 1 / (q / (1 - q) * (eta[k] + 1) * math.exp(-v[k]) + 1)
+        PH1[k] = p
+
+        # Spectral Gain
+        eta_ratio = eta[k] / (eta[k] + 1)
+        if v[k] > 5:
+            GH1 = eta_ratio
+        elif v[k] > 0:
+            if len(table_grid):
+                GH1 = eta_ratio * (interp(v[k], table_grid, table_h) / math.sqrt(v[k]))
+            else:
+                GH1 = eta_ratio * math.exp(expn1(v[k]) * 0.5)
+        else:
+            GH1 = 1.0
+        G[k] = G_f if noise_only else GH1 ** p * G_f ** (1 - p)
+        eta_2term[k] = GH1 * GH1 * gamma[k]
+
+
+@_njit
+def fused_frames(Ya2, G_out, PH1_mean, counters, state, fparams, iparams, b, b_xi_global,
+                 table_grid, table_h,
+                 S, St, Smin, Smint, SMact, SW, SWt, lambda_d, lambda_dav, lambda_dav_long,
+                 est_eta, est_v, I_f, Sf, conv_I, conv_Y, phat,
+                 eta_2term, xi, gamma, eta, v, xi_local, xi_global, P_local, P_global, PH1, G):
+    '''IMCRA and OMLSA over the rows of Ya2. Gains go to the rows of G_out, mean PH1 to PH1_mean.'''
+    for i in range(Ya2.shape[0]):
+        imcra_update(Ya2[i], eta_2term, counters, fparams, iparams, b,
+                     S, St, Smin, Smint, SMact, SW, SWt, lambda_d, lambda_dav, lambda_dav_long,
+                     est_eta, est_v, I_f, Sf, conv_I, conv_Y, phat)
+        omlsa_update(Ya2[i], lambda_d, state, fparams, iparams, b_xi_global, table_grid, table_h,
+                     eta_2term, xi, gamma, eta, v, xi_local, xi_global, P_local, P_global, PH1, G)
+        G_out[i] = G
+        PH1_mean[i] = pairwise_sum(PH1, 0, len(PH1)) / len(PH1)
+
+
+class FusedKernel(object):
+    '''
+    Runs an ImcraNoiseEstimator and an OmlsaGain together with the compiled
+    kernel. The scalar state of the two objects is copied into small arrays
+    around each call, the array state is updated in place.
+    '''
+    def __init__(self, noise_estimator, suppression_gain):
+        if numba is None :
+            raise ImportError("the numba backend needs the numba package")
+        est = self.noise_estimator = noise_estimator
+        gain = self.suppression_gain = suppression_gain
+        M21 = est.M21
+        self.fparams = np.array([est.alpha_s, est.alpha_d, est.alpha_d_long, est.alpha_eta,
+                                 gain.alpha_eta, gain.alpha_xi])
+        self.iparams = np.array([est.Vwin, est.Ninit, gain.k_l, gain.k_u, gain.k2_local, gain.k3_local,
+                                 gain.fast_path])
+        self.b = np.asarray(b, dtype=float)
+        self.b_xi_global = np.asarray(gain.b_xi_global, dtype=float)
+        table = gain.expint_table
+        self.table_grid = np.zeros(0) if table is None else table.grid
+        self.table_h = np.zeros(0) if table is None else table.h
+        self.counters = np.zeros(4, dtype=np.int64)
+        self.state = np.zeros(3)
+        self.Sf = np.zeros(M21)
+        self.conv_I = np.zeros(M21)
+        self.conv_Y = np.zeros(M21)
+        self.xi_local = np.zeros(M21)
+        self.xi_global = np.zeros(M21)
+        self.PH1_mean = np.zeros(1)
+
+    def update_frames(self, Ya2, G_out, PH1_mean=None):
+        '''
+        IMCRA and OMLSA for the frames in the rows of Ya2, the gains written to
+        the rows of G_out and the mean speech presence probability of every
+        frame to PH1_mean if given.
+        '''
+        est = self.noise_estimator
+        gain = self.suppression_gain
+        counters, state = self.counters, self.state
+        counters[0] = est.l
+        counters[1] = est.l_mod_lswitch
+        counters[2] = est.smint_is_st
+        counters[3] = est.sw_pos
+        state[0] = gain.xi_frame
+        state[1] = gain.xi_m_dB
+        state[2] = gain.noise_only_frames
+        if PH1_mean is None :
+            PH1_mean = np.empty(len(Ya2)) if len(Ya2) > 1 else self.PH1_mean
+        fused_frames(Ya2, G_out, PH1_mean, counters, state, self.fparams, self.iparams, self.b, self.b_xi_global,
+                     self.table_grid, self.table_h,
+                     est.S, est.St, est.Smin, est.Smint, est.SMact, est.SW, est.SWt,
+                     est.lambda_d, est.lambda_dav, est.lambda_dav_long,
+                     est.eta, est.v, est.I_f, self.Sf, self.conv_I, self.conv_Y, est.phat,
+                     gain.eta_2term, gain.xi, gain.gamma, gain.eta, gain.v, self.xi_local, self.xi_global,
+                     gain.P_local, gain.P_global, gain.PH1, gain.G)
+        est.l = int(counters[0])
+        est.l_mod_lswitch = int(counters[1])
+        est.smint_is_st = bool(counters[2])
+        est.sw_pos = int(counters[3])
+        gain.xi_frame = float(state[0])
+        gain.xi_m_dB = float(state[1])
+        gain.noise_only_frames = int(state[2])
+        return G_out
+
+    def update(self, features):
+        '''One frame: sets features.noise_power and returns the gain, like the two NumPy updates.'''
+        G = self.suppression_gain.G
+        self.update_frames(features.signal_power[None, :], G[None, :])
+        features.noise_power = self.noise_estimator.lambda_d
+        return G
@@ -0,0 +1,352 @@
+#!/usr/bin/python
+
+import asyncio
+import logging
+import struct
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .batch_suppressor import BatchNoiseSuppressor
+
+'''
+Asyncio streaming service
+
+    python -m pns serve [--host 127.0.0.1] [--port 8765] [--sample-rate 16000]
+
+Protocol, over TCP: every message is a 4 byte big-endian length followed by
+that many bytes. A client sends little-endian float32 samples in messages of
+any length and an empty message to end its stream. The server answers with
+messages of denoised float32 samples, a whole number of frames each; after
+the end of the stream it sends the rest of the output, so that the client
+gets back as many samples as it sent, then an empty message, and closes the
+connection.
+
+All sessions are rows of one BatchNoiseSuppressor. Once a frame is queued,
+the scheduler waits up to batch_window seconds for frames of the other
+sessions, or until every session has one, and processes up to max_rounds
+frames of every session in one executor call, so the event loop only moves
+bytes. A session with max_pending_frames frames received but not yet sent
+back is not read until its backlog drains, which pushes back on the client
+through TCP flow control.
+
+If processing a batch raises, the error is logged and the connections of
+the sessions with frames in it are aborted, since their rows may be partly
+updated; the other sessions and the scheduler go on. A message that is not
+a whole number of samples is logged and aborts its session the same way.
+'''
+HEADER = struct.Struct('>I')
+SAMPLE = np.dtype('<f4')
+BATCH_WINDOW = 0.002
+MAX_ROUNDS = 10
+MAX_PENDING_FRAMES = 100
+# latencies kept per session for the percentiles
+LATENCY_WINDOW = 1000
+
+
+async def read_message(reader):
+    '''Payload of the next message, None if the connection ended without one.'''
+    try:
+        header = await reader.readexactly(HEADER.size)
+        return await reader.readexactly(HEADER.unpack(header)[0])
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+
+
+def write_message(writer, payload=b''):
+    writer.write(HEADER.pack(len(payload)))
+    if payload:
+        writer.write(payload)
+
+
+async def send_samples(writer, samples):
+    '''Client side: send samples, or end the stream if samples is None.'''
+    write_message(writer, b'' if samples is None else np.asarray(samples, dtype=SAMPLE).tobytes())
+    await writer.drain()
+
+
+async def read_samples(reader):
+    '''Client side: the next denoised samples, None at the end of the stream.'''
+    payload = await read_message(reader)
+    return np.frombuffer(payload, dtype=SAMPLE) if payload else None
+
+
+class Session(object):
+    '''One client stream: its row of the batch, queued frames and latency record.'''
+    def __init__(self, stream, frame_size, writer=None):
+        self.stream = stream
+        self.writer = writer
+        self.started = time.perf_counter()
+        self.frames = deque()    # (frame, arrival time)
+        self.pending = np.zeros(frame_size)
+        self.n_pending = 0
+        self.samples_in = 0
+        self.samples_out = 0
+        self.frames_out = 0
+        self.in_flight = 0       # frames received and not yet sent back
+        self.space = asyncio.Event()
+        self.output = asyncio.Queue()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.backpressure = 0    # times reading was paused
+        self.broken = False
+        self.failed = False      # a batch with its frames raised
+
+    def receive(self, samples, now):
+        '''Cut samples into frames behind the pending ones and queue them.'''
+        Mno = len(self.pending)
+        n = self.n_pending
+        self.samples_in += len(samples)
+        queued = len(self.frames)
+        k = 0
+        if n + len(samples) >= Mno :
+            k = Mno - n
+            self.pending[n:] = samples[:k]
+            self.frames.append((self.pending.copy(), now))
+            n = 0
+            while k + Mno <= len(samples) :
+                self.frames.append((samples[k:k+Mno].astype(float), now))
+                k += Mno
+        self.pending[n:n+len(samples)-k] = samples[k:]
+        self.n_pending = n + len(samples) - k
+        self.in_flight += len(self.frames) - queued
+
+    def finish(self, now):
+        '''Queue the pending samples zero padded to a frame.'''
+        if self.n_pending :
+            self.pending[self.n_pending:] = 0
+            self.frames.append((self.pending.copy(), now))
+            self.n_pending = 0
+            self.in_flight += 1
+
+    def fail(self):
+        '''Drop the queued frames and abort the connection, after a batch with frames of this session raised.'''
+        self.failed = True
+        self.frames.clear()
+        self.space.set()
+        if self.writer is not None :
+            self.writer.transport.abort()
+
+    def metrics(self):
+        '''Frames sent and the processing latency from arrival to send, in seconds.'''
+        latencies = np.array(self.latencies)
+        return {
+            'frames': self.frames_out,
+            'samples_in': self.samples_in,
+            'samples_out': self.samples_out,
+            'in_flight': self.in_flight,
+            'backpressure': self.backpressure,
+            'latency_mean': self.latency_sum / max(self.frames_out, 1),
+            'latency_p50': float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+            'latency_p99': float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+            'latency_max': self.latency_max,
+        }
+
+
+class Server(object):
+    '''
+    Many concurrent sessions on one BatchNoiseSuppressor, see the module
+    docstring. start() listens and returns the port, close() stops.
+    '''
+    def __init__(self, sample_rate=16000, batch_window=BATCH_WINDOW, max_rounds=MAX_ROUNDS,
+                 max_pending_frames=MAX_PENDING_FRAMES):
+        self.sample_rate = sample_rate
+        self.batch_window = batch_window
+        self.max_rounds = max_rounds
+        self.max_pending_frames = max_pending_frames
+        self.batch = BatchNoiseSuppressor(sample_rate, 0)
+        self.frame_size = self.batch.get_frame_size()
+        # one worker: the batch state must not be updated concurrently
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.sessions = {}
+        self.finished = deque(maxlen=LATENCY_WINDOW)   # metrics of closed sessions
+        self.batches = 0
+        self.batch_frames = 0
+        self.batch_time = 0.0
+        self.failed_batches = 0
+        self.server = None
+        self.scheduler = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        # the lock is held while the batch runs, sessions join and leave in between
+        self.lock = asyncio.Lock()
+        self.ready = asyncio.Event()   # some session has frames
+        self.full = asyncio.Event()    # every session has frames
+        self.scheduler = asyncio.create_task(self._schedule())
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.scheduler.cancel()
+        try :
+            await self.scheduler
+        except asyncio.CancelledError :
+            pass
+        self.executor.shutdown()
+
+    def metrics(self):
+        return {
+            'sessions': len(self.sessions),
+            'batches': self.batches,
+            'frames': self.batch_frames,
+            'frames_per_batch': self.batch_frames / max(self.batches, 1),
+            'batch_time': self.batch_time,
+            'failed_batches': self.failed_batches,
+            'active': {session.stream: session.metrics() for session in self.sessions.values()},
+            'finished': list(self.finished),
+        }
+
+    def _wake(self):
+        self.ready.set()
+        if all(session.frames for session in self.sessions.values()) :
+            self.full.set()
+
+    async def _handle(self, reader, writer):
+        async with self.lock :
+            stream = int(self.batch.add_stream())
+        session = self.sessions[stream] = Session(stream, self.frame_size, writer)
+        sender = asyncio.create_task(self._send(session, writer))
+        try :
+            while True :
+                payload = await read_message(reader)
+                if not payload or session.failed :
+                    break
+                if len(payload) % SAMPLE.itemsize :
+                    logging.error(f"session {stream}: message of {len(payload)} bytes is not whole samples")
+                    session.fail()
+                    break
+                session.receive(np.frombuffer(payload, dtype=SAMPLE), time.perf_counter())
+                self._wake()
+                if session.in_flight >= self.max_pending_frames :
+                    session.backpressure += 1
+                    while session.in_flight >= self.max_pending_frames and not session.failed :
+                        session.space.clear()
+                        await session.space.wait()
+            if payload is not None and not session.failed :
+                # end of stream: zero pad the last frame, send everything back
+                session.finish(time.perf_counter())
+                self._wake()
+                while session.in_flight and not session.failed :
+                    session.space.clear()
+                    await session.space.wait()
+                if not session.failed :
+                    session.output.put_nowait(None)
+                    await sender
+        finally :
+            sender.cancel()
+            async with self.lock :
+                del self.sessions[stream]
+                self.batch.remove_stream(stream)
+            self.finished.append(session.metrics())
+            writer.close()
+            try :
+                await writer.wait_closed()
+            except ConnectionError :
+                pass
+
+    async def _send(self, session, writer):
+        while True :
+            item = await session.output.get()
+            if item is None :
+                write_message(writer)
+                await writer.drain()
+                return
+            samples, arrivals = item
+            # the zero padding of the last frame is not sent
+            samples = samples[:session.samples_in - session.samples_out]
+            session.samples_out += len(samples)
+            if not session.broken :
+                try :
+                    write_message(writer, samples.astype(SAMPLE).tobytes())
+                    await writer.drain()
+                except ConnectionError :
+                    session.broken = True
+            latencies = time.perf_counter() - arrivals
+            session.latencies.extend(latencies)
+            session.latency_sum += float(latencies.sum())
+            session.latency_max = max(session.latency_max, float(latencies.max()))
+            session.frames_out += len(arrivals)
+            session.in_flight -= len(arrivals)
+            session.space.set()
+
+    async def _schedule(self):
+        loop = asyncio.get_running_loop()
+        while True :
+            await self.ready.wait()
+            if not self.full.is_set() :
+                try :
+                    await asyncio.wait_for(self.full.wait(), self.batch_window)
+                except asyncio.TimeoutError :
+                    pass
+            self.ready.clear()
+            self.full.clear()
+            async with self.lock :
+                taken, rounds = self._take()
+                if not rounds :
+                    continue
+                start = time.perf_counter()
+                try :
+                    outputs = await loop.run_in_executor(self.executor, self._process, rounds)
+                except Exception :
+                    # the rows of these sessions may be partly updated: end
+                    # them, the other sessions go on
+                    logging.exception(f"batch of {len(taken)} sessions failed")
+                    self.failed_batches += 1
+                    for session, _ in taken :
+                        session.fail()
+                    outputs = None
+                finally :
+                    self.batch_time += time.perf_counter() - start
+            if outputs is not None :
+                self.batches += 1
+                self.batch_frames += sum(len(streams) for streams, _ in rounds)
+                # row i of round r is frame r of the i-th session that has r+1 frames
+                for i, (session, arrivals) in enumerate(taken) :
+                    samples = np.concatenate([outputs[r][i] for r in range(len(arrivals))])
+                    session.output.put_nowait((samples, np.array(arrivals)))
+            if any(session.frames for session in self.sessions.values()) :
+                self._wake()
+
+    def _take(self):
+        '''Pop up to max_rounds frames per session: [(session, arrivals)] and [(streams, frames)] per round.'''
+        taken = []
+        frames = []
+        for session in self.sessions.values() :
+            n = min(len(session.frames), self.max_rounds)
+            if n :
+                popped = [session.frames.popleft() for _ in range(n)]
+                taken.append((session, [arrival for _, arrival in popped]))
+                frames.append([frame for frame, _ in popped])
+        # sessions with the most frames first, so that round r is a prefix of them
+        order = sorted(range(len(taken)), key=lambda i: -len(frames[i]))
+        taken = [taken[i] for i in order]
+        frames = [frames[i] for i in order]
+        rounds = []
+        for r in range(len(frames[0]) if frames else 0) :
+            n = sum(len(f) > r for f in frames)
+            rounds.append((np.array([session.stream for session, _ in taken[:n]]),
+                           np.array([f[r] for f in frames[:n]])))
+        return taken, rounds
+
+    def _process(self, rounds):
+        return [self.batch.process_frame(block, streams) for streams, block in rounds]
+
+
+async def serve(host='127.0.0.1', port=8765, sample_rate=16000, batch_window=BATCH_WINDOW,
+                max_rounds=MAX_ROUNDS, max_pending_frames=MAX_PENDING_FRAMES, on_start=None):
+    '''Run a Server until cancelled and return its metrics. on_start is called with the port.'''
+    server = Server(sample_rate, batch_window, max_rounds, max_pending_frames)
+    port = await server.start(host, port)
+    logging.info(f"serving on {host}:{port}, {sample_rate} Hz")
+    if on_start is not None :
+        on_start(port)
+    try :
+        await asyncio.Event().wait()
+    except asyncio.CancelledError :
+        pass
+    finally :
+        await server.close()
+    return server.metrics()
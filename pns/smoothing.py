@@ -0,0 +1,38 @@
+#!/usr/bin/python
+
+import numpy as np
+
+'''
+Frequency smoothing of the IMCRA and OMLSA recursions.
+'''
+
+
+class Smoother(object):
+    '''
+    np.convolve(x, kernel)[w:len(x)+w] with w = len(kernel)//2, for a kernel
+    fixed at construction. An identity kernel such as b = [0, 1, 0] returns
+    x itself: its zero taps only add exact zeros for the finite inputs of the
+    recursions, so the result is bit-identical without any arithmetic. Other
+    kernels run np.convolve in 'same' mode, which computes the same sums
+    without the 2*w edge samples of the full convolution; numpy has no out=
+    for it and no other vectorized form reproduces its summation order.
+    The kernel is stored as dtype, so that float32 inputs stay float32. The
+    rows of a 2-D x, the streams of BatchNoiseSuppressor, are smoothed one by
+    one, so that each is bit-identical with the 1-D result.
+    '''
+    def __init__(self, kernel, dtype=np.float64):
+        self.kernel = np.asarray(kernel, dtype=dtype)
+        self.w = len(self.kernel) // 2
+        self.identity = len(self.kernel) % 2 == 1 and self.kernel[self.w] == 1 \
+            and not np.any(np.delete(self.kernel, self.w))
+
+    def __call__(self, x):
+        '''The smoothed x, x itself for an identity kernel: read it, do not write to it.'''
+        if self.identity :
+            return x
+        if np.ndim(x) == 2 :
+            out = np.empty(np.shape(x), np.result_type(x, self.kernel))
+            for i, row in enumerate(x) :
+                out[i] = np.convolve(row, self.kernel, mode='same')
+            return out
+        return np.convolve(x, self.kernel, mode='same')
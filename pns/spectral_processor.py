@@ -0,0 +1,177 @@
+#!/usr/bin/python
+
+import time
+import numpy as np
+from .noise_estimator import ImcraNoiseEstimator, noise_estimators
+from .suppression_gain import OmlsaGain, Features, suppression_gains
+from . import numba_backend
+
+'''
+Spectral-domain core of NoiseSuppressor, for callers that compute their own STFT.
+'''
+
+
+def fusable(noise_estimator='imcra', suppression_gain='omlsa', dtype=np.float64):
+    '''Whether the numba backend runs this noise estimator and gain, by registry name or class, in dtype.'''
+    estimator_class = noise_estimators.get(noise_estimator, noise_estimator)
+    gain_class = suppression_gains.get(suppression_gain, suppression_gain)
+    return isinstance(estimator_class, type) and issubclass(estimator_class, ImcraNoiseEstimator) and \
+        isinstance(gain_class, type) and issubclass(gain_class, OmlsaGain) and np.dtype(dtype) == np.float64
+
+
+def resolve_backend(backend, noise_estimator='imcra', suppression_gain='omlsa', dtype=np.float64):
+    '''The backend a SpectralProcessor with these arguments runs, 'auto' resolved to 'numba' or 'numpy'.'''
+    if backend != 'auto' :
+        return backend
+    return 'numba' if numba_backend.available and fusable(noise_estimator, suppression_gain, dtype) else 'numpy'
+
+
+class SpectralProcessor(object):
+    '''
+    Noise estimation and suppression gain on power spectra |X|**2 of
+    fft_size//2+1 bins, one STFT frame every frame_size samples at
+    sample_rate. The time constants follow the hop and the frequency
+    smoothing the bin width, as in NoiseSuppressor; the spectra should come
+    from a window of about the default overlap-add gain (a Hamming window
+    of fft_size samples).
+
+    process takes one frame, shape (bins,), or a block, shape (frames, bins),
+    and returns the gain; with stats, a pns.instrumentation.Stats, the stages
+    are timed and the frames counted into it. Arrays of the processor's dtype are read in place,
+    never copied; others are converted once. After every call
+    get_noise_power() and get_speech_presence() are the arrays of the last
+    frame, updated in place.
+
+    backend, noise_estimator, suppression_gain, expint_table, fast_path and
+    dtype are the ones of NoiseSuppressor, which wraps a SpectralProcessor.
+    '''
+    def __init__(self, sample_rate, fft_size, frame_size, expint_table=False, backend='numpy', fast_path=False,
+                 noise_estimator='imcra', suppression_gain='omlsa', dtype=np.float64):
+        self.sample_rate = sample_rate
+        self.fft_size = fft_size
+        self.frame_size = frame_size
+        self.bins = fft_size // 2 + 1
+        self.dtype = dtype = np.dtype(dtype)
+        if dtype not in (np.float64, np.float32) :
+            raise ValueError(f"dtype {dtype} is not float64 or float32")
+        estimator_class = noise_estimators.get(noise_estimator, noise_estimator)
+        gain_class = suppression_gains.get(suppression_gain, suppression_gain)
+        if not isinstance(estimator_class, type) :
+            raise ValueError(f"unknown noise estimator {noise_estimator!r}, one of {sorted(noise_estimators)}")
+        if not isinstance(gain_class, type) :
+            raise ValueError(f"unknown suppression gain {suppression_gain!r}, one of {sorted(suppression_gains)}")
+        # classes only get a dtype argument in float32, so that float64 ones may omit it
+        precision = {} if dtype == np.float64 else {'dtype': dtype}
+        self.noise_estimator = estimator_class(sample_rate, fft_size, frame_size, **precision)
+        if issubclass(gain_class, OmlsaGain) :
+            self.suppression_gain = gain_class(sample_rate, fft_size, frame_size, expint_table, fast_path,
+                                               **precision)
+        elif expint_table or fast_path :
+            raise ValueError("expint_table and fast_path only apply to the OMLSA gain")
+        else :
+            self.suppression_gain = gain_class(sample_rate, fft_size, frame_size, **precision)
+        # speech presence probability: OMLSA's PH1, else the estimator's
+        self.speech_presence = getattr(self.suppression_gain, 'PH1', None)
+        if self.speech_presence is None :
+            self.speech_presence = getattr(self.noise_estimator, 'phat', None)
+        backend = resolve_backend(backend, estimator_class, gain_class, dtype)
+        if backend == 'numba' and not fusable(estimator_class, gain_class, dtype) :
+            raise ValueError("the numba backend runs IMCRA with OMLSA in float64 only")
+        if backend == 'numba' :
+            self.kernel = numba_backend.FusedKernel(self.noise_estimator, self.suppression_gain)
+        elif backend == 'numpy' :
+            self.kernel = None
+        else :
+            raise ValueError(f"unknown backend {backend!r}")
+        self.backend = backend
+        self.features = Features(eta_2term=self.suppression_gain.get_eta())
+
+    def get_bins(self):
+        return self.bins
+
+    def get_noise_power(self):
+        '''Noise power estimate lambda_d of the last frame, updated in place.'''
+        return self.features.noise_power
+
+    def get_speech_presence(self):
+        '''Speech presence probability of the last frame, updated in place, or None for custom stages without one.'''
+        return self.speech_presence
+
+    def update(self, signal_power):
+        '''
+        One frame of signal_power, used as is: returns the gain array of the
+        suppression gain, valid until the next frame.
+        '''
+        features = self.features
+        features.signal_power = signal_power
+        if self.kernel is None :
+            features.noise_power = self.noise_estimator.update(features)
+            return self.suppression_gain.update(features)
+        return self.kernel.update(features)
+
+    def update_timed(self, signal_power, stats):
+        '''update with the noise estimation and the gain timed into stats and the frame counted.'''
+        clock = time.perf_counter
+        features = self.features
+        features.signal_power = signal_power
+        t1 = clock()
+        if self.kernel is None :
+            features.noise_power = self.noise_estimator.update(features)
+            t2 = clock()
+            gain = self.suppression_gain.update(features)
+        else :
+            # the fused kernel is counted as noise estimation
+            gain = self.kernel.update(features)
+            t2 = clock()
+        t3 = clock()
+        stats.add_time('noise_estimation', t2 - t1)
+        stats.add_time('gain', t3 - t2)
+        stats.add_frame(gain, self.speech_presence)
+        return gain
+
+    def process(self, power, out=None, noise_power=None, speech_presence=None, stats=None):
+        '''
+        Gain for one power spectrum frame (bins,) or a block (frames, bins),
+        in time order. The gain goes to out if given; otherwise a single frame
+        returns the processor's own gain array, valid until the next call,
+        and a block a new array. noise_power and speech_presence, arrays
+        shaped like power, receive the noise estimate and the speech presence
+        probability of every frame if given.
+        '''
+        power = np.asarray(power, dtype=self.dtype)
+        if power.shape[-1:] != (self.bins,) or power.ndim > 2 :
+            raise ValueError(f"power spectra of shape {power.shape}, expected (frames, {self.bins}) "
+                             f"or ({self.bins},)")
+        if speech_presence is not None and self.speech_presence is None :
+            raise ValueError("the noise estimator and gain give no speech presence probability")
+        update = self.update if stats is None else lambda frame: self.update_timed(frame, stats)
+        if power.ndim == 1 :
+            gain = update(power)
+            if noise_power is not None :
+                noise_power[:] = self.features.noise_power
+            if speech_presence is not None :
+                speech_presence[:] = self.speech_presence
+            if out is None :
+                return gain
+            out[:] = gain
+            return out
+
+        out = np.empty(power.shape, self.dtype) if out is None else out
+        if self.kernel is not None and noise_power is None and speech_presence is None :
+            # all frames in one compiled call, counted as noise estimation
+            if stats is None :
+                return self.kernel.update_frames(power, out)
+            t1 = time.perf_counter()
+            PH1_mean = np.empty(len(power))
+            self.kernel.update_frames(power, out, PH1_mean)
+            stats.add_time('noise_estimation', time.perf_counter() - t1, len(power))
+            for i in range(len(power)) :
+                stats.add_frame(out[i], PH1_mean[i])
+            return out
+        for i in range(len(power)) :
+            out[i] = update(power[i])
+            if noise_power is not None :
+                noise_power[i] = self.features.noise_power
+            if speech_presence is not None :
+                speech_presence[i] = self.speech_presence
+        return out
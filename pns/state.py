@@ -0,0 +1,47 @@
+#!/usr/bin/python
+
+import numpy as np
+
+'''
+Flat float64 state vectors of the stateful classes. Every class lists the
+attributes that carry over between frames in state_names; scalars take one
+element and arrays their size, in that order. Integer counters stay exact up
+to 2**53.
+'''
+STATE_VERSION = 3
+
+
+def state_size(obj):
+    return sum(np.size(getattr(obj, name)) for name in obj.state_names)
+
+
+def pack_state(obj, out):
+    '''Write the state of obj to the start of out and return the number of elements written.'''
+    k = 0
+    for name in obj.state_names:
+        value = getattr(obj, name)
+        n = np.size(value)
+        if isinstance(value, np.ndarray):
+            out[k:k+n] = value.ravel()
+        else:
+            out[k] = value
+        k += n
+    return k
+
+
+def unpack_state(obj, state):
+    '''
+    Load the state of obj from the start of state and return the number of
+    elements read. Arrays are overwritten in place, so views of them held
+    elsewhere stay valid; scalars keep their type.
+    '''
+    k = 0
+    for name in obj.state_names:
+        value = getattr(obj, name)
+        n = np.size(value)
+        if isinstance(value, np.ndarray):
+            value[...] = state[k:k+n].reshape(value.shape)
+        else:
+            setattr(obj, name, type(value)(state[k]))
+        k += n
+    return k
@@ -1,15 +1,12 @@
 import numpy as np
-from numpy import matlib
 from scipy.special import expn
+from .smoothing import Smoother
+from .noise_estimator import Fs_ref, M_ref, Mo_ref, Mno_ref
 
 '''
 Constants
 '''
-# 1) Parameters of Short Time Fourier Analysis:
-Fs_ref = 16e3		# 1.1) Reference Sampling frequency
-M_ref = 512		# 1.2) Size of analysis window
-#Mo_ref = 0.75*M_ref	# 1.3) Number of overlapping samples in consecutive frames
-Mo_ref = 352
+# 1) Parameters of Short Time Fourier Analysis: Fs_ref, M_ref, Mo_ref and Mno_ref of noise_estimator
 
 # 3) Parameters of a Priori Probability for Signal-Absence Estimate
 alpha_xi_ref = 0.7	# 3.1) Recursive averaging parameter
@@ -37,14 +34,6 @@ broad_flag = 1               # broad band flag   # new version
 tone_flag = 0                # pure tone flag   # new version
 nonstat = 'medium'                #Non stationarity  # new version
 
-Fs = Fs_ref
-M = int(M_ref)
-Mo = int(Mo_ref)
-Mno = int(M-Mo)
-alpha_eta = alpha_eta_ref
-alpha_xi = alpha_xi_ref
-
-alpha_d_long = 0.99
 eta_min = 10**(eta_min_dB/10)
 G_f = eta_min**0.5	   # Gain floor
 
@@ -52,98 +41,253 @@ G_f = eta_min**0.5	   # Gain floor
 ##b_xi_local = hanning(2*w_xi_local+1)
 #b_xi_local = b_xi_local/sum(b_xi_local)  # normalize the window function
 b_xi_local = np.array([0, 1, 0])
-#b_xi_global = hanning(2*w_xi_global+1)
-#b_xi_global = b_xi_global/sum(b_xi_global)   # normalize the window function
-b_xi_global = np.array([0, 0.000728, 0.002882, 0.006366, 0.011029, 0.016667, 0.023033, 0.029849, 0.036818, 0.043634, 0.050000, 0.055638, 0.060301, 0.063785, 0.065938, 0.066667, 0.065938, 0.063785, 0.060301, 0.055638, 0.050000, 0.043634, 0.036818, 0.029849, 0.023033, 0.016667, 0.011029, 0.006366, 0.002882, 0.000728, 0
-])
 
+def hanning_kernel(w):
+    '''
+    Normalized 2*w+1 tap Hanning window, rounded to 6 decimals. For w = 15 this
+    is the b_xi_global table of the reference implementation.
+    '''
+    b = np.hanning(2*w+1)
+    return np.round(b/np.sum(b), 6)
+
+def to_dB(x, out=None, mask=None):
+    '''10*log10(x) for positive entries, -100 dB elsewhere.'''
+    x_dB = np.empty(np.shape(x)) if out is None else out
+    idx = np.greater(x, 0, out=mask)
+    x_dB.fill(-100)
+    np.log10(x, out=x_dB, where=idx)
+    np.multiply(x_dB, 10, out=x_dB, where=idx)
+    return x_dB
+
+def presence_probability(xi_dB, xi_l_dB, xi_u_dB, out=None, mask=None):
+    '''Map a smoothed a priori SNR in dB to a speech presence probability in [P_min, 1].'''
+    # P_min + (xi_dB-xi_l_dB) / (xi_u_dB-xi_l_dB) * (1-P_min) between the thresholds
+    P = np.subtract(xi_dB, xi_l_dB, out=out)
+    np.divide(P, xi_u_dB-xi_l_dB, out=P)
+    np.multiply(P, 1-P_min, out=P)
+    np.add(P, P_min, out=P)
+    np.copyto(P, P_min, where=np.less_equal(xi_dB, xi_l_dB, out=mask))
+    np.copyto(P, 1, where=np.greater_equal(xi_dB, xi_u_dB, out=mask))
+    return P
+
+class ExpintTable(object):
+    '''
+    exp(0.5*E1(v)) for 0 < v <= 5, the range used by the OMLSA gain, from a
+    table. E1(v) + ln(v) is smooth down to v = 0, so h(v) = sqrt(v)*exp(0.5*E1(v))
+    is interpolated linearly on n uniform intervals and divided by sqrt(v).
+    The relative error is about 0.1/n**2, 9.7e-8 for the default n = 1024;
+    max_error holds the value measured on a grid 16 times finer than the table.
+    '''
+    v_max = 5
+
+    def __init__(self, n=1024):
+        self.grid = np.linspace(0, self.v_max, n+1)
+        self.h = np.empty(n+1)
+        self.h[0] = np.exp(-0.5*np.euler_gamma)    # E1(v) + ln(v) -> -euler_gamma
+        self.h[1:] = np.sqrt(self.grid[1:]) * np.exp(0.5*expn(1, self.grid[1:]))
+        v = np.linspace(0, self.v_max, 16*n+1)[1:]
+        self.max_error = np.max(np.abs(self(v) / np.exp(0.5*expn(1, v)) - 1))
+
+    def __call__(self, v, out=None, where=True, scratch=None):
+        '''Evaluate at v into out where `where` is set. scratch is a work array shaped like v.'''
+        out = np.empty(np.shape(v)) if out is None else out
+        scratch = np.empty(np.shape(v)) if scratch is None else scratch
+        np.copyto(out, np.interp(v, self.grid, self.h), where=where)
+        np.sqrt(v, out=scratch, where=where)
+        np.divide(out, scratch, out=out, where=where)
+        return out
+
+class Features(object):
+    '''
+    Per-frame quantities passed between the stages of NoiseSuppressor. The
+    arrays are owned by the stage that computes them and updated in place.
+    '''
+    __slots__ = ('signal_power', 'noise_power', 'eta_2term')
+
+    def __init__(self, signal_power=None, noise_power=None, eta_2term=None):
+        self.signal_power = signal_power
+        self.noise_power = noise_power
+        self.eta_2term = eta_2term
+
+class OmlsaParameters(object):
+    '''
+    OMLSA constants for one sample rate and STFT configuration. Recursive
+    averaging parameters are rescaled from the 10 ms reference hop to the
+    actual hop, and the global smoothing window and the decision bands keep
+    their width in Hz.
+    '''
+    def __init__(self, sample_rate, fft_size, frame_size=None):
+        if frame_size is None :
+            frame_size = round(sample_rate*Mno_ref/Fs_ref)
+        self.fs = sample_rate
+        self.fft_size = fft_size
+        self.frame_size = frame_size
+        self.M21 = int(fft_size/2+1)
+
+        hop_scale = (frame_size/sample_rate) / (Mno_ref/Fs_ref)
+        self.alpha_eta = alpha_eta_ref**hop_scale
+        self.alpha_xi = alpha_xi_ref**hop_scale
+
+        bin_scale = (Fs_ref/M_ref) / (sample_rate/fft_size)
+        self.w_xi_global = max(round(w_xi_global*bin_scale), 1)
+        self.b_xi_global = hanning_kernel(self.w_xi_global)
 
-M21 = int(M/2+1)
-k_u = round(f_u/Fs*M+1)  # Upper frequency bin for global decision
-k_l = round(f_l/Fs*M+1)  # Lower frequency bin for global decision
-k_u = min(k_u,M21)
-k2_local=round(500/Fs*M+1)
-k3_local = round(3500/Fs*M+1)
+        Fs = sample_rate
+        M = fft_size
+        self.k_u = min(round(f_u/Fs*M+1), self.M21)  # Upper frequency bin for global decision
+        self.k_l = round(f_l/Fs*M+1)  # Lower frequency bin for global decision
+        self.k2_local = round(500/Fs*M+1)
+        self.k3_local = round(3500/Fs*M+1)
 
 class SuppressionGain(object):
     def update(self, features):
         pass
 
-class WienerGain(SuppressionGain):
+class WienerGain(SuppressionGain, OmlsaParameters):
+    '''
+    Wiener gain G = eta/(1+eta) on the decision-directed a priori SNR eta
+    of OmlsaGain, floored at G_f. No speech presence probability and no
+    exponential integral: a fraction of the cost of OMLSA, with more
+    musical noise. update returns the G array of the gain, of dtype.
+    '''
+    state_names = ('eta_2term',)
+
+    def __init__(self, sample_rate, fft_size, frame_size=None, dtype=np.float64):
+        OmlsaParameters.__init__(self, sample_rate, fft_size, frame_size)
+        M21 = self.M21
+        self.dtype = dtype = np.dtype(dtype)
+        self.eta_2term = np.ones(M21, dtype)
+
+        # scratch
+        self.gamma = np.zeros(M21, dtype)
+        self.eta = np.zeros(M21, dtype)
+        self.G = np.zeros(M21, dtype)
+        self.tmp = np.zeros(M21, dtype)
+
     def update(self, features):
-        '''
-        ksi : a priori snr
-        '''
-        gain = features.ksi / (1 + features.ksi) 
-        return gain
-
-class OmlsaGain(SuppressionGain):
-    def __init__(self, sample_rate, fft_size):
-        self.fs = sample_rate
-        self.fft_size = fft_size
-        self.M21 = int(fft_size/2+1)
-        self.eta_2term = np.ones(M21) 
-        self.xi = np.ones(M21) 
-        self.xi_frame = 0
-        self.xi_m_dB = 0
+        Ya2 = features.signal_power
+        lambda_d = features.noise_power
+        alpha_eta = self.alpha_eta
+        gamma, eta, G, tmp = self.gamma, self.eta, self.G, self.tmp
+
+        # gamma = Ya2 / max(lambda_d, 1e-10), post_snr
+        np.maximum(lambda_d, 1e-10, out=tmp)
+        np.divide(Ya2, tmp, out=gamma)
+        # eta = alpha_eta*eta_2term + (1-alpha_eta)*max(gamma-1,0), prior_snr
+        np.subtract(gamma, 1, out=tmp)
+        np.maximum(tmp, 0, out=tmp)
+        np.multiply(tmp, 1-alpha_eta, out=tmp)
+        np.multiply(self.eta_2term, alpha_eta, out=eta)
+        np.add(eta, tmp, out=eta)
+        np.maximum(eta, eta_min, out=eta)
+
+        # G = max(eta/(1+eta), G_f)
+        np.add(eta, 1, out=tmp)
+        np.divide(eta, tmp, out=G)
+        np.maximum(G, G_f, out=G)
+
+        # eta_2term = G**2 * gamma, the clean speech estimate of the next frame
+        np.square(G, out=tmp)
+        np.multiply(tmp, gamma, out=self.eta_2term)
+        return G
+
+    def get_eta(self):
+        return self.eta_2term
+
+class OmlsaGain(SuppressionGain, OmlsaParameters):
+    '''
+    OMLSA gain. All state and scratch arrays are allocated here and updated in
+    place, update returns the G array of the gain. With expint_table,
+    exp(0.5*E1(v)) comes from an ExpintTable instead of scipy's expn, a
+    table of that many intervals if it is an int.
+
+    With fast_path, frames whose frame-level speech presence P_frame is at
+    its floor P_min (noise_only) skip the local and global speech presence
+    and get G = G_f directly, which is what the full computation gives for
+    them. noise_only_frames counts them.
+
+    All arrays are of dtype, float64 or float32 (see NoiseSuppressor).
+
+    state_names lists the attributes that carry over between frames, see
+    pns.state.
+    '''
+    state_names = ('xi_frame', 'xi_m_dB', 'noise_only_frames', 'eta_2term', 'xi')
+
+    def __init__(self, sample_rate, fft_size, frame_size=None, expint_table=False, fast_path=False,
+                 dtype=np.float64):
+        OmlsaParameters.__init__(self, sample_rate, fft_size, frame_size)
+        M21 = self.M21
+        self.dtype = dtype = np.dtype(dtype)
+        # expn(1, v) runs its double loop, in float32 the order is a float32 to select the single one
+        self.expn_order = 1 if dtype == np.float64 else dtype.type(1)
+        if expint_table is True :
+            expint_table = ExpintTable()
+        elif expint_table and not isinstance(expint_table, ExpintTable) :
+            expint_table = ExpintTable(expint_table)
+        self.expint_table = expint_table or None
+        self.fast_path = fast_path
+        self.noise_only_frames = 0
+        self.smooth_local = Smoother(b_xi_local, dtype)
+        self.smooth_global = Smoother(self.b_xi_global, dtype)
+        self.eta_2term = np.ones(M21, dtype) 
+        self.xi = np.ones(M21, dtype) 
+        self.xi_frame = 0.0
+        self.xi_m_dB = 0.0
+
+        # scratch
+        self.gamma = np.zeros(M21, dtype)
+        self.eta = np.zeros(M21, dtype)
+        self.v = np.zeros(M21, dtype)
+        self.xi_local_dB = np.zeros(M21, dtype)
+        self.xi_global_dB = np.zeros(M21, dtype)
+        self.P_local = np.zeros(M21, dtype)
+        self.P_global = np.zeros(M21, dtype)
+        self.q = np.zeros(M21, dtype)
+        self.PH1 = np.zeros(M21, dtype)
+        self.GH1 = np.zeros(M21, dtype)
+        self.G = np.zeros(M21, dtype)
+        self.tmp = np.zeros(M21, dtype)
+        self.tmp2 = np.zeros(M21, dtype)
+        self.tmp3 = np.zeros(M21, dtype)
+        self.mask = np.zeros(M21, dtype=bool)
+        self.mask2 = np.zeros(M21, dtype=bool)
 
     def update(self, features):
-        Ya2 = features['signal_power']
-        lambda_d = features['noise_power']
+        Ya2 = features.signal_power
+        alpha_eta, alpha_xi = self.alpha_eta, self.alpha_xi
+        k_l, k_u, k2_local, k3_local = self.k_l, self.k_u, self.k2_local, self.k3_local
+        lambda_d = features.noise_power
+        gamma, eta, v, tmp, tmp2 = self.gamma, self.eta, self.v, self.tmp, self.tmp2
+        mask, mask2 = self.mask, self.mask2
         
-        gamma = Ya2 / np.maximum(lambda_d, 1e-10) #post_snr
-        eta = alpha_eta*self.eta_2term + (1-alpha_eta)*np.maximum(gamma-1,0)  #prior_snr
-        eta = np.maximum(eta,eta_min)  
-        v = gamma*eta/(1+eta)
+        # gamma = Ya2 / max(lambda_d, 1e-10), post_snr
+        np.maximum(lambda_d, 1e-10, out=tmp)
+        np.divide(Ya2, tmp, out=gamma)
+        # eta = alpha_eta*eta_2term + (1-alpha_eta)*max(gamma-1,0), prior_snr
+        np.subtract(gamma, 1, out=tmp)
+        np.maximum(tmp, 0, out=tmp)
+        np.multiply(tmp, 1-alpha_eta, out=tmp)
+        np.multiply(self.eta_2term, alpha_eta, out=eta)
+        np.add(eta, tmp, out=eta)
+        np.maximum(eta, eta_min, out=eta)
+        # v = gamma*eta/(1+eta)
+        np.multiply(gamma, eta, out=v)
+        np.add(eta, 1, out=tmp)
+        np.divide(v, tmp, out=v)
 
         # A Priori Probability for Signal-Absence Estimate
-        self.xi = alpha_xi * self.xi + (1-alpha_xi) * eta
-        xi_local = np.convolve(self.xi, b_xi_local)
-        xi_local = xi_local[w_xi_local:self.M21+w_xi_local]
-        xi_global = np.convolve(self.xi, b_xi_global)
-        xi_global = xi_global[w_xi_global:self.M21+w_xi_global]
+        np.multiply(self.xi, alpha_xi, out=self.xi)
+        np.multiply(eta, 1-alpha_xi, out=tmp)
+        np.add(self.xi, tmp, out=self.xi)
         dxi_frame = self.xi_frame
         self.xi_frame = np.mean(self.xi[k_l:k_u])
         dxi_frame = self.xi_frame - dxi_frame
 
-        xi_local_dB = np.zeros(len(xi_local))
-        xi_global_dB = np.zeros(len(xi_global))
-
-        for i in range(len(xi_local)) :
-            if xi_local[i] > 0 :
-                xi_local_dB[i] = 10*np.log10(xi_local[i])  
-            else : 
-                xi_local_dB[i] = -100 
-
-        for i in range(len(xi_global)) :
-            if xi_global[i] >0 : 
-                xi_global_dB[i] = 10*np.log10(xi_global[i]) 
-            else :
-                xi_global_dB[i] = -100
-
         if self.xi_frame >0 :
             xi_frame_dB = 10*np.log10(self.xi_frame) 
         else :
             xi_frame_dB = -100
 
-        P_local = np.ones(M21)
-        for idx in range(M21) :
-            if xi_local_dB[idx] <= xi_ll_dB:
-                P_local[idx] = P_min
-            if xi_local_dB[idx] > xi_ll_dB  and xi_local_dB[idx] < xi_lu_dB :
-                P_local[idx] = P_min + (xi_local_dB[idx]-xi_ll_dB) / (xi_lu_dB-xi_ll_dB) * (1-P_min)
-
-        P_global = np.ones(M21)
-        for idx in range(M21) :
-            if xi_global_dB[idx] <= xi_gl_dB:
-                P_global[idx] = P_min
-            if xi_global_dB[idx] >xi_gl_dB  and xi_global_dB[idx] <xi_gu_dB :
-                P_global[idx] = P_min + (xi_global_dB[idx]-xi_gl_dB)/(xi_gu_dB-xi_gl_dB)*(1-P_min)
-
-        m_P_local = np.mean(P_local[2:(k2_local+k3_local-3)])    # average probability of speech presence
-        if m_P_local < 0.25 :
-            P_local[k2_local:k3_local] = P_min    # reset P_local (frequency>500Hz) for low probability of speech presence
-
         if xi_frame_dB <= xi_fl_dB :
             P_frame = P_min
         elif dxi_frame >= 0 :
@@ -156,35 +300,88 @@ class OmlsaGain(SuppressionGain):
         else :
             P_frame = P_min+(xi_frame_dB-self.xi_m_dB-xi_fl_dB)/(xi_fu_dB-xi_fl_dB)*(1-P_min)
 
-        #     q=1-P_global.*P_local*P_frame   # new version
-        if broad_flag :  # new version
-            q = 1 - P_global * P_local * P_frame   # new version
-        else :  # new version
-            q = 1 - P_local * P_frame   ##ok<UNRCH> # new version
-
-        q = np.minimum(q, q_max)
-        gamma = np.zeros(M21)
-        gamma = Ya2 / np.maximum(lambda_d, 1e-10)
-        eta = alpha_eta * self.eta_2term + (1-alpha_eta) * np.maximum(gamma-1,0)
-        eta = np.maximum(eta, eta_min)
-        v = gamma*eta/(1+eta)
-        PH1 = np.zeros(M21)
-        idx = [i for i, v in enumerate(q) if v<0.9]
-        PH1[idx] = 1 / ( 1+q[idx] / (1-q[idx]) * (1+eta[idx]) * np.exp(-v[idx]) )
+        # With P_frame = P_min, q >= 1-P_min > 0.9 in every bin, so PH1 = 0 and
+        # G = G_f whatever P_local and P_global are: the fast path skips them.
+        # GH1 is still needed for eta_2term.
+        noise_only = self.fast_path and P_frame == P_min
+        PH1 = self.PH1
+        if noise_only :
+            self.noise_only_frames += 1
+            PH1.fill(0)
+        else :
+            xi_local = self.smooth_local(self.xi)
+            xi_global = self.smooth_global(self.xi)
+            xi_local_dB = to_dB(xi_local, self.xi_local_dB, mask)
+            xi_global_dB = to_dB(xi_global, self.xi_global_dB, mask)
+
+            P_local = presence_probability(xi_local_dB, xi_ll_dB, xi_lu_dB, self.P_local, mask)
+            P_global = presence_probability(xi_global_dB, xi_gl_dB, xi_gu_dB, self.P_global, mask)
 
-        # Spectral Gain
-        GH1 = np.ones(M21)
+            m_P_local = np.mean(P_local[2:(k2_local+k3_local-3)])    # average probability of speech presence
+            if m_P_local < 0.25 :
+                P_local[k2_local:k3_local] = P_min    # reset P_local (frequency>500Hz) for low probability of speech presence
+
+            #     q=1-P_global.*P_local*P_frame   # new version
+            q = self.q
+            if broad_flag :  # new version
+                np.multiply(P_global, P_local, out=q)   # new version
+                np.multiply(q, P_frame, out=q)
+            else :  # new version
+                np.multiply(P_local, P_frame, out=q)   ##ok<UNRCH> # new version
+            np.subtract(1, q, out=q)
+            np.minimum(q, q_max, out=q)
 
-        idx = [i for i, val in enumerate(v) if val>5 ]
-        GH1[idx] = eta[idx] / (1+eta[idx])
-        idx = [i for i, val in enumerate(v) if val<=5 and val>0]
-        GH1[idx] = eta[idx] / (1+eta[idx]) * np.exp(0.5 * expn(1, v[idx]))
+            # PH1 = 1 / (1+q/(1-q)*(1+eta)*exp(-v)) where q < 0.9, else 0
+            PH1.fill(0)
+            idx = np.less(q, 0.9, out=mask)
+            np.subtract(1, q, out=tmp, where=idx)
+            np.divide(q, tmp, out=tmp, where=idx)
+            np.add(eta, 1, out=tmp2, where=idx)
+            np.multiply(tmp, tmp2, out=tmp, where=idx)
+            np.negative(v, out=tmp2, where=idx)
+            np.exp(tmp2, out=tmp2, where=idx)
+            np.multiply(tmp, tmp2, out=tmp, where=idx)
+            np.add(tmp, 1, out=tmp, where=idx)
+            np.divide(1, tmp, out=PH1, where=idx)
+
+        # Spectral Gain
+        GH1 = self.GH1
+        GH1.fill(1)
+        eta_ratio = np.add(eta, 1, out=tmp)
+        np.divide(eta, eta_ratio, out=eta_ratio)
+        np.copyto(GH1, eta_ratio, where=np.greater(v, 5, out=mask))
+        # eta/(1+eta) * exp(0.5*E1(v)) where 0 < v <= 5
+        idx = np.less_equal(v, 5, out=mask)
+        np.logical_and(idx, np.greater(v, 0, out=mask2), out=idx)
+        if self.expint_table is None :
+            expn(self.expn_order, v, out=tmp2, where=idx)
+            np.multiply(tmp2, 0.5, out=tmp2, where=idx)
+            np.exp(tmp2, out=tmp2, where=idx)
+        else :
+            self.expint_table(v, tmp2, idx, self.tmp3)
+        np.multiply(eta_ratio, tmp2, out=GH1, where=idx)
 
         GH0 = G_f  
 
-        G = GH1**PH1 * GH0**(1 - PH1)
-        self.eta_2term = GH1**2 * gamma
+        # G = GH1**PH1 * GH0**(1 - PH1)
+        G = self.G
+        if noise_only :
+            G.fill(GH0)
+        else :
+            np.power(GH1, PH1, out=G)
+            np.subtract(1, PH1, out=tmp)
+            np.power(GH0, tmp, out=tmp)
+            np.multiply(G, tmp, out=G)
+        # eta_2term = GH1**2 * gamma
+        np.square(GH1, out=self.eta_2term)
+        np.multiply(self.eta_2term, gamma, out=self.eta_2term)
         return G
 
     def get_eta(self):
-        return self.eta_2term
\ No newline at end of file
+        return self.eta_2term
+
+# suppression gains by name, for NoiseSuppressor(suppression_gain=...)
+suppression_gains = {
+    'omlsa': OmlsaGain,
+    'wiener': WienerGain,
+}
@@ -0,0 +1,312 @@
+'''
+Frozen copy of the original per-bin IMCRA/OMLSA implementation.
+
+This module is not part of the library. It keeps the loop-based code the
+optimized pipeline in ``pns`` was derived from, so that equivalence tests and
+benchmarks have a fixed reference to compare against. Do not optimize it.
+'''
+import numpy as np
+from scipy.special import expn
+
+'''
+Constants
+'''
+M = 512
+Mo = 352
+Mno = M - Mo
+M21 = int(M/2+1)
+zero_thres = 1e-10
+
+w = 1
+alpha_s = 0.9
+Nwin = 8
+Vwin = 15
+delta_s = 1.67
+Bmin = 1.66
+delta_y = 4.6
+delta_yt = 3
+alpha_d = 0.85
+alpha_d_long = 0.99
+alpha_xi = 0.7
+alpha_eta = 0.95
+eta_min = 10**(-18/10)
+G_f = eta_min**0.5
+nonstat = 'medium'
+b = np.array([0, 1, 0])
+
+w_xi_local = 1
+w_xi_global = 15
+P_min = 0.005
+xi_lu_dB = -5
+xi_ll_dB = -10
+xi_gu_dB = -5
+xi_gl_dB = -10
+xi_fu_dB = -5
+xi_fl_dB = -10
+xi_mu_dB = 10
+xi_ml_dB = 0
+q_max = 0.998
+broad_flag = 1
+b_xi_local = np.array([0, 1, 0])
+b_xi_global = np.array([0, 0.000728, 0.002882, 0.006366, 0.011029, 0.016667, 0.023033, 0.029849, 0.036818, 0.043634, 0.050000, 0.055638, 0.060301, 0.063785, 0.065938, 0.066667, 0.065938, 0.063785, 0.060301, 0.055638, 0.050000, 0.043634, 0.036818, 0.029849, 0.023033, 0.016667, 0.011029, 0.006366, 0.002882, 0.000728, 0
+])
+k_u = min(round(10e3/16e3*M+1), M21)
+k_l = round(50/16e3*M+1)
+k2_local = round(500/16e3*M+1)
+k3_local = round(3500/16e3*M+1)
+
+
+class ReferenceImcraNoiseEstimator(object):
+    def __init__(self):
+        self.l = 0
+        self.l_mod_lswitch = 0
+        self.S = np.zeros(M21)
+        self.St = np.zeros(M21)
+        self.Sy = np.zeros(M21)
+        self.Smin = np.zeros(M21)
+        self.Smint = np.zeros(M21)
+        self.SMact = np.zeros(M21)
+        self.SMactt = np.zeros(M21)
+        self.SW = np.zeros((M21,Nwin))
+        self.SWt = np.zeros((M21,Nwin))
+        self.lambda_d = np.zeros(M21)
+        self.lambda_dav = np.zeros(M21)
+
+    def update(self, Ya2, eta_2term):
+        self.eta_2term = eta_2term
+
+        self.l = self.l + 1
+        gamma = Ya2 / np.maximum(self.lambda_d, 1e-10)
+        eta = alpha_eta*self.eta_2term + (1-alpha_eta)*np.maximum(gamma-1,0)
+        eta = np.maximum(eta,eta_min)
+        v = gamma*eta/(1+eta)
+
+        Sf = np.convolve(b, Ya2)
+        Sf = Sf[w:M21+w]
+        if self.l == 1 :
+            self.Sy = Ya2
+            self.S = Sf
+            self.St = Sf
+            self.lambda_dav = Ya2
+        else :
+            self.S = alpha_s * self.S + (1-alpha_s) * Sf
+
+        if self.l < 15 :
+            self.Smin = self.S
+            self.SMact = self.S
+        else :
+            self.Smin = np.minimum(self.Smin, self.S)
+            self.SMact = np.minimum(self.SMact, self.S)
+
+        I_f = np.zeros(M21)
+        for i in range(M21) :
+            I_f[i] = Ya2[i]<delta_y*Bmin*self.Smin[i] and self.S[i]<delta_s*Bmin*self.Smin[i] and 1
+        conv_I = np.convolve(b, I_f)
+        conv_I = conv_I[w:M21+w]
+        Sft = self.St
+        idx = [i for i, v in enumerate(conv_I) if v>0]
+        if len(idx)!=0 :
+            if w :
+                conv_Y = np.convolve(b, I_f*Ya2)
+                conv_Y = conv_Y[w:M21+w]
+                Sft[idx] = conv_Y[idx]/conv_I[idx]
+            else :
+                Sft[idx] = Ya2[idx]
+
+        if self.l < 15 :
+            self.St = self.S
+            self.Smint = self.St
+            self.SMactt = self.St
+        else :
+            self.St[:] = alpha_s * self.St + (1-alpha_s) * Sft
+            self.Smint[:] = np.minimum(self.Smint, self.St)
+            self.SMactt[:] = np.minimum(self.SMactt, self.St)
+
+        qhat = np.ones(M21)
+        phat = np.zeros(M21)
+
+        gamma_mint = Ya2/Bmin/np.maximum(self.Smint,1e-10)
+        zetat = self.S/Bmin/np.maximum(self.Smint,1e-10)
+
+        for idx in range(M21) :
+            if gamma_mint[idx]>1 and gamma_mint[idx]<delta_yt and zetat[idx]<delta_s :
+                qhat[idx] = (delta_yt-gamma_mint[idx])/(delta_yt-1)
+                phat[idx] = 1/(1+qhat[idx]/(1-qhat[idx])*(1+eta[idx])*np.exp(-v[idx]))
+            if gamma_mint[idx]>delta_yt  or  zetat[idx]>=delta_s :
+                phat[idx] = 1
+
+        self.l_mod_lswitch = self.l_mod_lswitch + 1
+        if self.l_mod_lswitch == Vwin :
+            self.l_mod_lswitch = 0
+
+            if self.l == Vwin :
+                for i in range(Nwin):
+                    self.SW[:,i] = self.S
+                    self.SWt[:, i] = self.St
+            else :
+                self.SW[:,:Nwin-1] = self.SW[:,1:Nwin]
+                self.SW[:,Nwin-1] = self.SMact
+                self.Smin = self.SW.min(1)
+                self.SMact = self.S
+                self.SWt[:,:Nwin-1] = self.SWt[:,1:Nwin]
+                self.SWt[:,Nwin-1] = self.SMactt
+                self.Smint = self.SWt.min(1)
+                self.SMactt = self.St
+
+        alpha_dt = alpha_d + (1-alpha_d)*phat
+        self.lambda_dav = alpha_dt * self.lambda_dav + (1-alpha_dt)*Ya2
+        if self.l < 15 :
+            self.lambda_dav_long = self.lambda_dav
+        else :
+            alpha_dt_long = alpha_d_long + (1-alpha_d_long)*phat
+            self.lambda_dav_long = alpha_dt_long * self.lambda_dav_long + (1-alpha_dt_long)*Ya2
+
+        self.lambda_d = 1.4685 * self.lambda_dav
+
+        return self.lambda_d
+
+
+class ReferenceOmlsaGain(object):
+    def __init__(self):
+        self.eta_2term = np.ones(M21)
+        self.xi = np.ones(M21)
+        self.xi_frame = 0
+        self.xi_m_dB = 0
+
+    def update(self, Ya2, lambda_d):
+        gamma = Ya2 / np.maximum(lambda_d, 1e-10)
+        eta = alpha_eta*self.eta_2term + (1-alpha_eta)*np.maximum(gamma-1,0)
+        eta = np.maximum(eta,eta_min)
+        v = gamma*eta/(1+eta)
+
+        self.xi = alpha_xi * self.xi + (1-alpha_xi) * eta
+        xi_local = np.convolve(self.xi, b_xi_local)
+        xi_local = xi_local[w_xi_local:M21+w_xi_local]
+        xi_global = np.convolve(self.xi, b_xi_global)
+        xi_global = xi_global[w_xi_global:M21+w_xi_global]
+        dxi_frame = self.xi_frame
+        self.xi_frame = np.mean(self.xi[k_l:k_u])
+        dxi_frame = self.xi_frame - dxi_frame
+
+        xi_local_dB = np.zeros(len(xi_local))
+        xi_global_dB = np.zeros(len(xi_global))
+
+        for i in range(len(xi_local)) :
+            if xi_local[i] > 0 :
+                xi_local_dB[i] = 10*np.log10(xi_local[i])
+            else :
+                xi_local_dB[i] = -100
+
+        for i in range(len(xi_global)) :
+            if xi_global[i] >0 :
+                xi_global_dB[i] = 10*np.log10(xi_global[i])
+            else :
+                xi_global_dB[i] = -100
+
+        if self.xi_frame >0 :
+            xi_frame_dB = 10*np.log10(self.xi_frame)
+        else :
+            xi_frame_dB = -100
+
+        P_local = np.ones(M21)
+        for idx in range(M21) :
+            if xi_local_dB[idx] <= xi_ll_dB:
+                P_local[idx] = P_min
+            if xi_local_dB[idx] > xi_ll_dB  and xi_local_dB[idx] < xi_lu_dB :
+                P_local[idx] = P_min + (xi_local_dB[idx]-xi_ll_dB) / (xi_lu_dB-xi_ll_dB) * (1-P_min)
+
+        P_global = np.ones(M21)
+        for idx in range(M21) :
+            if xi_global_dB[idx] <= xi_gl_dB:
+                P_global[idx] = P_min
+            if xi_global_dB[idx] >xi_gl_dB  and xi_global_dB[idx] <xi_gu_dB :
+                P_global[idx] = P_min + (xi_global_dB[idx]-xi_gl_dB)/(xi_gu_dB-xi_gl_dB)*(1-P_min)
+
+        m_P_local = np.mean(P_local[2:(k2_local+k3_local-3)])
+        if m_P_local < 0.25 :
+            P_local[k2_local:k3_local] = P_min
+
+        if xi_frame_dB <= xi_fl_dB :
+            P_frame = P_min
+        elif dxi_frame >= 0 :
+            self.xi_m_dB = min(max(xi_frame_dB,xi_ml_dB),xi_mu_dB)
+            P_frame = 1
+        elif xi_frame_dB >= self.xi_m_dB + xi_fu_dB :
+            P_frame = 1
+        elif xi_frame_dB <= self.xi_m_dB + xi_fl_dB :
+            P_frame = P_min
+        else :
+            P_frame = P_min+(xi_frame_dB-self.xi_m_dB-xi_fl_dB)/(xi_fu_dB-xi_fl_dB)*(1-P_min)
+
+        if broad_flag :
+            q = 1 - P_global * P_local * P_frame
+        else :
+            q = 1 - P_local * P_frame
+
+        q = np.minimum(q, q_max)
+        gamma = Ya2 / np.maximum(lambda_d, 1e-10)
+        eta = alpha_eta * self.eta_2term + (1-alpha_eta) * np.maximum(gamma-1,0)
+        eta = np.maximum(eta, eta_min)
+        v = gamma*eta/(1+eta)
+        PH1 = np.zeros(M21)
+        idx = [i for i, v in enumerate(q) if v<0.9]
+        PH1[idx] = 1 / ( 1+q[idx] / (1-q[idx]) * (1+eta[idx]) * np.exp(-v[idx]) )
+
+        GH1 = np.ones(M21)
+        idx = [i for i, val in enumerate(v) if val>5 ]
+        GH1[idx] = eta[idx] / (1+eta[idx])
+        idx = [i for i, val in enumerate(v) if val<=5 and val>0]
+        GH1[idx] = eta[idx] / (1+eta[idx]) * np.exp(0.5 * expn(1, v[idx]))
+
+        G = GH1**PH1 * G_f**(1 - PH1)
+        self.eta_2term = GH1**2 * gamma
+        return G
+
+
+class ReferenceSuppressor(object):
+    '''
+    The original 16 kHz NoiseSuppressor: 512-sample Hamming window, 160-sample
+    hop, full complex FFT and shifting input/output buffers.
+    '''
+    def __init__(self):
+        self.win = np.hamming(M)
+        self.in_buffer = np.zeros(M)
+        self.out_buffer = np.zeros(M)
+        self.noise_estimator = ReferenceImcraNoiseEstimator()
+        self.suppression_gain = ReferenceOmlsaGain()
+        self.fnz_flag = 0
+
+    def process_frame(self, frame_data):
+        self.in_buffer[:M-Mno] = self.in_buffer[Mno:M]
+        self.in_buffer[M-Mno:M] = frame_data
+        signal_spec = np.zeros(M)
+        signal_power = np.zeros(M21)
+        if ((self.fnz_flag==0 and abs(self.in_buffer[1])>zero_thres)) or \
+             (self.fnz_flag==1 and any(abs(self.in_buffer)>zero_thres)) :
+            self.fnz_flag = 1
+            signal_spec = np.fft.fft(self.win * self.in_buffer)
+            signal_power = abs(signal_spec[:M21])**2
+
+        yout = np.zeros(Mno)
+        if self.fnz_flag == 1 :
+            noise_power = self.noise_estimator.update(signal_power, self.suppression_gain.eta_2term)
+            gain = self.suppression_gain.update(signal_power, noise_power)
+            X = gain * signal_spec[:M21]
+            x = self.win *np.fft.irfft(X)
+            self.out_buffer = self.out_buffer + x
+            yout = self.out_buffer[:Mno] * 1.0
+            self.out_buffer[:M-Mno] = self.out_buffer[Mno:M]
+            self.out_buffer[M-Mno:M] = np.zeros(Mno)
+        return yout
+
+
+def reference_denoise(x):
+    '''Run the reference suppressor over x hop by hop, zero-padding the tail.'''
+    suppressor = ReferenceSuppressor()
+    n_frames = -(-len(x) // Mno)
+    padded = np.zeros(n_frames * Mno)
+    padded[:len(x)] = x
+    y = np.zeros(n_frames * Mno)
+    for k in range(0, len(padded), Mno):
+        y[k:k+Mno] = suppressor.process_frame(padded[k:k+Mno])
+    return y[:len(x)]
@@ -0,0 +1,69 @@
+import glob
+import tracemalloc
+import numpy as np
+import soundfile as sf
+from pns.noise_suppressor import NoiseSuppressor
+from pns.audio_file import denoise_file, denoise_to_file
+
+NOISY_FILES = sorted(glob.glob("data/*_sn*[0-9].wav"))
+
+
+def write_noisy(path, seconds, fs=16000, channels=1):
+    rng = np.random.default_rng(0)
+    x = np.concatenate([sf.read(input_file)[0] for input_file in NOISY_FILES])
+    x = np.resize(x, int(seconds * fs))[:, None] + 0.01 * rng.standard_normal((int(seconds * fs), channels))
+    sf.write(path, x, fs, subtype="DOUBLE")
+    return x
+
+
+def test_blocks_match_process_signal(tmp_path):
+    x = write_noisy(tmp_path / "in.wav", 12.345, channels=2)
+    peak = denoise_file(str(tmp_path / "in.wav"), str(tmp_path / "out.wav"), normalize=False, block_frames=7)
+    y, fs = sf.read(tmp_path / "out.wav")
+    expected = np.stack([NoiseSuppressor(fs).process_signal(x[:, channel]) for channel in range(2)], axis=1)
+    np.testing.assert_array_equal(y, expected)
+    np.testing.assert_array_equal(peak, np.max(np.abs(expected), axis=0))
+
+    denoise_file(str(tmp_path / "in.wav"), str(tmp_path / "normalized.wav"), block_frames=7)
+    y, fs = sf.read(tmp_path / "normalized.wav")
+    np.testing.assert_allclose(y, expected / (peak + 1e-10), rtol=0, atol=1e-15)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["in.wav", "normalized.wav", "out.wav"]
+
+
+def test_range_with_warmup(tmp_path):
+    x = write_noisy(tmp_path / "in.wav", 5)
+    denoise_to_file(str(tmp_path / "in.wav"), str(tmp_path / "out.wav"), start=32000, stop=64000,
+                    warmup_start=16000, block_frames=3)
+    y, fs = sf.read(tmp_path / "out.wav")
+    np.testing.assert_array_equal(y, NoiseSuppressor(fs).process_signal(x[16000:64000, 0])[16000:])
+
+
+def traced_peak(input_file, output_file):
+    tracemalloc.start()
+    denoise_file(input_file, output_file)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def test_memory_does_not_grow_with_duration(tmp_path):
+    write_noisy(tmp_path / "short.wav", 5)
+    write_noisy(tmp_path / "long.wav", 30)
+    short = traced_peak(str(tmp_path / "short.wav"), str(tmp_path / "short_out.wav"))
+    long = traced_peak(str(tmp_path / "long.wav"), str(tmp_path / "long_out.wav"))
+    # 25 s more of float64 output would be 25 * 16000 * 8 = 3.2 MB
+    assert long - short < 64 * 1024
+
+
+def test_float32_file_processing(tmp_path):
+    x = write_noisy(tmp_path / "in.wav", 3)
+    sf.write(tmp_path / "pcm16.wav", x, 16000, subtype="PCM_16")
+    peak = denoise_file(str(tmp_path / "pcm16.wav"), str(tmp_path / "out.wav"), dtype=np.float32)
+    assert peak.dtype == np.float64 and sf.info(str(tmp_path / "out.wav")).subtype == "PCM_16"
+    y = sf.read(tmp_path / "out.wav", dtype="float32")[0]
+    x32 = sf.read(tmp_path / "pcm16.wav", dtype="float32")[0]
+    expected = NoiseSuppressor(16000).process_signal(x32.astype(float))
+    expected /= np.max(np.abs(expected)) + 1e-10
+    # within the 16-bit quantization of the output
+    assert np.max(np.abs(y - expected)) < 2 / 32768
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["in.wav", "out.wav", "pcm16.wav"]
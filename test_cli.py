@@ -0,0 +1,86 @@
+import glob
+import os
+import shutil
+import numpy as np
+import soundfile as sf
+from pns.noise_suppressor import NoiseSuppressor
+from pns.cli import denoise_files, plan_units, main
+
+NOISY_FILES = sorted(glob.glob("data/*_sn*[0-9].wav"))
+
+
+def write_corpus_stereo(path):
+    x = np.concatenate([sf.read(input_file)[0] for input_file in NOISY_FILES])
+    x = np.stack([x, x[::-1]], axis=1)
+    sf.write(path, x, 16000, subtype="DOUBLE")
+    return x
+
+
+def test_plan_units_covers_signal():
+    units = plan_units(100000, 16000, unit_seconds=2, warmup_seconds=1)
+    assert units[0] == (0, 0, 31200)
+    assert all(stop == next_start for (_, _, stop), (_, next_start, _) in zip(units, units[1:]))
+    assert units[-1][2] == 100000
+    # boundaries and warm-ups are whole minimum search windows of 15 hops
+    assert all(start % 2400 == 0 and (start - warmup_start) % 2400 == 0 for warmup_start, start, _ in units)
+    assert plan_units(100000, 16000, unit_seconds=0) == [(0, 0, 100000)]
+    # MCRA restarts its minimum search every L = 100 hops
+    assert all(start % 16000 == 0 and (start - warmup_start) % 16000 == 0
+               for warmup_start, start, _ in plan_units(100000, 16000, 2, 1, noise_estimator="mcra"))
+
+
+def test_whole_channels_match_process_signal(tmp_path):
+    x = write_corpus_stereo(tmp_path / "long.wav")
+    results = denoise_files([str(tmp_path / "long.wav")], str(tmp_path / "out"), workers=2,
+                            unit_seconds=0, normalize=False)
+    assert results[0]["error"] is None and results[0]["rtf"] > 0
+    y, fs = sf.read(results[0]["output"])
+    for channel in range(2):
+        np.testing.assert_array_equal(y[:, channel], NoiseSuppressor(fs).process_signal(x[:, channel]))
+
+
+def test_work_units_are_assembled_in_order(tmp_path):
+    x = write_corpus_stereo(tmp_path / "long.wav")
+    results = denoise_files([str(tmp_path / "long.wav")], str(tmp_path / "out"), workers=2,
+                            unit_seconds=2, warmup_seconds=1, normalize=False)
+    y, fs = sf.read(results[0]["output"])
+    assert y.shape == x.shape and np.all(np.isfinite(y))
+    # the first unit has no warm-up and is exact, the later ones follow the
+    # whole-signal output up to the state left over from before the warm-up
+    first = plan_units(len(x), fs, unit_seconds=2, warmup_seconds=1)[0][2]
+    for channel in range(2):
+        expected = NoiseSuppressor(fs).process_signal(x[:, channel])
+        np.testing.assert_array_equal(y[:first, channel], expected[:first])
+        assert np.corrcoef(y[:, channel], expected)[0, 1] > 0.9
+
+
+def test_failed_files_are_reported(tmp_path, caplog):
+    bad_file = tmp_path / "bad.wav"
+    bad_file.write_bytes(b"not a wav file")
+    inputs = [NOISY_FILES[0], str(bad_file), str(tmp_path / "missing.wav"), NOISY_FILES[1]]
+    results = denoise_files(inputs, str(tmp_path / "out"), workers=2)
+    assert [result["error"] is None for result in results] == [True, False, False, True]
+    assert all(sf.info(result["output"]).frames == sf.info(result["input"]).frames
+               for result in results if result["error"] is None)
+    assert "bad.wav" in caplog.text and "missing.wav" in caplog.text
+
+    assert main(["denoise", NOISY_FILES[0], "-o", str(tmp_path / "cli"), "-j", "1"]) == 0
+    assert main(["denoise", str(bad_file), NOISY_FILES[0], "-o", str(tmp_path / "cli")]) == 1
+
+
+def test_conflicting_outputs_are_refused(tmp_path, caplog):
+    for directory in ["a", "b"]:
+        os.makedirs(tmp_path / directory)
+        shutil.copy(NOISY_FILES[0], tmp_path / directory)
+    name = os.path.basename(NOISY_FILES[0])
+    inputs = [str(tmp_path / "a" / name), str(tmp_path / "b" / name), NOISY_FILES[1]]
+    results = denoise_files(inputs, str(tmp_path / "out"), workers=1, unit_seconds=0)
+    assert [result["error"] is None for result in results] == [False, False, True]
+    assert os.listdir(tmp_path / "out") == [os.path.basename(NOISY_FILES[1])]
+    assert "shared by 2 inputs" in caplog.text
+
+    # -o at the directory of an input would replace it
+    before = (tmp_path / "a" / name).read_bytes()
+    results = denoise_files([inputs[0]], str(tmp_path / "a"), workers=1, unit_seconds=0)
+    assert "would overwrite an input" in results[0]["error"]
+    assert (tmp_path / "a" / name).read_bytes() == before
@@ -0,0 +1,373 @@
+import glob
+from math import gcd
+import numpy as np
+import soundfile as sf
+import pytest
+from scipy.signal import resample_poly
+from scipy.special import expn
+from pns.noise_suppressor import NoiseSuppressor
+from pns.noise_estimator import ImcraNoiseEstimator
+from pns.suppression_gain import OmlsaGain, Features, ExpintTable, b_xi_local, hanning_kernel
+from pns.smoothing import Smoother
+from pns.batch_suppressor import BatchNoiseSuppressor
+from pns_reference import ReferenceSuppressor, reference_denoise
+from bench_suite import BUNDLED_TOLERANCE
+
+NOISY_FILES = sorted(glob.glob("data/*_sn*[0-9].wav"))
+
+
+def denoise(x, fs=16000):
+    noise_suppressor = NoiseSuppressor(fs)
+    frame_size = noise_suppressor.get_frame_size()
+    n_frames = -(-len(x) // frame_size)
+    padded = np.zeros(n_frames * frame_size)
+    padded[:len(x)] = x
+    y = np.zeros(len(padded))
+    for k in range(0, len(padded), frame_size):
+        y[k : k + frame_size] = noise_suppressor.process_frame(padded[k : k + frame_size])
+    return y[:len(x)]
+
+
+def power_frames(x, fft_size=512, frame_size=160):
+    win = np.hamming(fft_size)
+    for k in range(0, len(x) - fft_size, frame_size):
+        yield np.abs(np.fft.fft(win * x[k : k + fft_size])[:fft_size // 2 + 1])**2
+
+
+@pytest.mark.parametrize("input_file", NOISY_FILES)
+def test_imcra_matches_reference(input_file):
+    noisy_wav, fs = sf.read(input_file)
+    reference = ReferenceSuppressor()
+    estimator = ImcraNoiseEstimator()
+
+    for Ya2 in power_frames(noisy_wav):
+        eta_2term = reference.suppression_gain.eta_2term
+        features = Features(signal_power=Ya2.copy(), eta_2term=eta_2term)
+        noise_power = estimator.update(features)
+        ref_noise_power = reference.noise_estimator.update(Ya2.copy(), eta_2term)
+        np.testing.assert_array_equal(noise_power, ref_noise_power)
+        reference.suppression_gain.update(Ya2, ref_noise_power)
+
+
+@pytest.mark.parametrize("input_file", NOISY_FILES)
+def test_omlsa_matches_reference(input_file):
+    noisy_wav, fs = sf.read(input_file)
+    reference = ReferenceSuppressor()
+    suppression_gain = OmlsaGain(fs, 512)
+
+    for Ya2 in power_frames(noisy_wav):
+        noise_power = reference.noise_estimator.update(Ya2.copy(), reference.suppression_gain.eta_2term)
+        features = Features(signal_power=Ya2, noise_power=noise_power)
+        gain = suppression_gain.update(features)
+        np.testing.assert_array_equal(gain, reference.suppression_gain.update(Ya2, noise_power))
+        np.testing.assert_array_equal(suppression_gain.get_eta(), reference.suppression_gain.eta_2term)
+
+
+@pytest.mark.parametrize("input_file", NOISY_FILES)
+def test_pipeline_matches_reference(input_file):
+    noisy_wav, fs = sf.read(input_file)
+    # the reference takes the first half of a complex FFT, NoiseSuppressor an rfft
+    np.testing.assert_allclose(denoise(noisy_wav, fs), reference_denoise(noisy_wav), rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("input_file", NOISY_FILES)
+def test_pipeline_matches_bundled_outputs(input_file):
+    noisy_wav, fs = sf.read(input_file)
+    processed_wav, _ = sf.read(input_file.replace(".wav", "_processed.wav"))
+
+    # the bundled outputs were written by the frame loop in test_pns.py,
+    # which stops before the last frame, and peak normalized to PCM_16
+    xfinal = denoise(noisy_wav, fs)
+    xfinal[(len(noisy_wav) - 1) // 160 * 160:] = 0
+    xfinal = xfinal / (np.max(np.abs(xfinal)) + 1e-10)
+    np.testing.assert_allclose(xfinal, processed_wav, rtol=0, atol=BUNDLED_TOLERANCE)
+
+
+def test_batch_matches_per_stream():
+    signals = [sf.read(input_file)[0] for input_file in NOISY_FILES]
+    batch = BatchNoiseSuppressor(16000, 2)
+    frame_size = batch.get_frame_size()
+    n_frames = max(len(x) for x in signals) // frame_size + 60
+
+    # streams 0 and 1 start together, stream 2 joins at frame 40, stream 0
+    # leaves at frame 150 and stream 3 takes its place at frame 170
+    schedule = {0: (0, 150), 1: (0, n_frames), 2: (40, n_frames), 3: (170, n_frames)}
+    ids, outputs = {}, {i: [] for i in schedule}
+    for k in range(n_frames):
+        for i, (start, stop) in schedule.items():
+            if k == start and i >= 2:
+                ids[i] = batch.add_stream()
+            elif k == start:
+                ids[i] = i
+            if k == stop:
+                batch.remove_stream(ids.pop(i))
+        frames = []
+        for i in ids:
+            x = signals[i][(k - schedule[i][0]) * frame_size:][:frame_size]
+            frames.append(np.pad(x, (0, frame_size - len(x))))
+        y = batch.process_frame(np.array(frames), streams=list(ids.values()))
+        for i, y_i in zip(ids, y):
+            outputs[i].append(y_i)
+
+    assert ids[3] == 0
+    for i, (start, stop) in schedule.items():
+        y = np.concatenate(outputs[i])
+        expected = denoise(np.pad(signals[i], (0, len(y))), 16000)[:len(y)]
+        np.testing.assert_array_equal(y, expected)
+
+
+@pytest.mark.parametrize("input_file", NOISY_FILES)
+def test_process_signal_matches_process_frame(input_file):
+    noisy_wav, fs = sf.read(input_file)
+    # leading zeros exercise the first non-zero frame gate
+    x = np.concatenate([np.zeros(1000), noisy_wav])
+    y = NoiseSuppressor(fs).process_signal(x)
+    assert len(y) == len(x)
+    np.testing.assert_allclose(y, denoise(x, fs), rtol=0, atol=1e-12)
+
+
+def test_process_signal_continues_state():
+    noisy_wav, fs = sf.read(NOISY_FILES[0])
+    noise_suppressor = NoiseSuppressor(fs)
+    split = 100 * noise_suppressor.get_frame_size()
+    y = np.concatenate([noise_suppressor.process_signal(noisy_wav[:split]),
+                        noise_suppressor.process_signal(noisy_wav[split:])])
+    np.testing.assert_allclose(y, denoise(noisy_wav, fs), rtol=0, atol=1e-12)
+
+
+def test_process_signal_split_calls():
+    noisy_wav, fs = sf.read(NOISY_FILES[0])
+    expected = NoiseSuppressor(fs).process_signal(noisy_wav)
+    noise_suppressor = NoiseSuppressor(fs)
+    # whole frames, then the rest with its partial last frame
+    y = np.concatenate([noise_suppressor.process_signal(noisy_wav[:960]),
+                        noise_suppressor.process_signal(noisy_wav[960:])])
+    np.testing.assert_array_equal(y, expected)
+
+    # a partial frame in the middle would put the padding inside the signal
+    noise_suppressor = NoiseSuppressor(fs)
+    noise_suppressor.process_signal(noisy_wav[:1000])
+    with pytest.raises(ValueError, match="zero padded frame"):
+        noise_suppressor.process_signal(noisy_wav[1000:])
+
+
+def test_process_signal_after_push():
+    noisy_wav, fs = sf.read(NOISY_FILES[0])
+    noise_suppressor = NoiseSuppressor(fs)
+    noise_suppressor.push(noisy_wav[:100])
+    with pytest.raises(ValueError, match="100 pushed samples are pending"):
+        noise_suppressor.process_signal(noisy_wav[100:])
+    # once the frame is complete, process_signal goes on in order
+    y = np.concatenate([noise_suppressor.push(noisy_wav[100:160]), noise_suppressor.process_signal(noisy_wav[160:])])
+    np.testing.assert_allclose(y, denoise(noisy_wav, fs), rtol=0, atol=1e-12)
+
+
+def random_chunks(x, seed=0):
+    rng = np.random.default_rng(seed)
+    k = 0
+    while k < len(x):
+        n = rng.choice([0, 1, 80, 160, 320, int(rng.integers(1, 1000))])
+        yield x[k : k + n]
+        k += n
+
+
+@pytest.mark.parametrize("input_file", NOISY_FILES)
+def test_push_matches_process_frame(input_file):
+    noisy_wav, fs = sf.read(input_file)
+    noise_suppressor = NoiseSuppressor(fs)
+    outputs = []
+    for chunk in random_chunks(noisy_wav):
+        outputs.append(noise_suppressor.push(chunk))
+        assert noise_suppressor.samples_in - noise_suppressor.samples_out == noise_suppressor.get_pending()
+    outputs.append(noise_suppressor.flush())
+    assert noise_suppressor.samples_out == noise_suppressor.samples_in == len(noisy_wav)
+    np.testing.assert_array_equal(np.concatenate(outputs), denoise(noisy_wav, fs))
+
+
+def test_process_stream_drains_delay():
+    noisy_wav, fs = sf.read(NOISY_FILES[0])
+    noise_suppressor = NoiseSuppressor(fs)
+    delay = noise_suppressor.get_delay()
+    y = np.concatenate(list(noise_suppressor.process_stream(random_chunks(noisy_wav, seed=1), drain=True)))
+    assert len(y) == len(noisy_wav) + delay
+    np.testing.assert_array_equal(y, denoise(np.pad(noisy_wav, (0, delay)), fs))
+
+    # the drained stream is finished
+    assert len(noise_suppressor.flush(drain=True)) == 0 and len(noise_suppressor.flush()) == 0
+    assert noise_suppressor.samples_out == len(noisy_wav) + delay
+    for process in [noise_suppressor.push, noise_suppressor.process_frame, noise_suppressor.process_signal]:
+        with pytest.raises(ValueError, match="drained"):
+            process(np.zeros(160))
+
+
+def denoise_aligned(x, fs):
+    noise_suppressor = NoiseSuppressor(fs)
+    delay = noise_suppressor.get_delay()
+    return noise_suppressor.process_signal(np.pad(x, (0, delay)))[delay:]
+
+
+@pytest.mark.parametrize("sample_rate, fft_size, frame_size",
+                         [(8000, 256, 80), (32000, 1024, 320), (44100, 1440, 441), (48000, 1536, 480)])
+@pytest.mark.parametrize("input_file", NOISY_FILES)
+def test_resampled_input_matches_16k(input_file, sample_rate, fft_size, frame_size):
+    noisy_wav, fs = sf.read(input_file)
+    up, down = sample_rate // gcd(sample_rate, fs), fs // gcd(sample_rate, fs)
+    noise_suppressor = NoiseSuppressor(sample_rate)
+    assert noise_suppressor.get_fft_size() == fft_size
+    assert noise_suppressor.get_frame_size() == frame_size
+
+    # the same 32 ms window, 10 ms hop and time constants at every rate, so
+    # the output brought back to 16 kHz follows the 16 kHz output
+    y = denoise_aligned(resample_poly(noisy_wav, up, down), sample_rate)
+    y = resample_poly(y, down, up)[:len(noisy_wav)]
+    expected = denoise_aligned(noisy_wav, fs)
+    if sample_rate < fs:
+        expected = resample_poly(resample_poly(expected, up, down), down, up)[:len(noisy_wav)]
+    snr = 10 * np.log10(np.sum(expected**2) / np.sum((y - expected)**2))
+    assert snr > 15
+
+
+def test_batch_matches_per_stream_at_48k():
+    signals = [resample_poly(sf.read(input_file)[0], 3, 1) for input_file in NOISY_FILES[:2]]
+    batch = BatchNoiseSuppressor(48000, 2)
+    frame_size = batch.get_frame_size()
+    n = min(len(x) for x in signals) // frame_size * frame_size
+    y = [batch.process_frame(np.array([x[k : k + frame_size] for x in signals]))
+         for k in range(0, n, frame_size)]
+    # the global smoothing of the a priori SNR convolves every row like the single stream
+    for i, x in enumerate(signals):
+        np.testing.assert_array_equal(np.concatenate([y_k[i] for y_k in y]), denoise(x[:n], 48000))
+
+
+def test_expint_table_error():
+    table = ExpintTable()
+    assert table.max_error < 1e-7
+    v = np.linspace(0, 5, 100001)[1:]
+    np.testing.assert_allclose(table(v), np.exp(0.5 * expn(1, v)), rtol=table.max_error, atol=0)
+
+
+@pytest.mark.parametrize("input_file", NOISY_FILES)
+def test_expint_table_gain_and_pesq(input_file):
+    pesq = pytest.importorskip("pesq").pesq
+    noisy_wav, fs = sf.read(input_file)
+    clean_wav, _ = sf.read(input_file.split("_")[0] + ".wav")
+    exact, table = NoiseSuppressor(fs), NoiseSuppressor(fs, expint_table=True)
+    frame_size = exact.get_frame_size()
+    outputs = {exact: [], table: []}
+    for k in range(0, len(noisy_wav) - frame_size + 1, frame_size):
+        for noise_suppressor, y in outputs.items():
+            y.append(noise_suppressor.process_frame(noisy_wav[k : k + frame_size]))
+        np.testing.assert_allclose(table.suppression_gain.G, exact.suppression_gain.G, rtol=1e-5, atol=0)
+
+    n = min(len(clean_wav), len(outputs[exact]) * frame_size)
+    scores = [pesq(fs, clean_wav[:n], np.concatenate(y)[:n], "wb") for y in outputs.values()]
+    assert abs(scores[1] - scores[0]) < 0.01
+
+
+@pytest.mark.parametrize("expint_table", [False, True])
+@pytest.mark.parametrize("input_file", NOISY_FILES)
+def test_numba_backend_matches_numpy(input_file, expint_table):
+    pytest.importorskip("numba")
+    noisy_wav, fs = sf.read(input_file)
+    x = np.concatenate([np.zeros(1000), noisy_wav])
+    numpy_ns = NoiseSuppressor(fs, expint_table, backend="numpy")
+    numba_ns = NoiseSuppressor(fs, expint_table, backend="numba")
+    frame_size = numpy_ns.get_frame_size()
+    for k in range(0, len(x) - frame_size + 1, frame_size):
+        y = numba_ns.process_frame(x[k : k + frame_size])
+        np.testing.assert_allclose(y, numpy_ns.process_frame(x[k : k + frame_size]), rtol=0, atol=1e-12)
+        # the compiled kernel sums the 31 tap xi smoothing in another order
+        np.testing.assert_allclose(numba_ns.suppression_gain.G, numpy_ns.suppression_gain.G, rtol=1e-9, atol=0)
+        np.testing.assert_allclose(numba_ns.noise_estimator.lambda_d, numpy_ns.noise_estimator.lambda_d,
+                                   rtol=1e-9, atol=0)
+    for name in ["l", "l_mod_lswitch", "smint_is_st"]:
+        assert getattr(numba_ns.noise_estimator, name) == getattr(numpy_ns.noise_estimator, name)
+
+    y = NoiseSuppressor(fs, expint_table, backend="numba").process_signal(x)
+    np.testing.assert_allclose(y, NoiseSuppressor(fs, expint_table).process_signal(x), rtol=0, atol=1e-12)
+
+
+def test_numba_backend_at_48k():
+    pytest.importorskip("numba")
+    x = resample_poly(sf.read(NOISY_FILES[0])[0], 3, 1)
+    np.testing.assert_allclose(NoiseSuppressor(48000, backend="numba").process_signal(x),
+                               NoiseSuppressor(48000).process_signal(x), rtol=0, atol=1e-12)
+    with pytest.raises(ValueError):
+        NoiseSuppressor(16000, backend="cuda")
+
+
+def with_silence(x, fs=16000):
+    '''x with leading zeros and a zero gap longer than the analysis window in the middle.'''
+    gap = len(x) // 2
+    return np.concatenate([np.zeros(1000), x[:gap], np.zeros(fs // 10), x[gap:]])
+
+
+@pytest.mark.parametrize("input_file", NOISY_FILES)
+def test_zero_gate_across_silence(input_file):
+    noisy_wav, fs = sf.read(input_file)
+    x = with_silence(noisy_wav, fs)
+    x = np.concatenate([x[:len(x) // 160 * 160], np.zeros(800)])
+    by_frame = NoiseSuppressor(fs)
+    y = np.concatenate([by_frame.process_frame(x[k : k + 160]) for k in range(0, len(x), 160)])
+    np.testing.assert_allclose(y, reference_denoise(x), rtol=0, atol=1e-12)
+    by_signal = NoiseSuppressor(fs)
+    half = len(x) // 320 * 160
+    np.testing.assert_array_equal(by_signal.process_signal(x[:half]), y[:half])
+    np.testing.assert_array_equal(by_signal.process_signal(x[half:]), y[half:])
+    # 800 trailing zeros: the last frame is all zeros again
+    assert by_frame.zero_age == by_signal.zero_age == 512
+
+
+@pytest.mark.parametrize("backend", ["numpy", "numba"])
+@pytest.mark.parametrize("input_file", NOISY_FILES)
+def test_fast_path_is_exact(input_file, backend):
+    if backend == "numba":
+        pytest.importorskip("numba")
+    noisy_wav, fs = sf.read(input_file)
+    x = with_silence(noisy_wav, fs)
+    fast = NoiseSuppressor(fs, backend=backend, fast_path=True)
+    y = fast.process_signal(x)
+    np.testing.assert_array_equal(y, NoiseSuppressor(fs, backend=backend).process_signal(x))
+    assert 0 < fast.suppression_gain.noise_only_frames < len(x) // 160
+
+    fast = NoiseSuppressor(fs, backend=backend, fast_path=True)
+    frame_size = fast.get_frame_size()
+    frames = [fast.process_frame(x[k : k + frame_size]) for k in range(0, len(x) - frame_size + 1, frame_size)]
+    np.testing.assert_array_equal(np.concatenate(frames), y[:len(frames) * frame_size])
+
+
+def test_smoother_matches_convolve():
+    rng = np.random.default_rng(0)
+    for kernel in [b_xi_local, hanning_kernel(15), hanning_kernel(45), np.array([0.25, 0.5, 0.25])]:
+        smoother = Smoother(kernel)
+        w = len(kernel) // 2
+        assert smoother.identity == (len(kernel) == 3 and kernel[1] == 1)
+        for n in [129, 257, 769]:
+            x = rng.exponential(size=n) * 10.0**rng.uniform(-10, 10, n)
+            x[rng.random(n) < 0.1] = 0
+            np.testing.assert_array_equal(smoother(x), np.convolve(x, kernel)[w : n + w])
+
+
+def test_minimum_ring_matches_reference_over_long_signal():
+    # many wraps of the Nwin sub-window ring: 4000 frames are 266 sub-windows
+    x = np.concatenate([sf.read(input_file)[0] for input_file in NOISY_FILES])
+    rng = np.random.default_rng(0)
+    x = np.concatenate([rng.uniform(0.1, 3) * x for _ in range(4)])[:4000 * 160 + 512]
+    reference = ReferenceSuppressor()
+    estimator = ImcraNoiseEstimator()
+    for Ya2 in power_frames(x):
+        eta_2term = reference.suppression_gain.eta_2term
+        noise_power = estimator.update(Features(signal_power=Ya2.copy(), eta_2term=eta_2term))
+        ref_noise_power = reference.noise_estimator.update(Ya2.copy(), eta_2term)
+        np.testing.assert_array_equal(estimator.Smin, reference.noise_estimator.Smin)
+        np.testing.assert_array_equal(estimator.Smint, reference.noise_estimator.Smint)
+        np.testing.assert_array_equal(noise_power, ref_noise_power)
+        reference.suppression_gain.update(Ya2, ref_noise_power)
+
+
+def test_fft_without_out_argument(monkeypatch):
+    # the path of NumPy < 2.0, whose np.fft has no out= argument
+    x = sf.read(NOISY_FILES[0])[0]
+    expected = denoise(x)
+    monkeypatch.setattr("pns.noise_suppressor.fft_out", False)
+    np.testing.assert_array_equal(denoise(x), expected)
@@ -0,0 +1,82 @@
+import glob
+import json
+import numpy as np
+import soundfile as sf
+import pytest
+from pns.noise_suppressor import NoiseSuppressor
+from pns.evaluation import evaluate, write_report, clean_file_of, ScoreCache, score_key
+from pns.cli import main
+
+pesq = pytest.importorskip("pesq").pesq
+
+NOISY_FILES = sorted(glob.glob("data/*_sn*[0-9].wav"))
+PAIRS = [(clean_file_of(noisy_file), noisy_file) for noisy_file in NOISY_FILES[:2]]
+CONFIGURATIONS = {"default": {}, "mcra": {"noise_estimator": "mcra"}}
+
+
+def without_cache_counts(report):
+    return {key: value for key, value in report.items() if key != "cache"}
+
+
+def test_report_matches_direct_pesq(tmp_path):
+    report = evaluate(CONFIGURATIONS, PAIRS, str(tmp_path / "cache"), workers=2, output_dir=str(tmp_path / "out"))
+    assert PAIRS[0][0] == "data/sp02.wav"
+    # 2 input and 4 output signals, narrow and wide band
+    assert report["cache"] == {"hits": 0, "misses": 12}
+    assert len(report["files"]) == 4
+    for row in report["files"]:
+        clean, fs = sf.read(row["clean"])
+        noisy, _ = sf.read(row["input"])
+        y = NoiseSuppressor(fs, **CONFIGURATIONS[row["configuration"]]).process_signal(noisy)
+        y = y / (np.max(np.abs(y)) + 1e-10)
+        n = min(len(clean), len(y))
+        assert row["error"] is None
+        assert row["input_pesq_wb"] == pesq(fs, clean[:n], noisy[:n], "wb")
+        assert row["pesq_nb"] == pesq(fs, clean[:n], y[:n], "nb")
+        assert row["delta_wb"] == row["pesq_wb"] - row["input_pesq_wb"]
+        written, _ = sf.read(tmp_path / "out" / row["configuration"] / row["input"].split("/")[-1])
+        np.testing.assert_allclose(written, y, rtol=0, atol=1 / 32768)
+    summary = report["configurations"]["mcra"]
+    assert summary["options"] == {"noise_estimator": "mcra"} and summary["files"] == 2 and summary["errors"] == 0
+    assert summary["pesq_wb"] == pytest.approx(np.mean([row["pesq_wb"] for row in report["files"]
+                                                        if row["configuration"] == "mcra"]))
+
+    # a second run scores nothing, a new configuration only its own outputs
+    again = evaluate(CONFIGURATIONS, PAIRS, str(tmp_path / "cache"), workers=2)
+    assert again["cache"] == {"hits": 12, "misses": 0}
+    assert without_cache_counts(again) == without_cache_counts(report)
+    wider = evaluate({**CONFIGURATIONS, "wiener": {"suppression_gain": "wiener"}}, PAIRS, str(tmp_path / "cache"))
+    assert wider["cache"] == {"hits": 12, "misses": 4}
+
+    write_report(report, str(tmp_path / "report.json"))
+    with open(tmp_path / "report.json") as f:
+        assert json.load(f) == report
+
+
+def test_cache_keys_and_errors(tmp_path):
+    x = np.random.default_rng(0).standard_normal(16000)
+    assert score_key(x, x, 16000, "wb") != score_key(x, x, 16000, "nb")
+    assert score_key(x, x, 16000, "wb") != score_key(x, x[::-1], 16000, "wb")
+    assert score_key(x, x, 16000, "wb") != score_key(x, x, 8000, "wb")
+    cache = ScoreCache(str(tmp_path))
+    key = score_key(x, x, 16000, "wb")
+    assert cache.get(key) is None
+    cache.put(key, 4.5)
+    assert cache.get(key) == 4.5 and (cache.hits, cache.misses) == (1, 1)
+
+    report = evaluate({"default": {}, "broken": {"backend": "cuda"}}, PAIRS[:1], str(tmp_path), workers=1)
+    errors = {row["configuration"]: row["error"] for row in report["files"]}
+    assert errors["default"] is None and "cuda" in errors["broken"]
+    assert report["configurations"]["broken"]["errors"] == 1
+    assert report["configurations"]["broken"]["pesq_wb"] is None
+
+
+def test_cli(tmp_path):
+    with open(tmp_path / "sweep.json", "w") as f:
+        json.dump({"wiener": {"suppression_gain": "wiener"}}, f)
+    assert main(["evaluate", NOISY_FILES[0], "--configs", str(tmp_path / "sweep.json"), "--cache-dir",
+                 str(tmp_path / "cache"), "--report", str(tmp_path / "report.json"), "-j", "1"]) == 0
+    with open(tmp_path / "report.json") as f:
+        report = json.load(f)
+    assert [row["configuration"] for row in report["files"]] == ["wiener"]
+    assert report["files"][0]["clean"] == "data/sp02.wav"
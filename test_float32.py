@@ -0,0 +1,72 @@
+import glob
+import numpy as np
+import soundfile as sf
+import pytest
+from pns.noise_suppressor import NoiseSuppressor
+from pns.noise_estimator import noise_estimators
+from pns.suppression_gain import suppression_gains
+
+NOISY_FILES = sorted(glob.glob("data/*_sn*[0-9].wav"))
+COMBINATIONS = [(estimator, gain) for estimator in noise_estimators for gain in suppression_gains]
+
+
+def snr_dB(expected, y):
+    return 10 * np.log10(np.sum(expected**2) / np.sum((y - expected)**2))
+
+
+@pytest.mark.parametrize("noise_estimator, suppression_gain", COMBINATIONS)
+@pytest.mark.parametrize("input_file", NOISY_FILES)
+def test_float32_follows_float64(input_file, noise_estimator, suppression_gain):
+    x = sf.read(input_file, dtype="float32")[0]
+    options = dict(noise_estimator=noise_estimator, suppression_gain=suppression_gain)
+    expected = NoiseSuppressor(16000, **options).process_signal(x.astype(float))
+    by_signal = NoiseSuppressor(16000, dtype=np.float32, **options)
+    y = by_signal.process_signal(x)
+    assert y.dtype == np.float32
+    # the recursions do not accumulate the rounding of float32
+    assert snr_dB(expected, y) > 100
+    assert np.max(np.abs(y - expected)) < 1e-5
+
+    by_frame = NoiseSuppressor(16000, dtype=np.float32, **options)
+    n = len(x) // 160 * 160
+    yout = np.empty(160, np.float32)
+    y_frames = np.concatenate([by_frame.process_frame(x[k : k + 160], out=yout).copy() for k in range(0, n, 160)])
+    np.testing.assert_allclose(y_frames, y[:n], rtol=0, atol=1e-6)
+
+
+def test_float32_state_is_single_precision():
+    noise_suppressor = NoiseSuppressor(16000, dtype=np.float32, fast_path=True, expint_table=True)
+    x = sf.read(NOISY_FILES[0], dtype="float32")[0]
+    noise_suppressor.process_signal(x[:len(x) // 160 * 160])
+    for part in [noise_suppressor, noise_suppressor.noise_estimator, noise_suppressor.suppression_gain]:
+        for name in part.state_names:
+            value = getattr(part, name)
+            if isinstance(value, np.ndarray):
+                assert value.dtype == np.float32, name
+
+    # get_state stays a float64 vector, restored by a float32 suppressor only
+    x = sf.read(NOISY_FILES[1], dtype="float32")[0][:16000]
+    restored = NoiseSuppressor(16000, dtype=np.float32, fast_path=True, expint_table=True)
+    restored.set_state(noise_suppressor.get_state())
+    np.testing.assert_array_equal(restored.process_signal(x), noise_suppressor.process_signal(x))
+    with pytest.raises(ValueError, match="32 bit"):
+        NoiseSuppressor(16000).set_state(noise_suppressor.get_state())
+
+
+def test_float32_pesq():
+    pesq = pytest.importorskip("pesq").pesq
+    for input_file in NOISY_FILES:
+        x, fs = sf.read(input_file, dtype="float32")
+        clean = sf.read(input_file.split("_")[0] + ".wav")[0]
+        y64 = NoiseSuppressor(fs).process_signal(x.astype(float))
+        y32 = NoiseSuppressor(fs, dtype=np.float32).process_signal(x).astype(float)
+        n = min(len(clean), len(x))
+        assert abs(pesq(fs, clean[:n], y32[:n], "wb") - pesq(fs, clean[:n], y64[:n], "wb")) < 0.01
+
+
+def test_float32_configurations():
+    with pytest.raises(ValueError, match="float64"):
+        NoiseSuppressor(16000, dtype=np.float16)
+    with pytest.raises(ValueError, match="float64"):
+        NoiseSuppressor(16000, dtype=np.float32, backend="numba")
+    assert NoiseSuppressor(16000, dtype=np.float32, backend="auto").backend == "numpy"
@@ -0,0 +1,62 @@
+import glob
+import numpy as np
+import soundfile as sf
+from pns.noise_suppressor import NoiseSuppressor
+from pns.instrumentation import Stats, STAGES
+
+NOISY_FILES = sorted(glob.glob("data/*_sn*[0-9].wav"))
+
+
+def frame_loop(noise_suppressor, x):
+    frame_size = noise_suppressor.get_frame_size()
+    return np.concatenate([noise_suppressor.process_frame(x[k : k + frame_size])
+                           for k in range(0, len(x) - frame_size + 1, frame_size)])
+
+
+def test_stats_do_not_change_output():
+    noisy_wav, fs = sf.read(NOISY_FILES[0])
+    x = np.concatenate([np.zeros(1000), noisy_wav])
+    instrumented = NoiseSuppressor(fs)
+    instrumented.enable_stats()
+    np.testing.assert_array_equal(frame_loop(instrumented, x), frame_loop(NoiseSuppressor(fs), x))
+    instrumented = NoiseSuppressor(fs)
+    instrumented.enable_stats()
+    np.testing.assert_array_equal(instrumented.process_signal(x), NoiseSuppressor(fs).process_signal(x))
+
+
+def test_frame_and_signal_counters_agree():
+    noisy_wav, fs = sf.read(NOISY_FILES[1])
+    x = np.concatenate([np.zeros(1000), noisy_wav])
+    calls = []
+    by_frame = Stats(callback=calls.append, interval=50)
+    noise_suppressor = NoiseSuppressor(fs)
+    noise_suppressor.enable_stats(by_frame)
+    frame_loop(noise_suppressor, x)
+    noise_suppressor = NoiseSuppressor(fs)
+    by_signal = noise_suppressor.enable_stats()
+    noise_suppressor.process_signal(x[:len(x) // 160 * 160])
+
+    # the gate opens when sample 1 of the 512 sample window is past the leading zeros
+    assert by_frame.skipped_frames == by_signal.skipped_frames == (1000 + 511) // 160
+    assert by_frame.frames == by_signal.frames == len(x) // 160
+    assert by_frame.speech_frames == by_signal.speech_frames
+    assert 0 < by_frame.speech_presence_ratio() < 1
+    np.testing.assert_allclose(by_frame.mean_gain(), by_signal.mean_gain(), rtol=1e-12)
+    np.testing.assert_allclose(by_frame.mean_speech_presence(), by_signal.mean_speech_presence(), rtol=1e-12)
+    assert len(calls) == by_frame.frames // 50 and calls[0] is by_frame
+
+    for stats in (by_frame, by_signal):
+        snapshot = stats.snapshot()
+        assert all(snapshot["time"][stage] > 0 for stage in STAGES)
+        assert sum(snapshot["histogram"]["gain"]) == stats.frames - stats.skipped_frames
+    assert sum(by_frame.histogram["stft_analyze"]) == by_frame.frames
+
+
+def test_disable_stats_restores_plain_path():
+    noise_suppressor = NoiseSuppressor(16000)
+    stats = noise_suppressor.enable_stats()
+    noise_suppressor.process_frame(np.ones(160))
+    noise_suppressor.disable_stats()
+    assert "_process_frame" not in vars(noise_suppressor) and noise_suppressor.stats is None
+    noise_suppressor.process_frame(np.ones(160))
+    assert stats.frames == 1
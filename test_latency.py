@@ -0,0 +1,71 @@
+import glob
+import numpy as np
+import soundfile as sf
+import pytest
+from pns.noise_suppressor import NoiseSuppressor, stft_sizes, latency_presets
+
+NOISY_FILES = sorted(glob.glob("data/*_sn*[0-9].wav"))
+
+
+def preset_suppressor(name, fs=16000, **kwargs):
+    fft_size, frame_size = stft_sizes(fs, *latency_presets[name])
+    return NoiseSuppressor(fs, fft_size=fft_size, frame_size=frame_size, **kwargs)
+
+
+def overlap_add_gain(noise_suppressor):
+    '''Mean of the overlap-added products of analysis and synthesis windows.'''
+    return np.sum(noise_suppressor.win * noise_suppressor.synthesis_win) / noise_suppressor.get_frame_size()
+
+
+@pytest.mark.parametrize("name, fft_size, frame_size, latency",
+                         [("default", 512, 160, 0.032), ("low_latency", 256, 80, 0.016),
+                          ("ultra_low_latency", 128, 40, 0.008)])
+def test_presets_frame_and_signal_paths_agree(name, fft_size, frame_size, latency):
+    noisy_wav, fs = sf.read(NOISY_FILES[0])
+    x = np.concatenate([np.zeros(1000), noisy_wav])
+    x = x[:len(x) // frame_size * frame_size]
+    by_frame = preset_suppressor(name, fs)
+    assert (by_frame.get_fft_size(), by_frame.get_frame_size()) == (fft_size, frame_size)
+    assert by_frame.get_latency() == pytest.approx(latency)
+    y = np.concatenate([by_frame.process_frame(x[k : k + frame_size]) for k in range(0, len(x), frame_size)])
+    np.testing.assert_array_equal(preset_suppressor(name, fs).process_signal(x), y)
+    assert overlap_add_gain(by_frame) == pytest.approx(overlap_add_gain(NoiseSuppressor(fs)))
+
+    restored = preset_suppressor(name, fs)
+    restored.set_state(by_frame.get_state())
+    np.testing.assert_array_equal(restored.process_signal(x[:8000]), by_frame.process_signal(x[:8000]))
+
+
+@pytest.mark.parametrize("name", latency_presets)
+def test_presets_numba_backend_matches_numpy(name):
+    pytest.importorskip("numba")
+    x = sf.read(NOISY_FILES[1])[0]
+    np.testing.assert_allclose(preset_suppressor(name, backend="numba").process_signal(x),
+                               preset_suppressor(name).process_signal(x), rtol=0, atol=1e-12)
+
+
+def test_explicit_default_configuration_is_unchanged():
+    x = sf.read(NOISY_FILES[0])[0]
+    noise_suppressor = NoiseSuppressor(16000, fft_size=512, frame_size=160, window="hamming")
+    assert noise_suppressor.synthesis_win is noise_suppressor.win
+    np.testing.assert_array_equal(noise_suppressor.process_signal(x), NoiseSuppressor(16000).process_signal(x))
+
+
+def test_window_types():
+    x = sf.read(NOISY_FILES[0])[0]
+    y = NoiseSuppressor(16000).process_signal(x)
+    for window in ["hann", ("kaiser", 8), np.hanning(512)]:
+        noise_suppressor = NoiseSuppressor(16000, window=window)
+        z = noise_suppressor.process_signal(x)
+        assert overlap_add_gain(noise_suppressor) == pytest.approx(overlap_add_gain(NoiseSuppressor(16000)))
+        # the same gains through a slightly different window
+        assert 10 * np.log10(np.sum(y**2) / np.sum((z - y)**2)) > 10
+
+
+def test_invalid_sizes():
+    with pytest.raises(ValueError, match="half"):
+        NoiseSuppressor(16000, fft_size=256, frame_size=160)
+    with pytest.raises(ValueError, match="half"):
+        NoiseSuppressor(16000, frame_size=0)
+    with pytest.raises(ValueError, match="window"):
+        NoiseSuppressor(16000, fft_size=256, frame_size=80, window=np.hamming(512))
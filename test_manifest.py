@@ -0,0 +1,132 @@
+import glob
+import logging
+import os
+import shutil
+import pytest
+import soundfile as sf
+import pns.cli
+import pns.manifest
+import pns.numba_backend
+from pns.manifest import Manifest, replace_atomically
+from pns.cli import denoise_files, main
+from pns.spectral_processor import resolve_backend
+
+NOISY_FILES = sorted(glob.glob("data/*_sn*[0-9].wav"))
+
+
+def copy_inputs(tmp_path, n=2):
+    os.makedirs(tmp_path / "in")
+    return [shutil.copy(input_file, tmp_path / "in") for input_file in NOISY_FILES[:n]]
+
+
+def run(inputs, tmp_path, **options):
+    manifest = Manifest(str(tmp_path / "manifest.json"))
+    return denoise_files(inputs, str(tmp_path / "out"), workers=1, unit_seconds=0, manifest=manifest, **options)
+
+
+def test_second_run_skips_current_outputs(tmp_path):
+    inputs = copy_inputs(tmp_path)
+    assert [result["skipped"] for result in run(inputs, tmp_path)] == [False, False]
+    outputs = {name: os.stat(tmp_path / "out" / name).st_mtime_ns for name in os.listdir(tmp_path / "out")}
+    results = run(inputs, tmp_path)
+    assert [result["skipped"] for result in results] == [True, True]
+    assert all(result["error"] is None for result in results)
+    assert outputs == {name: os.stat(tmp_path / "out" / name).st_mtime_ns for name in os.listdir(tmp_path / "out")}
+
+
+def test_changes_are_reprocessed(tmp_path):
+    inputs = copy_inputs(tmp_path, 3)
+    run(inputs, tmp_path)
+    # new content under the same name, a corrupted output and a missing one
+    x, fs = sf.read(inputs[0])
+    sf.write(inputs[0], x[::-1], fs)
+    with open(tmp_path / "out" / os.path.basename(inputs[1]), "r+b") as f:
+        f.seek(100)
+        f.write(b"\0\1")
+    os.remove(tmp_path / "out" / os.path.basename(inputs[2]))
+    assert [result["skipped"] for result in run(inputs, tmp_path)] == [False, False, False]
+    assert [result["skipped"] for result in run(inputs, tmp_path)] == [True, True, True]
+
+    # the options and the library version are part of the key
+    assert not any(result["skipped"] for result in run(inputs, tmp_path, normalize=False))
+    assert not any(result["skipped"] for result in run(inputs, tmp_path))
+    with pytest.MonkeyPatch.context() as m:
+        m.setattr(pns.manifest, "__version__", "0.0.0")
+        assert not any(result["skipped"] for result in run(inputs, tmp_path))
+
+
+def test_auto_backend_is_keyed_resolved(tmp_path, monkeypatch):
+    inputs = copy_inputs(tmp_path, 1)
+    run(inputs, tmp_path, backend="auto")
+    assert [result["skipped"] for result in run(inputs, tmp_path, backend=resolve_backend("auto"))] == [True]
+    # the same option runs another backend once numba is installed or removed
+    monkeypatch.setattr(pns.numba_backend, "available", not pns.numba_backend.available)
+    assert [result["skipped"] for result in run(inputs, tmp_path, backend="auto")] == [False]
+
+
+def test_interrupted_run_resumes(tmp_path, monkeypatch):
+    inputs = copy_inputs(tmp_path, 3)
+    copy_scaled = pns.cli.copy_scaled
+
+    def fail_on_last(parts, output_file, *args, **kwargs):
+        copy_scaled(parts, output_file, *args, **kwargs)
+        if os.path.basename(inputs[2]) in output_file:
+            raise KeyboardInterrupt
+    monkeypatch.setattr(pns.cli, "copy_scaled", fail_on_last)
+    with pytest.raises(KeyboardInterrupt):
+        run(inputs, tmp_path)
+    # the output being written was not left behind, complete or partial
+    assert sorted(os.listdir(tmp_path / "out")) == sorted(os.path.basename(f) for f in inputs[:2])
+    monkeypatch.undo()
+
+    assert [result["skipped"] for result in run(inputs, tmp_path)] == [True, True, False]
+    assert sorted(os.listdir(tmp_path / "out")) == sorted(os.path.basename(f) for f in inputs)
+
+
+def test_unreadable_manifest_starts_afresh(tmp_path, caplog):
+    path = tmp_path / "manifest.json"
+    path.write_text("{not json")
+    assert Manifest(str(path)).entries == {}
+    assert "manifest" in caplog.text
+    inputs = copy_inputs(tmp_path, 1)
+    assert [result["skipped"] for result in run(inputs, tmp_path)] == [False]
+    assert Manifest(str(path)).entries[str(tmp_path / "out" / os.path.basename(inputs[0]))]["version"] \
+        == pns.__version__
+
+
+def test_replace_atomically_keeps_old_file_on_failure(tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_text("old")
+
+    def write(tmp):
+        with open(tmp, "w") as f:
+            f.write("partial")
+        raise OSError("disk full")
+    with pytest.raises(OSError):
+        replace_atomically(str(path), write)
+    assert path.read_text() == "old" and os.listdir(tmp_path) == ["file.txt"]
+
+
+def test_outputs_get_default_permissions(tmp_path):
+    umask = os.umask(0o022)
+    try:
+        inputs = copy_inputs(tmp_path, 1)
+        run(inputs, tmp_path)
+        output_file = tmp_path / "out" / os.path.basename(inputs[0])
+        assert os.stat(output_file).st_mode & 0o777 == 0o644
+        assert os.stat(tmp_path / "manifest.json").st_mode & 0o777 == 0o644
+        # a replaced file keeps its permissions
+        os.chmod(output_file, 0o640)
+        replace_atomically(str(output_file), lambda tmp: shutil.copy(inputs[0], tmp))
+        assert os.stat(output_file).st_mode & 0o777 == 0o640
+    finally:
+        os.umask(umask)
+
+
+def test_cli_manifest(tmp_path, caplog):
+    caplog.set_level(logging.INFO)
+    inputs = copy_inputs(tmp_path, 1)
+    command = inputs + ["-o", str(tmp_path / "out"), "-j", "1", "--manifest", str(tmp_path / "manifest.json")]
+    assert main(["denoise"] + command) == 0
+    assert main(["denoise"] + command) == 0
+    assert "0 files denoised, 1 up to date" in caplog.text
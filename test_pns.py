@@ -1,8 +1,8 @@
 import os
-import numpy as np
 import soundfile as sf
-from pesq import pesq
-from pns.noise_suppressor import NoiseSuppressor
+from pns.audio_file import denoise_file
+from pns.manifest import Manifest
+from pns.evaluation import evaluate, write_report
 import logging
 
 # Setup logging
@@ -19,102 +19,54 @@ def test():
                    "data/sp04_babble_sn10.wav", 
                    "data/sp06_babble_sn5.wav", 
                    "data/sp09_babble_sn10.wav"]
-    output_files = [os.path.join(EXPORT_DIR, "sp02_train_sn5_processed.wav"), 
-                    os.path.join(EXPORT_DIR, "sp04_babble_sn10_processed.wav"),
-                    os.path.join(EXPORT_DIR, "sp06_babble_sn5_processed.wav"), 
-                    os.path.join(EXPORT_DIR, "sp09_babble_sn10_processed.wav")]
 
-    for i in range(len(input_files)):
-        clean_file = clean_files[i]
-        input_file = input_files[i]
-        output_file = output_files[i]
+    # Denoise in worker processes, save the results to export/default/ and
+    # score them; the input PESQ comes from the cache after the first run
+    report = evaluate({"default": {}}, list(zip(clean_files, input_files)), output_dir=EXPORT_DIR)
 
-        try:
-            clean_wav, _  = sf.read(clean_file)
-            noisy_wav, fs = sf.read(input_file)
-        except FileNotFoundError as e:
-            logging.error(f"File not found: {e}")
-            continue
-        except Exception as e:
-            logging.error(f"Error reading files: {e}")
+    # Performance Metrics
+    for row in report["files"]:
+        logging.info(f"Processing completed for {row['input']}")
+        if row["error"] is not None:
+            logging.error(f"Error calculating PESQ: {row['error']}")
             continue
-
-        # Initialize
-        noise_suppressor = NoiseSuppressor(fs)
-        frame_size = noise_suppressor.get_frame_size()
-        xfinal = np.zeros(len(noisy_wav))
-
-        # Start Processing
-        k = 0
-        while k + frame_size < len(noisy_wav):
-            frame = noisy_wav[k : k + frame_size]
-            xfinal[k : k + frame_size] = noise_suppressor.process_frame(frame)
-            k += frame_size
-
-        # Save Results
-        xfinal = xfinal / (np.max(np.abs(xfinal)) + 1e-10)
-        sf.write(output_file, xfinal, fs)
-
-        # Performance Metrics
-        logging.info(f"Processing completed for {input_file}")
-        try:
-            pesq_nb = pesq(ref=clean_wav, deg=noisy_wav, fs=fs, mode='nb')
-            logging.info(f"Input PESQ (NB): {pesq_nb:.4f}")
-            pesq_nb = pesq(ref=clean_wav, deg=xfinal, fs=fs, mode='nb')
-            logging.info(f"Output PESQ (NB): {pesq_nb:.4f}")
-
-            if fs > 8000:
-                pesq_wb = pesq(ref=clean_wav, deg=noisy_wav, fs=fs, mode='wb')
-                logging.info(f"Input PESQ (WB): {pesq_wb:.4f}")
-                pesq_wb = pesq(ref=clean_wav, deg=xfinal, fs=fs, mode='wb')
-                logging.info(f"Output PESQ (WB): {pesq_wb:.4f}")
-        except Exception as e:
-            logging.error(f"Error calculating PESQ: {e}")
-
-def denoise_all_files(input_files, output_files):
+        logging.info(f"Input PESQ (NB): {row['input_pesq_nb']:.4f}")
+        logging.info(f"Output PESQ (NB): {row['pesq_nb']:.4f}")
+        if "pesq_wb" in row:
+            logging.info(f"Input PESQ (WB): {row['input_pesq_wb']:.4f}")
+            logging.info(f"Output PESQ (WB): {row['pesq_wb']:.4f}")
+    logging.info(f"PESQ cache: {report['cache']['hits']} hits, {report['cache']['misses']} misses")
+    write_report(report, os.path.join(EXPORT_DIR, "report.json"))
+
+def denoise_all_files(input_files, output_files, manifest_file=os.path.join(EXPORT_DIR, "manifest.json")):
+    # outputs recorded in the manifest for the same input, denoise_file
+    # options and version are skipped, so an interrupted run resumes where
+    # it stopped
+    manifest = Manifest(manifest_file)
+    options = dict(normalize=True, backend="numpy", noise_estimator="imcra", suppression_gain="omlsa",
+                   dtype="float64")
     for input_file, output_file in zip(input_files, output_files):
         try:
-            noisy_wav, fs = sf.read(input_file)
-        except FileNotFoundError:
-            logging.error(f"File not found: {input_file}")
-            continue
+            info = sf.info(input_file)
+            if manifest.is_current(input_file, output_file, options):
+                logging.info(f"Output file up to date: {output_file}")
+                continue
+            key = manifest.job_key(input_file, options)
         except Exception as e:
             logging.error(f"Error reading file {input_file}: {e}")
             continue
 
-        channels = noisy_wav.shape[1] if noisy_wav.ndim > 1 else 1
         logging.info(f"Input file: {input_file}")
-        logging.info(f"Sample rate: {fs} Hz")
-        logging.info(f"Number of channels: {channels}")
-
-        if channels > 1:
-            xfinal = np.zeros_like(noisy_wav)
-
-            for ch in range(channels):
-                noise_suppressor = NoiseSuppressor(fs)
-                frame_size = noise_suppressor.get_frame_size()
-
-                k = 0
-                while k + frame_size < len(noisy_wav):
-                    frame = noisy_wav[k : k + frame_size, ch]
-                    xfinal[k : k + frame_size, ch] = noise_suppressor.process_frame(frame)
-                    k += frame_size
+        logging.info(f"Sample rate: {info.samplerate} Hz")
+        logging.info(f"Number of channels: {info.channels}")
 
-                xfinal[:, ch] = xfinal[:, ch] / (np.max(np.abs(xfinal[:, ch])) + 1e-10)
-        else:
-            noise_suppressor = NoiseSuppressor(fs)
-            frame_size = noise_suppressor.get_frame_size()
-            xfinal = np.zeros(len(noisy_wav))
-
-            k = 0
-            while k + frame_size < len(noisy_wav):
-                frame = noisy_wav[k : k + frame_size]
-                xfinal[k : k + frame_size] = noise_suppressor.process_frame(frame)
-                k += frame_size
-
-            xfinal = xfinal / (np.max(np.abs(xfinal)) + 1e-10)
-
-        sf.write(output_file, xfinal, fs)
+        # read, denoise and write in blocks, then peak normalize every channel
+        try:
+            denoise_file(input_file, output_file, **options)
+            manifest.record(input_file, output_file, options, key)
+        except Exception as e:
+            logging.error(f"Error processing file {input_file}: {e}")
+            continue
         logging.info(f"Output file saved: {output_file}")
 
 if __name__ == "__main__":
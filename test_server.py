@@ -0,0 +1,150 @@
+import asyncio
+import glob
+import numpy as np
+import soundfile as sf
+from pns.noise_suppressor import NoiseSuppressor
+from pns.server import Server, send_samples, read_samples, HEADER
+
+NOISY_FILES = sorted(glob.glob("data/*_sn*[0-9].wav"))
+
+
+async def client(port, x, chunk, read=True):
+    '''Send x in chunks, concurrently read the output, return it.'''
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+    async def produce():
+        for k in range(0, len(x), chunk):
+            await send_samples(writer, x[k : k + chunk])
+        await send_samples(writer, None)
+
+    producer = asyncio.create_task(produce())
+    if not read:
+        # let the server fill up before reading
+        await asyncio.sleep(0.5)
+    outputs = []
+    while (y := await read_samples(reader)) is not None:
+        outputs.append(y)
+    await producer
+    writer.close()
+    return np.concatenate(outputs)
+
+
+def expected(x):
+    return NoiseSuppressor(16000).process_signal(x.astype(float))
+
+
+def run(server, *clients):
+    async def main():
+        port = await server.start()
+        try:
+            return await asyncio.gather(*[client(port, *args) for args in clients])
+        finally:
+            await server.close()
+    return asyncio.run(main())
+
+
+def test_sessions_match_process_signal():
+    signals = [sf.read(input_file)[0].astype(np.float32) for input_file in NOISY_FILES]
+    server = Server()
+    outputs = run(server, *[(x, chunk) for x, chunk in zip(signals, [37, 160, 1000, 4999])])
+    for x, y in zip(signals, outputs):
+        assert len(y) == len(x)
+        np.testing.assert_allclose(y, expected(x), rtol=0, atol=1e-7)
+
+    metrics = server.metrics()
+    assert metrics["sessions"] == 0 and len(metrics["finished"]) == len(signals)
+    # frames of several sessions go through one executor call
+    assert metrics["frames_per_batch"] > 1
+    for session in metrics["finished"]:
+        assert session["samples_out"] == session["samples_in"]
+        assert 0 < session["latency_p50"] <= session["latency_p99"] <= session["latency_max"]
+
+
+def test_backpressure_bounds_backlog():
+    x = np.resize(sf.read(NOISY_FILES[0])[0], 16000 * 5).astype(np.float32)
+    server = Server(max_pending_frames=20)
+    y, = run(server, (x, 1600, False))
+    np.testing.assert_allclose(y, expected(x), rtol=0, atol=1e-7)
+    session = server.metrics()["finished"][0]
+    assert session["backpressure"] > 0
+
+
+def test_disconnect_leaves_other_sessions_intact():
+    x = sf.read(NOISY_FILES[1])[0].astype(np.float32)
+
+    async def main():
+        server = Server()
+        port = await server.start()
+        # a client that leaves without ending its stream
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        await send_samples(writer, x[:8000])
+        await read_samples(reader)
+        writer.close()
+        y = await client(port, x, 480)
+        await asyncio.sleep(0.01)
+        await server.close()
+        return server, y
+
+    server, y = asyncio.run(main())
+    np.testing.assert_allclose(y, expected(x), rtol=0, atol=1e-7)
+    assert server.metrics()["sessions"] == 0 and len(server.batch.get_streams()) == 0
+
+
+def test_failed_batch_ends_its_sessions_only(caplog):
+    x = sf.read(NOISY_FILES[2])[0].astype(np.float32)
+
+    async def main():
+        server = Server()
+        process = server._process
+        calls = []
+
+        def fail_once(rounds):
+            calls.append(len(rounds))
+            if len(calls) == 1:
+                raise RuntimeError("injected failure")
+            return process(rounds)
+        server._process = fail_once
+        port = await server.start()
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        await send_samples(writer, x[:8000])
+        # the connection is aborted instead of answered
+        assert await asyncio.wait_for(read_samples(reader), 5) is None
+        writer.close()
+        # the scheduler survived and serves new sessions
+        y = await asyncio.wait_for(client(port, x, 480), 30)
+        await asyncio.sleep(0.01)
+        await server.close()
+        return server, y
+
+    server, y = asyncio.run(main())
+    np.testing.assert_allclose(y, expected(x), rtol=0, atol=1e-7)
+    metrics = server.metrics()
+    assert metrics["failed_batches"] == 1 and metrics["sessions"] == 0
+    assert metrics["finished"][0]["samples_out"] == 0
+    assert "injected failure" in caplog.text
+
+
+def test_malformed_message_ends_its_session(caplog):
+    x = sf.read(NOISY_FILES[0])[0].astype(np.float32)
+
+    async def main():
+        server = Server()
+        port = await server.start()
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        await send_samples(writer, x[:8000])
+        # a payload that is not a whole number of float32 samples
+        writer.write(HEADER.pack(6) + b"\0" * 6)
+        await writer.drain()
+        while await asyncio.wait_for(read_samples(reader), 5) is not None:
+            pass
+        writer.close()
+        y = await asyncio.wait_for(client(port, x, 480), 30)
+        await asyncio.sleep(0.01)
+        await server.close()
+        return server, y
+
+    server, y = asyncio.run(main())
+    np.testing.assert_allclose(y, expected(x), rtol=0, atol=1e-7)
+    metrics = server.metrics()
+    assert metrics["sessions"] == 0 and len(metrics["finished"]) == 2
+    assert "6 bytes" in caplog.text
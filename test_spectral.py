@@ -0,0 +1,128 @@
+import glob
+import numpy as np
+import soundfile as sf
+import pytest
+from pns.noise_suppressor import NoiseSuppressor
+from pns.spectral_processor import SpectralProcessor
+from pns.instrumentation import Stats
+from pns.noise_estimator import NoiseEstimator
+from pns_reference import ReferenceSuppressor
+
+NOISY_FILES = sorted(glob.glob("data/*_sn*[0-9].wav"))
+
+
+def power_block(x, fft_size=512, frame_size=160):
+    frames = np.lib.stride_tricks.sliding_window_view(x, fft_size)[::frame_size]
+    return np.abs(np.fft.rfft(np.hamming(fft_size) * frames))**2
+
+
+@pytest.mark.parametrize("input_file", NOISY_FILES)
+def test_block_matches_reference(input_file):
+    power = power_block(sf.read(input_file)[0])
+    processor = SpectralProcessor(16000, 512, 160)
+    noise_power = np.empty(power.shape)
+    speech_presence = np.empty(power.shape)
+    gain = processor.process(power, noise_power=noise_power, speech_presence=speech_presence)
+
+    reference = ReferenceSuppressor()
+    by_frame = SpectralProcessor(16000, 512, 160)
+    for i, Ya2 in enumerate(power):
+        ref_noise_power = reference.noise_estimator.update(Ya2.copy(), reference.suppression_gain.eta_2term)
+        np.testing.assert_array_equal(noise_power[i], ref_noise_power)
+        np.testing.assert_array_equal(gain[i], reference.suppression_gain.update(Ya2, ref_noise_power))
+        np.testing.assert_array_equal(by_frame.process(Ya2), gain[i])
+        np.testing.assert_array_equal(by_frame.get_speech_presence(), speech_presence[i])
+    assert 0 < np.mean(speech_presence) < 1
+
+
+def test_inputs_are_not_copied():
+    power = power_block(sf.read(NOISY_FILES[0])[0])
+    processor = SpectralProcessor(16000, 512, 160)
+    frame = power[0]
+    gain = processor.process(frame)
+    assert processor.features.signal_power is frame
+    assert gain is processor.suppression_gain.G
+    out = np.empty(power[1:].shape)
+    assert processor.process(power[1:], out) is out
+    assert np.shares_memory(processor.features.signal_power, power)
+    assert processor.get_noise_power() is processor.noise_estimator.lambda_d
+
+
+@pytest.mark.parametrize("expint_table", [False, True])
+def test_numba_block_matches_numpy(expint_table):
+    pytest.importorskip("numba")
+    power = power_block(sf.read(NOISY_FILES[1])[0])
+    expected = SpectralProcessor(16000, 512, 160, expint_table).process(power)
+    np.testing.assert_allclose(SpectralProcessor(16000, 512, 160, expint_table, "numba").process(power),
+                               expected, rtol=0, atol=1e-12)
+    # the per-frame outputs run the kernel frame by frame
+    processor = SpectralProcessor(16000, 512, 160, expint_table, "numba")
+    noise_power = np.empty(power.shape)
+    gain = processor.process(power, noise_power=noise_power)
+    np.testing.assert_allclose(gain, expected, rtol=0, atol=1e-12)
+    np.testing.assert_array_equal(noise_power[-1], processor.get_noise_power())
+
+
+def test_noise_suppressor_wraps_processor():
+    x = sf.read(NOISY_FILES[2])[0]
+    noise_suppressor = NoiseSuppressor(16000)
+    noise_suppressor.process_signal(x)
+    assert noise_suppressor.noise_estimator is noise_suppressor.processor.noise_estimator
+
+    # the first non-zero frame gate skips the 3 frames whose second sample is padding
+    padded = np.concatenate([np.zeros(352), x, np.zeros(-(len(x)) % 160)])
+    processor = SpectralProcessor(16000, 512, 160)
+    processor.process(power_block(padded)[3:])
+    np.testing.assert_allclose(processor.get_noise_power(), noise_suppressor.processor.get_noise_power(),
+                               rtol=1e-12, atol=0)
+    np.testing.assert_allclose(processor.suppression_gain.G, noise_suppressor.suppression_gain.G,
+                               rtol=1e-12, atol=0)
+
+
+def test_invalid_inputs():
+    processor = SpectralProcessor(16000, 512, 160)
+    with pytest.raises(ValueError, match="257"):
+        processor.process(np.ones(256))
+    with pytest.raises(ValueError, match="257"):
+        processor.process(np.ones((2, 2, 257)))
+    float32 = SpectralProcessor(16000, 512, 160, dtype=np.float32)
+    assert float32.process(np.ones(257)).dtype == np.float32
+
+
+@pytest.mark.parametrize("backend", ["numpy", "numba"])
+def test_stats_leave_gain_unchanged(backend):
+    if backend == "numba":
+        pytest.importorskip("numba")
+    power = power_block(sf.read(NOISY_FILES[3])[0])
+    expected = SpectralProcessor(16000, 512, 160, backend=backend).process(power)
+    stats = Stats()
+    processor = SpectralProcessor(16000, 512, 160, backend=backend)
+    np.testing.assert_array_equal(processor.process(power[:10], stats=stats), expected[:10])
+    np.testing.assert_array_equal(processor.process(power[10], stats=stats), expected[10])
+    np.testing.assert_array_equal(processor.process(power[11:], stats=stats), expected[11:])
+    assert stats.frames == len(power) and stats.skipped_frames == 0
+    assert stats.time["noise_estimation"] > 0
+
+
+class MinimumNoiseEstimator(NoiseEstimator):
+    # custom stage without a speech presence probability
+    def __init__(self, sample_rate, fft_size, frame_size):
+        self.noise_power = None
+
+    def update(self, features):
+        if self.noise_power is None:
+            self.noise_power = features.signal_power.copy()
+        np.minimum(self.noise_power, features.signal_power, out=self.noise_power)
+        return self.noise_power
+
+
+def test_stats_without_speech_presence():
+    power = power_block(sf.read(NOISY_FILES[3])[0])
+    processor = SpectralProcessor(16000, 512, 160, noise_estimator=MinimumNoiseEstimator,
+                                  suppression_gain="wiener")
+    assert processor.get_speech_presence() is None
+    stats = Stats()
+    processor.process(power[:10], stats=stats)
+    processor.process(power[10], stats=stats)
+    assert stats.frames == 11 and stats.mean_gain() > 0
+    assert stats.speech_presence_sum == 0 and stats.speech_frames == 0
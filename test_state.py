@@ -0,0 +1,67 @@
+import glob
+import numpy as np
+import soundfile as sf
+import pytest
+from pns.noise_suppressor import NoiseSuppressor
+
+NOISY_FILES = sorted(glob.glob("data/*_sn*[0-9].wav"))
+
+
+@pytest.mark.parametrize("backend", ["numpy", "numba"])
+@pytest.mark.parametrize("input_file", NOISY_FILES)
+def test_restore_continues_bit_identical(input_file, backend):
+    if backend == "numba":
+        pytest.importorskip("numba")
+    noisy_wav, fs = sf.read(input_file)
+    x = np.concatenate([np.zeros(1000), noisy_wav])
+    # whole frames, so that nothing is pending before process_signal
+    x = x[:len(x) // 160 * 160]
+    original = NoiseSuppressor(fs, backend=backend)
+    # stop mid-frame so that the pending samples are part of the state
+    split = len(x) // 2 + 37
+    original.push(x[:split])
+    blob = original.get_state().tobytes()
+
+    restored = NoiseSuppressor(fs, backend=backend)
+    restored.set_state(blob)
+    np.testing.assert_array_equal(restored.get_state(), original.get_state())
+    np.testing.assert_array_equal(restored.push(x[split:]), original.push(x[split:]))
+    np.testing.assert_array_equal(restored.process_signal(x[:4000]), original.process_signal(x[:4000]))
+    np.testing.assert_array_equal(restored.flush(drain=True), original.flush(drain=True))
+
+
+def test_warm_start_from_noise_profile():
+    noisy_wav, fs = sf.read(NOISY_FILES[0])
+    profile = NoiseSuppressor(fs)
+    profile.process_signal(noisy_wav)
+    state = profile.get_state()
+
+    warm = NoiseSuppressor(fs)
+    warm.set_state(state, buffers=False)
+    assert warm.samples_in == 0 and not warm.in_buffer.any()
+    np.testing.assert_array_equal(warm.noise_estimator.lambda_d, profile.noise_estimator.lambda_d)
+    assert warm.noise_estimator.l == profile.noise_estimator.l
+
+    # the noise estimate of a warm start is already converged on the first frames
+    cold = NoiseSuppressor(fs)
+    for noise_suppressor in [warm, cold]:
+        noise_suppressor.process_signal(noisy_wav[:1600])
+    target = np.log(profile.noise_estimator.lambda_d + 1e-10)
+    error = [np.mean(np.abs(np.log(noise_suppressor.noise_estimator.lambda_d + 1e-10) - target))
+             for noise_suppressor in [warm, cold]]
+    assert error[0] < error[1] / 2
+
+
+def test_rejects_foreign_state():
+    state = NoiseSuppressor(16000).get_state()
+    with pytest.raises(ValueError, match="Hz"):
+        NoiseSuppressor(48000).set_state(state)
+    with pytest.raises(ValueError, match="version"):
+        NoiseSuppressor(16000).set_state(np.concatenate([[99], state[1:]]))
+    # the header identifies the noise estimator, the gain and the window
+    for options in [dict(noise_estimator="mcra"), dict(suppression_gain="wiener"), dict(window="hann")]:
+        other = NoiseSuppressor(16000, **options)
+        with pytest.raises(ValueError, match="noise estimator, gain or window"):
+            other.set_state(state)
+    with pytest.raises(ValueError, match="elements"):
+        NoiseSuppressor(16000).set_state(state[:-1])
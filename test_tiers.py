@@ -0,0 +1,79 @@
+import glob
+import numpy as np
+import soundfile as sf
+import pytest
+from pns.noise_suppressor import NoiseSuppressor
+from pns.noise_estimator import McraNoiseEstimator, noise_estimators
+from pns.suppression_gain import WienerGain, Features, G_f, eta_min, suppression_gains
+
+NOISY_FILES = sorted(glob.glob("data/*_sn*[0-9].wav"))
+COMBINATIONS = [(estimator, gain) for estimator in noise_estimators for gain in suppression_gains]
+
+
+@pytest.mark.parametrize("noise_estimator, suppression_gain", COMBINATIONS)
+def test_combinations_frame_and_signal_paths_agree(noise_estimator, suppression_gain):
+    noisy_wav, fs = sf.read(NOISY_FILES[0])
+    x = np.concatenate([np.zeros(1000), noisy_wav])
+    x = x[:len(x) // 160 * 160]
+    by_frame = NoiseSuppressor(fs, noise_estimator=noise_estimator, suppression_gain=suppression_gain)
+    y = np.concatenate([by_frame.process_frame(x[k : k + 160]) for k in range(0, len(x), 160)])
+    by_signal = NoiseSuppressor(fs, noise_estimator=noise_estimator, suppression_gain=suppression_gain)
+    stats = by_signal.enable_stats()
+    np.testing.assert_array_equal(by_signal.process_signal(x), y)
+    assert 0 < stats.mean_speech_presence() < 1
+
+    restored = NoiseSuppressor(fs, noise_estimator=noise_estimator, suppression_gain=suppression_gain)
+    restored.set_state(by_frame.get_state())
+    np.testing.assert_array_equal(restored.process_signal(x[:8000]), by_frame.process_signal(x[:8000]))
+
+
+@pytest.mark.parametrize("noise_estimator, suppression_gain", COMBINATIONS)
+def test_combinations_improve_pesq(noise_estimator, suppression_gain):
+    pesq = pytest.importorskip("pesq").pesq
+    gains = []
+    for input_file in NOISY_FILES:
+        noisy_wav, fs = sf.read(input_file)
+        clean_wav, _ = sf.read(input_file.split("_")[0] + ".wav")
+        y = NoiseSuppressor(fs, noise_estimator=noise_estimator,
+                            suppression_gain=suppression_gain).process_signal(noisy_wav)
+        n = min(len(clean_wav), len(y))
+        gains.append(pesq(fs, clean_wav[:n], y[:n], "wb") - pesq(fs, clean_wav[:n], noisy_wav[:n], "wb"))
+    assert np.mean(gains) > 0.1
+
+
+def test_wiener_gain_is_decision_directed():
+    gain = WienerGain(16000, 512, 160)
+    rng = np.random.default_rng(0)
+    noise_power = rng.uniform(0.5, 2, 257)
+    signal_power = noise_power * rng.uniform(0, 20, 257)
+    eta_2term = gain.get_eta().copy()
+    G = gain.update(Features(signal_power=signal_power, noise_power=noise_power, eta_2term=eta_2term)).copy()
+
+    gamma = signal_power / noise_power
+    eta = np.maximum(gain.alpha_eta * eta_2term + (1 - gain.alpha_eta) * np.maximum(gamma - 1, 0), eta_min)
+    np.testing.assert_allclose(G, np.maximum(eta / (1 + eta), G_f), rtol=1e-14)
+    np.testing.assert_allclose(gain.get_eta(), G**2 * gamma, rtol=1e-14)
+
+
+def test_mcra_tracks_stationary_noise():
+    estimator = McraNoiseEstimator(16000, 512, 160)
+    rng = np.random.default_rng(0)
+    noise_power = np.linspace(1, 4, 257)
+    for _ in range(500):
+        # periodogram of complex Gaussian noise: exponential around noise_power
+        features = Features(signal_power=noise_power * rng.exponential(size=257))
+        lambda_d = estimator.update(features)
+    assert np.median(np.abs(lambda_d / noise_power - 1)) < 0.2
+    assert np.mean(estimator.phat) < 0.2
+
+
+def test_invalid_configurations():
+    with pytest.raises(ValueError, match="noise estimator"):
+        NoiseSuppressor(16000, noise_estimator="histogram")
+    with pytest.raises(ValueError, match="suppression gain"):
+        NoiseSuppressor(16000, suppression_gain="spectral_subtraction")
+    with pytest.raises(ValueError, match="OMLSA"):
+        NoiseSuppressor(16000, suppression_gain="wiener", fast_path=True)
+    with pytest.raises(ValueError, match="numba"):
+        NoiseSuppressor(16000, backend="numba", noise_estimator="mcra")
+    assert NoiseSuppressor(16000, backend="auto", noise_estimator="mcra").backend == "numpy"